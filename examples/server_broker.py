@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# vim: fileencoding=utf-8 et ts=4 sts=4 sw=4 tw=0 fdm=marker fmr=#{,#}
+
+""" A simple RPC server that shows how to expose several services
+    on a single endpoint with a broker:
+
+    * the broker routes requests by procedure name/namespace
+    * a request goes only to a worker with free capacity
+    * workers can live in any process and come and go
+
+    A client needs only one connection:
+
+        client.connect('tcp://127.0.0.1:5555')
+        client.echo('Hi there')
+        client.math.add(1, 2)
+"""
+
+#-----------------------------------------------------------------------------
+#  Copyright (C) 2012-2014. Brian Granger, Min Ragan-Kelley, Alexander Glyzov
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file LICENSE distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+from time import sleep
+
+from netcall.broker    import Broker, BrokerWorker
+from netcall.threading import ThreadingRPCService
+
+
+class Math(object):
+
+    def add(self, a, b):
+        print "add %r %r" % (a, b)
+        return a+b
+
+    def subtract(self, a, b):
+        print "subtract %r %r" % (a, b)
+        return a-b
+
+
+if __name__ == '__main__':
+    broker = Broker()
+    broker.bind_frontend('tcp://127.0.0.1:5555')
+    broker.bind_backend('ipc:///tmp/rpc-demo-broker.workers')
+    broker.start()
+
+    echo = ThreadingRPCService()
+
+    @echo.task(name='echo')
+    def echo_echo(s):
+        print "echo %r" % s
+        return s
+
+    @echo.task(name='sleep')
+    def echo_sleep(t):
+        sleep(t)
+        return t
+
+    # the worker announces 'echo' and 'sleep'
+    BrokerWorker(echo, 'ipc:///tmp/rpc-demo-broker.workers').start()
+    echo.start()
+
+    # two services serving the 'math' namespace share the load
+    for _ in range(2):
+        math = ThreadingRPCService()
+        math.register_object(Math(), namespace='math')
+        BrokerWorker(math, 'ipc:///tmp/rpc-demo-broker.workers', namespaces=['math']).start()
+        math.start()
+
+    broker.serve()
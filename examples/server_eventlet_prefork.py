@@ -5,7 +5,7 @@
 A simple RPC server that shows how to:
 
 * start several worker processes
-* use zmq proxy device to load balance requests to the workers
+* use a native zmq proxy device to load balance requests to the workers
 * make each worker to serve multiple RPC services asynchronously
   using Eventlet cooperative multitasking
 
@@ -18,14 +18,14 @@ A simple RPC server that shows how to:
 #  the file LICENSE, distributed as part of this software.
 #-----------------------------------------------------------------------------
 
-from eventlet import sleep as green_sleep, spawn
+from eventlet import sleep as green_sleep
 
 from os              import getpid
 from multiprocessing import Process, cpu_count
 
-from zmq           import ROUTER, DEALER
-from netcall.green import GreenRPCService, JSONSerializer
-from netcall.utils import get_zmq_classes, green_device
+from netcall.green   import GreenRPCService, JSONSerializer
+from netcall.utils   import get_zmq_classes
+from netcall.devices import ProxyDevice
 
 
 class EchoService(GreenRPCService):
@@ -106,27 +106,24 @@ if __name__ == '__main__':
     Context, _ = get_zmq_classes(env='eventlet')
     context = Context()
 
-    echo_inp  = context.socket(ROUTER)
-    math1_inp = context.socket(ROUTER)
-    math2_inp = context.socket(ROUTER)
+    # the devices shuttle messages in native threads (zmq.proxy in C)
+    # so they do not compete with the greenlets for the GIL
+    echo_proxy  = ProxyDevice(context=context)
+    math1_proxy = ProxyDevice(context=context)
+    math2_proxy = ProxyDevice(context=context)
 
-    echo_out  = context.socket(DEALER)
-    math1_out = context.socket(DEALER)
-    math2_out = context.socket(DEALER)
+    echo_proxy  .bind_in('tcp://127.0.0.1:5555')
+    math1_proxy .bind_in('tcp://127.0.0.1:5556')
+    math2_proxy .bind_in('tcp://127.0.0.1:5557')
 
-    echo_inp  .bind('tcp://127.0.0.1:5555')
-    math1_inp .bind('tcp://127.0.0.1:5556')
-    math2_inp .bind('tcp://127.0.0.1:5557')
+    echo_proxy  .bind_out('ipc:///tmp/rpc-demo-echo.service')
+    math1_proxy .bind_out('ipc:///tmp/rpc-demo-math1.service')
+    math2_proxy .bind_out('ipc:///tmp/rpc-demo-math2.service')
 
-    echo_out  .bind('ipc:///tmp/rpc-demo-echo.service')
-    math1_out .bind('ipc:///tmp/rpc-demo-math1.service')
-    math2_out .bind('ipc:///tmp/rpc-demo-math2.service')
-
-    devices = [
-        spawn(green_device, echo_inp,  echo_out,  env='eventlet'),
-        spawn(green_device, math1_inp, math1_out, env='eventlet'),
-        spawn(green_device, math2_inp, math2_out, env='eventlet'),
-    ]
-    for device in devices:
-        device.wait()
+    echo_proxy  .start()
+    math1_proxy .start()
+    math2_proxy .start()
 
+    echo_proxy  .join()
+    math1_proxy .join()
+    math2_proxy .join()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# vim: fileencoding=utf-8 et ts=4 sts=4 sw=4 tw=0 fdm=marker fmr=#{,#}
+
+""" A simple RPC server that shows how to scale a service across
+    all CPU cores with the prefork supervisor:
+
+    * the supervisor forks a worker per core and pins it to the core
+    * a broker load balances requests to the workers
+    * crashed workers are respawned
+    * `kill -HUP <pid>` restarts the workers one by one
+"""
+
+#-----------------------------------------------------------------------------
+#  Copyright (C) 2012-2014. Brian Granger, Min Ragan-Kelley, Alexander Glyzov
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file LICENSE distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+from os   import getpid
+from time import sleep
+
+from netcall.prefork   import PreforkServer
+from netcall.threading import ThreadingRPCService, JSONSerializer
+
+
+class EchoService(ThreadingRPCService):
+
+    def echo(self, s):
+        print "<pid:%s> echo %r" % (getpid(), s)
+        return s
+
+    def sleep(self, t):
+        print "<pid:%s> sleep %s" % (getpid(), t)
+        sleep(t)
+
+    def error(self):
+        raise ValueError('raising ValueError for fun!')
+
+
+if __name__ == '__main__':
+    # the factory is called in every worker process
+    server = PreforkServer(
+        lambda: EchoService(serializer=JSONSerializer()),
+        'tcp://127.0.0.1:5555',
+    )
+    print "<pid:%s> supervisor" % getpid()
+    server.serve()
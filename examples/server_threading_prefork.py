@@ -5,7 +5,7 @@
 A simple RPC server that shows how to:
 
 * start several worker processes
-* use zmq proxy device to load balance requests to the workers
+* use a native zmq proxy device to load balance requests to the workers
 * make each worker to serve multiple RPC services asynchronously
   using the Python Threading multitasking
 
@@ -23,10 +23,9 @@ from os              import getpid
 from time            import sleep
 from multiprocessing import Process, cpu_count
 
-from zmq               import ROUTER, DEALER
-from zmq.devices       import ThreadProxy
 from netcall.threading import ThreadingRPCService, JSONSerializer
 from netcall.utils     import get_zmq_classes
+from netcall.devices   import ProxyDevice
 
 
 class EchoService(ThreadingRPCService):
@@ -96,9 +95,13 @@ if __name__ == '__main__':
     for w in workers:
         w.start()
 
-    echo_proxy  = ThreadProxy(ROUTER, DEALER)
-    math1_proxy = ThreadProxy(ROUTER, DEALER)
-    math2_proxy = ThreadProxy(ROUTER, DEALER)
+    Context, _ = get_zmq_classes()
+    context = Context()
+
+    # the devices shuttle messages in native threads (zmq.proxy in C)
+    echo_proxy  = ProxyDevice(context=context)
+    math1_proxy = ProxyDevice(context=context)
+    math2_proxy = ProxyDevice(context=context)
 
     echo_proxy  .bind_in('tcp://127.0.0.1:5555')
     math1_proxy .bind_in('tcp://127.0.0.1:5556')
@@ -112,8 +115,7 @@ if __name__ == '__main__':
     math1_proxy .start()
     math2_proxy .start()
 
-    while True:
-        echo_proxy  .join(0.1)
-        math1_proxy .join(0.1)
-        math2_proxy .join(0.1)
+    echo_proxy  .join()
+    math1_proxy .join()
+    math2_proxy .join()
 
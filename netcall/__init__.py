@@ -52,8 +52,9 @@ To talk to this service:
 
 from .base       import RPCServiceBase, RPCClientBase
 from .utils      import logger, RemoteMethod, ThreadPool, get_zmq_classes, detect_green_env
-from .errors     import RPCError, RemoteRPCError, RPCTimeoutError
+from .errors     import RPCError, RemoteRPCError, RPCTimeoutError, RPCBusyError
 from .serializer import *
+from .cache      import LRU
 
 from .sync       import SyncRPCClient
 from .threading  import ThreadingRPCService, ThreadingRPCClient
@@ -19,18 +19,27 @@ Authors:
 # Imports
 #-----------------------------------------------------------------------------
 
-from sys       import exc_info
-from abc       import ABCMeta, abstractmethod
-from random    import randint
-from traceback import format_exc
-from itertools import chain
-from functools import partial
+from __future__ import absolute_import
+
+from sys         import exc_info
+from time        import time, sleep
+from abc         import ABCMeta, abstractmethod
+from random      import randint
+from binascii    import hexlify
+from traceback   import format_exc
+from functools   import partial
+from threading   import Lock
+from collections import deque
 
 import zmq
 from zmq.utils               import jsonapi
 
 from .serializer import PickleSerializer
-from .errors     import RemoteRPCError, RPCError
+from .errors     import RemoteRPCError, RPCError, RPCBusyError
+from .metrics    import ProcStats, ClientMetrics, request_phases
+from .profiling  import Profiler
+from .tracing    import TraceContext, current_trace, trace
+from .messages   import Request, Reply
 from .utils      import logger, RemoteMethod
 
 
@@ -41,6 +50,8 @@ from .utils      import logger, RemoteMethod
 class RPCBase(object):  #{
     __metaclass__ = ABCMeta
 
+    _HOOKS = ()  # names of middleware hooks a subclass calls (see add_middleware)
+
     def __init__(self, serializer=None, identity=None):  #{
         """Base class for RPC service and proxy.
 
@@ -51,6 +62,11 @@ class RPCBase(object):  #{
             and deserialize args, kwargs and the result.
         identity   : [optional] <bytes>
         """
+        # middleware hooks: a list per hook name in self._HOOKS
+        self.middleware = []
+        for hook in self._HOOKS:
+            setattr(self, '_'+hook, [])
+
         self.identity    = identity or b'%08x' % randint(0, 0xFFFFFFFF)
         self.socket      = None
         self._ready      = False
@@ -64,11 +80,74 @@ class RPCBase(object):  #{
         "A subclass has to create a socket here"
         self._ready = False
     #}
+    def _run_hooks(self, hooks, *args):  #{
+        "Call middleware hooks logging (not raising) their exceptions"
+        for hook in hooks:
+            try:
+                hook(*args)
+            except Exception:
+                logger.error('middleware hook %r has failed' % hook, exc_info=True)
+    #}
 
     #-------------------------------------------------------------------------
     # Public API
     #-------------------------------------------------------------------------
 
+    def add_middleware(self, middleware):  #{
+        """ Register a middleware: an object with any of the hook methods
+            named in self._HOOKS. Hooks are called in the order of
+            registration; an object without hooks raises TypeError.
+
+            Services call:
+
+            before_dispatch(request)       - a request is accepted (before a cache,
+                                             a concurrency limit and the procedure),
+                                             an exception rejects the request
+            after_dispatch(request, result) - a request is answered with a result
+                                             (None for a cached result and for
+                                             single-flight followers)
+            on_error(request, error)       - a request has failed (error is None
+                                             for single-flight followers)
+
+            where request is a Request (see netcall.messages).
+            before_dispatch is called in the I/O thread/greenlet so it should
+            be quick, the others where the request is finished right after
+            its reply is sent (if the result is not ignored).
+
+            Clients call:
+
+            before_send(call) - in the calling thread before a request is
+                                serialized, call is a dict {'req_id', 'name',
+                                'args', 'kwargs', 'ignore'} and its args/kwargs
+                                could be replaced, an exception fails the call
+            on_reply(reply)   - an ACK/OK/FAIL reply is received (a Reply,
+                                see netcall.messages)
+
+            Exceptions raised by the other hooks are logged and ignored.
+            Nothing but an empty list check is done while there are no hooks.
+        """
+        hooks = [hook for hook in self._HOOKS if callable(getattr(middleware, hook, None))]
+        if not hooks:
+            raise TypeError('%r has none of the hooks: %s' % (middleware, ', '.join(self._HOOKS)))
+
+        self.middleware.append(middleware)
+        for hook in hooks:
+            # replaced rather than appended to, not to disturb running hooks
+            attr = '_'+hook
+            setattr(self, attr, getattr(self, attr) + [getattr(middleware, hook)])
+    #}
+    def remove_middleware(self, middleware):  #{
+        """ Unregister a middleware (see add_middleware) """
+        self.middleware.remove(middleware)
+        for hook in self._HOOKS:
+            method = getattr(middleware, hook, None)
+            if callable(method):
+                attr  = '_'+hook
+                hooks = list(getattr(self, attr))
+                hooks.remove(method)
+                setattr(self, attr, hooks)
+    #}
+
     def reset(self):  #{
         """Reset the socket/stream."""
         if self.socket is not None:
@@ -79,11 +158,11 @@ class RPCBase(object):  #{
         self.connected = set()
     #}
 
-    def shutdown(self):  #{
+    def shutdown(self, linger=0):  #{
         """ Deallocate resources (cleanup)
         """
         logger.debug('closing the socket')
-        self.socket.close(0)
+        self.socket.close(linger)
     #}
 
     def bind(self, urls, only=False):  #{
@@ -178,10 +257,101 @@ class RPCBase(object):  #{
 # RPC Service base
 #-----------------------------------------------------------------------------
 
+_NO_OPTIONS = {}
+
+class _Bulkhead(object):  #{
+    """ A concurrency limit of a procedure with a queue of waiting requests """
+
+    def __init__(self, max_concurrency, max_queue=0):  #{
+        self.max_concurrency = max_concurrency
+        self.max_queue       = max_queue
+        self.active          = 0
+        self.rejected        = 0
+        self.queue           = deque()
+        self._lock           = Lock()
+    #}
+    def acquire(self, request):  #{
+        """ Returns True if the request can run right away, False if it is
+            queued or raises RPCBusyError if the queue is full
+        """
+        with self._lock:
+            if self.active < self.max_concurrency:
+                self.active += 1
+                return True
+            if len(self.queue) < self.max_queue:
+                self.queue.append(request)
+                return False
+            self.rejected += 1
+        raise RPCBusyError('procedure %r is busy (%s running, %s queued)' % (
+            request.name, self.max_concurrency, self.max_queue
+        ))
+    #}
+    def release(self):  #{
+        """ Returns the next queued request (it takes over the slot) or None """
+        with self._lock:
+            if self.queue:
+                return self.queue.popleft()
+            self.active -= 1
+    #}
+    def occupancy(self):  #{
+        return dict(
+            active          = self.active,
+            queued          = len(self.queue),
+            rejected        = self.rejected,
+            max_concurrency = self.max_concurrency,
+            max_queue       = self.max_queue,
+        )
+    #}
+#}
+
+class _Batch(object):  #{
+    """ Collects concurrent requests to a batch procedure """
+
+    def __init__(self, max_batch=256, max_wait_ms=2):  #{
+        self.max_batch  = max_batch
+        self.max_wait   = max_wait_ms / 1000.0
+        self.pending    = []
+        self.generation = 0
+        self._lock      = Lock()
+    #}
+    def _take(self):  #{
+        batch, self.pending = self.pending, []
+        self.generation += 1
+        return batch
+    #}
+    def add(self, request):  #{
+        """ Returns a tuple (<full batch> | None, <generation> | None),
+            a generation is returned for a fresh batch that has to be
+            flushed after max_wait seconds
+        """
+        with self._lock:
+            self.pending.append(request)
+            if len(self.pending) >= self.max_batch:
+                return self._take(), None
+            if len(self.pending) == 1:
+                return None, self.generation
+            return None, None
+    #}
+    def flush(self, generation):  #{
+        """ Returns pending requests of a given generation (if not taken yet) """
+        with self._lock:
+            if generation != self.generation:
+                return []
+            return self._take()
+    #}
+#}
+
 class RPCServiceBase(RPCBase):  #{
 
     _RESERVED = ['register','register_object','proc','task','start','stop','serve',
-                 'shutdown','reset', 'connect', 'bind', 'bind_ports'] # From RPCBase
+                 'shutdown','reset', 'connect', 'bind', 'bind_ports', # From RPCBase
+                 'occupancy', 'workload', 'drain', 'stats', 'slow_requests',
+                 'add_middleware', 'remove_middleware']
+    _HOOKS    = ('before_dispatch', 'after_dispatch', 'on_error')
+    _OPTIONS  = ['cache', 'single_flight',  # procedure options accepted by register()
+                 'max_concurrency', 'max_queue',
+                 'batch', 'max_batch', 'max_wait_ms',
+                 'inline']
 
     def __init__(self, *args, **kwargs):  #{
         """
@@ -192,17 +362,69 @@ class RPCServiceBase(RPCBase):  #{
             and deserialize args, kwargs and the result.
 
         service_id : [optional] <bytes>
+
+        metrics    : <bool>
+            Whether to collect per-procedure statistics (True by default),
+            see stats().
+
+        profiling  : <bool>
+            Whether procedures could be profiled on demand by the reserved
+            '_netcall.profile.*' procedures (True by default), see Profiler.
+
+        slow_threshold : [optional] <float>
+            Requests handled longer than that (seconds) are logged and kept
+            in a ring buffer (disabled by default), see slow_requests().
+        slow_log_size  : <int> a size of the ring buffer (100 by default)
         """
-        service_id = kwargs.pop('service_id', None)
+        service_id     = kwargs.pop('service_id', None)
+        metrics        = kwargs.pop('metrics', True)
+        profiling      = kwargs.pop('profiling', True)
+        slow_threshold = kwargs.pop('slow_threshold', None)
+        slow_log_size  = kwargs.pop('slow_log_size', 100)
 
         super(RPCServiceBase, self).__init__(*args, **kwargs)
 
         self.service_id = service_id \
                        or b'%s/%s' % (self.__class__.__name__, self.identity)
-        self.procedures = {}  # {<name> : <callable>}
+        self.procedures   = {}  # {<name> : <callable>}
+        self.proc_options = {}  # {<name> : {<option> : <value>}}
+
+        # single-flight requests in progress
+        self._flights      = {}  # {<cache key> : [<request>, ...]}
+        self._flights_lock = Lock()
+
+        # per-procedure concurrency limits
+        self._bulkheads = {}  # {<name> : <_Bulkhead>}
+
+        # batch procedures
+        self._batches = {}  # {<name> : <_Batch>}
+
+        # requests received but not finished yet (see drain)
+        self._inflight      = 0
+        self._inflight_lock = Lock()
+        self._draining      = False
+
+        # per-procedure statistics
+        self._stats      = {} if metrics else None  # {<name> : <ProcStats>}
+        self._stats_lock = Lock()
+
+        # on-demand profiling
+        self.profiler = Profiler() if profiling else None
+
+        # slow requests
+        self.slow_threshold = slow_threshold
+        self._slow_log      = deque(maxlen=slow_log_size)
 
         # register extra class methods as service procedures
         self.register_object(self, restricted=self._RESERVED)
+
+        # introspection procedures
+        self.procedures['_netcall.stats']         = self.stats
+        self.procedures['_netcall.slow_requests'] = self.slow_requests
+        if self.profiler is not None:
+            self.procedures['_netcall.profile.start']  = self.profiler.start
+            self.procedures['_netcall.profile.stop']   = self.profiler.stop
+            self.procedures['_netcall.profile.result'] = self.profiler.result
     #}
     def _parse_request(self, msg_list):  #{
         """
@@ -211,47 +433,52 @@ class RPCServiceBase(RPCBase):  #{
 
         The request is received as a multipart message:
 
-        [<id>..<id>, b'|', req_id, proc_name, <ser_args>, <ser_kwargs>, <ignore>]
+        [<id>..<id>, b'|', req_id, proc_name, <ser_args>, <ser_kwargs>, <ignore>, [<trace>]]
 
-        Returns either a None or a dict {
-            'route'  : [<id:bytes>, ...],  # list of all dealer ids (a return path)
-            'req_id' : <id:bytes>,         # unique message id
-            'proc'   : <callable>,         # a task callable
-            'args'   : [<arg1>, ...],      # positional arguments
-            'kwargs' : {<kw1>, ...},       # keyword arguments
-            'ignore' : <bool>,             # ignore result flag
-            'error'  : None or <Exception>
-        }
+        where the optional trace frame is a trace context of the caller
+        (see TraceContext.encode). Arguments are not deserialized here (see _run_request) so that
+        a request could be answered without touching them (e.g. from a cache).
+
+        Returns either a None or a Request (see netcall.messages) which
+        keeps the reply header [<id>..<id>, b'|', req_id] sliced out of
+        the message once for the ACK and the result reply.
         """
+        received = time()
+
         if len(msg_list) < 6 or b'|' not in msg_list:
             logger.error('bad request: %r' % msg_list)
             return None
 
         error    = None
-        args     = None
-        kwargs   = None
         ignore   = None
         boundary = msg_list.index(b'|')
         name     = msg_list[boundary+2]
         proc     = self.procedures.get(name, None)
         try:
-            data = msg_list[boundary+3:boundary+5]
-            args, kwargs = self._serializer.deserialize_args_kwargs(data)
-            ignore       = bool(int(msg_list[boundary+5]))
+            ignore = bool(int(msg_list[boundary+5]))
         except Exception, e:
             error = e
 
         if proc is None:
             error = NotImplementedError("Unregistered procedure %r" % name)
 
-        return dict(
-            route  = msg_list[0:boundary],
-            req_id = msg_list[boundary+1],
-            proc   = proc,
-            args   = args,
-            kwargs = kwargs,
-            ignore = ignore,
-            error  = error,
+        context = None
+        if len(msg_list) > boundary+6:
+            context = TraceContext.decode(msg_list[boundary+6])
+            if context is not None:
+                context = context.child()
+
+        return Request(
+            msg_list[0:boundary+2],
+            name,
+            proc,
+            msg_list[boundary+3:boundary+5],
+            self.proc_options.get(name, _NO_OPTIONS),
+            ignore,
+            error,
+            context,
+            received,
+            time(),
         )
     #}
     def _build_reply(self, request, typ, data):  #{
@@ -264,11 +491,9 @@ class RPCServiceBase(RPCBase):  #{
         data : list of bytes
             A list of data frame to be appended to the message.
         """
-        return list(chain(
-            request['route'],
-            [b'|', request['req_id'], typ],
-            data,
-        ))
+        reply = request.header + [typ]
+        reply.extend(data)
+        return reply
     #}
 
     def _send_reply(self, reply):  #{
@@ -280,17 +505,57 @@ class RPCServiceBase(RPCBase):  #{
     #}
     def _send_ack(self, request):  #{
         "Send an ACK notification"
-        reply = self._build_reply(request, b'ACK', [self.service_id])
-        self._send_reply(reply)
+        self._send_reply(request.header + [b'ACK', self.service_id])
     #}
     def _send_ok(self, request, result):  #{
-        "Send a OK reply"
-        data_list = self._serializer.serialize_result(result)
-        reply = self._build_reply(request, b'OK', data_list)
-        self._send_reply(reply)
+        "Send a OK reply (the serialized result is cached if requested)"
+        request.executed = time()
+        try:
+            data_list = self._serializer.serialize_result(result)
+        except Exception:
+            self._send_fail(request)
+            if self._on_error:
+                self._run_hooks(self._on_error, request, exc_info()[1])
+            return
+        request.serialized = time()
+        cache = request.options.get('cache')
+        if cache is not None:
+            cache.set(self._cache_key(request), data_list)
+        self._send_data(request, b'OK', data_list)
+    #}
+    def _send_data(self, request, typ, data_list):  #{
+        """ Send a reply with already serialized data.
+
+            If the request leads a single-flight the same data
+            is sent to all the requests waiting for it as well.
+        """
+        failed    = typ == b'FAIL'
+        bytes_out = sum(len(frame) for frame in data_list)
+
+        request.failed    = failed
+        request.bytes_out = bytes_out
+        self._send_reply(self._build_reply(request, typ, data_list))
+        request.replied   = time()
+
+        if request.flight is not None:
+            with self._flights_lock:
+                followers = self._flights.pop(request.flight, ())
+            for follower in followers:
+                follower.failed    = failed
+                follower.bytes_out = bytes_out
+                self._send_reply(self._build_reply(follower, typ, data_list))
+                follower.replied   = time()
+                if failed:
+                    if self._on_error:
+                        self._run_hooks(self._on_error, follower, None)
+                elif self._after_dispatch:
+                    self._run_hooks(self._after_dispatch, follower, None)
+                self._finish(follower)
     #}
     def _send_fail(self, request):  #{
         """Send a FAIL reply"""
+        if request.executed is None:
+            request.executed = time()
         # take the current exception implicitly
         etype, evalue, tb = exc_info()
         error_dict = {
@@ -299,18 +564,20 @@ class RPCServiceBase(RPCBase):  #{
             'traceback' : format_exc(tb)
         }
         data_list = [jsonapi.dumps(error_dict)]
-        reply = self._build_reply(request, b'FAIL', data_list)
-        self._send_reply(reply)
+        self._send_data(request, b'FAIL', data_list)
     #}
 
-    @abstractmethod
+    def _cache_key(self, request):  #{
+        "A cache key made of the procedure name and the raw argument frames"
+        return (request.name,) + tuple(request.data)
+    #}
     def _handle_request(self, msg_list):  #{
         """
         Handle an incoming request.
 
         The request is received as a multipart message:
 
-        [<id>..<id>, b'|', req_id, proc_name, <serialized args & kwargs>]
+        [<id>..<id>, b'|', req_id, proc_name, <ser_args>, <ser_kwargs>, <ignore>]
 
         First, the service sends back a notification that the message was
         indeed received:
@@ -324,16 +591,310 @@ class RPCServiceBase(RPCBase):  #{
 
         Here the (ename, evalue, traceback) are utf-8 encoded unicode.
 
-        Note: subclasses have to override this method
+        A request to a procedure registered with a cache is answered with
+        the cached result frames if there are any. A single-flight request
+        identical to one in progress waits for its reply. A request to
+        a procedure at its concurrency limit is queued or rejected with
+        RPCBusyError. Otherwise it is passed to self._dispatch().
+
+        Every request is finished with self._finish() eventually, a draining
+        service rejects new requests with RPCBusyError. Accepted requests
+        pass the before_dispatch middleware hooks first (see add_middleware).
+        """
+        req = self._parse_request(msg_list)
+        if req is None:
+            return
+        self._send_ack(req)
+
+        # checked and counted at once so that drain() cannot miss the request
+        with self._inflight_lock:
+            draining = self._draining
+            if not draining:
+                self._inflight += 1
+
+        if draining:
+            try:
+                raise RPCBusyError('the service is draining')
+            except RPCBusyError:
+                req.ignore or self._send_fail(req)
+            return
+
+        if self._before_dispatch:
+            try:
+                for hook in self._before_dispatch:
+                    hook(req)
+            except Exception:
+                self._fail(req)
+                return
+
+        cache = req.options.get('cache')
+        if cache is not None and req.error is None:
+            data_list = cache.get(self._cache_key(req))
+            if data_list is not None:
+                req.ignore or self._send_data(req, b'OK', data_list)
+                if self._after_dispatch:
+                    self._run_hooks(self._after_dispatch, req, None)
+                self._finish(req)
+                return
+
+        if req.options.get('single_flight') and not req.ignore and req.error is None:
+            key = self._cache_key(req)
+            with self._flights_lock:
+                followers = self._flights.get(key)
+                if followers is not None:
+                    followers.append(req)
+                    return
+                self._flights[key] = []
+            req.flight = key
+
+        bulkhead = self._bulkheads.get(req.name)
+        if bulkhead is not None and req.error is None:
+            try:
+                if not bulkhead.acquire(req):
+                    return  # queued
+            except RPCBusyError:
+                self._fail(req)
+                return
+            req.bulkhead = bulkhead
+
+        self._dispatch(req)
+    #}
+    def _execute(self, func, *args):  #{
+        """ Run func(*args).
+
+            Subclasses override this to run requests concurrently
+            (in a thread pool, a greenlet etc.)
+        """
+        func(*args)
+    #}
+    @abstractmethod
+    def _call_later(self, delay, func, *args):  #{
+        """ Call func(*args) after delay seconds (non-blocking)
+
+            Note: subclasses have to override this method
         """
         pass
     #}
+    def _dispatch(self, request):  #{
+        """ Run a parsed request (a request to a batch procedure
+            joins the current batch, an inline one runs right here)
+        """
+        if request.options.get('inline'):
+            return self._run_request(request)
+
+        batch = self._batches.get(request.name)
+        if batch is None or request.error is not None:
+            return self._execute(self._run_request, request)
+
+        ready, generation = batch.add(request)
+        if ready:
+            self._execute(self._run_batch, ready)
+        elif generation is not None:
+            self._call_later(batch.max_wait, self._flush_batch, batch, generation)
+    #}
+    def _flush_batch(self, batch, generation):  #{
+        ready = batch.flush(generation)
+        if ready:
+            self._execute(self._run_batch, ready)
+    #}
+    def _run_request(self, request):  #{
+        """ Deserialize arguments, call the procedure and send a reply """
+        request.started = time()
+        try:
+            # raise any parsing errors here
+            if request.error:
+                raise request.error
+            args, kwargs = self._serializer.deserialize_args_kwargs(request.data)
+            request.deserialized = time()
+            if self.profiler is not None and self.profiler.session is not None:
+                request.proc = self.profiler.wrap(request.name, request.proc)
+            # call procedure (in the caller's trace if any)
+            if request.trace is None:
+                res = self._invoke(request, args, kwargs)
+            else:
+                with trace(request.trace):
+                    res = self._invoke(request, args, kwargs)
+        except Exception:
+            self._fail(request)
+        else:
+            self._send_result(request, res)
+    #}
+    def _invoke(self, request, args, kwargs):  #{
+        "Call the procedure of a request"
+        return request.proc(*args, **kwargs)
+    #}
+    def _run_batch(self, requests):  #{
+        """ Call a batch procedure once with a list of positional arguments
+            of all the requests and send every caller its own result
+        """
+        calls   = []
+        started = time()
+        for request in requests:
+            request.started = started
+            try:
+                if request.error:
+                    raise request.error
+                args, kwargs = self._serializer.deserialize_args_kwargs(request.data)
+                request.deserialized = time()
+                if kwargs:
+                    raise TypeError("batch procedure %r does not accept keyword arguments" % request.name)
+            except Exception:
+                self._fail(request)
+            else:
+                calls.append((request, args))
+
+        if not calls:
+            return
+
+        proc = calls[0][0].proc
+        if self.profiler is not None and self.profiler.session is not None:
+            proc = self.profiler.wrap(calls[0][0].name, proc)
+
+        try:
+            results = list(proc([args for _, args in calls]))
+            if len(results) != len(calls):
+                raise ValueError("batch procedure %r returned %s results for %s calls" % (
+                    calls[0][0].name, len(results), len(calls)
+                ))
+        except Exception:
+            for request, _ in calls:
+                self._fail(request)
+            return
+
+        for (request, _), result in zip(calls, results):
+            if isinstance(result, Exception):
+                try:
+                    raise result
+                except Exception:
+                    self._fail(request)
+            else:
+                self._send_result(request, result)
+    #}
+    def _send_result(self, request, result):  #{
+        "Send a result of a procedure call and finish the request"
+        request.ignore or self._send_ok(request, result)
+        if self._after_dispatch and not request.failed:
+            self._run_hooks(self._after_dispatch, request, result)
+        self._finish(request)
+    #}
+    def _fail(self, request):  #{
+        "Send a FAIL reply with the current exception (if not ignored) and finish the request"
+        request.ignore or self._send_fail(request)
+        if self._on_error:
+            self._run_hooks(self._on_error, request, exc_info()[1])
+        self._finish(request)
+    #}
+    def _finish(self, request):  #{
+        """ Account a finished request (its reply has been sent),
+            release its concurrency slot passing it to the next one
+        """
+        with self._inflight_lock:
+            self._inflight -= 1
+
+        if request.proc is not None:
+            self._account(request)
+
+        bulkhead = request.bulkhead
+        if bulkhead is not None:
+            waiting = bulkhead.release()
+            if waiting is not None:
+                waiting.bulkhead = bulkhead
+                self._dispatch(waiting)
+    #}
+    def _account(self, request):  #{
+        """ Account a finished request in the statistics of its procedure
+            and in the slow log if it has taken longer than slow_threshold
+        """
+        threshold = self.slow_threshold
+        if self._stats is None and threshold is None:
+            return
+
+        now          = time()
+        received     = request.received
+        started      = request.started
+        deserialized = request.deserialized
+        executed     = request.executed or now
+        serialized   = request.serialized
+        bytes_in     = sum(len(frame) for frame in request.data)
+        latency      = now - received
+
+        if self._stats is not None:
+            name  = request.name
+            stats = self._stats.get(name)
+            if stats is None:
+                with self._stats_lock:
+                    stats = self._stats.setdefault(name, ProcStats())
+            stats.record(
+                failed      = request.failed,
+                bytes_in    = bytes_in,
+                bytes_out   = request.bytes_out,
+                latency     = latency,
+                queue       = started and started - received,
+                deserialize = deserialized and deserialized - started,
+                execute     = deserialized and executed - deserialized,
+                serialize   = serialized and serialized - executed,
+            )
+
+        if threshold is not None and latency >= threshold:
+            entry = dict(
+                time      = received,
+                procedure = request.name,
+                req_id    = request.req_id,
+                route     = [hexlify(frame) for frame in request.route],  # binary ids
+                bytes_in  = bytes_in,
+                bytes_out = request.bytes_out,
+                failed    = request.failed,
+                total     = latency,
+            )
+            entry.update(request_phases(request, now))
+            self._slow_log.append(entry)
+            logger.warning('slow request %r to %s: %.3f sec (%s)' % (
+                request.req_id, request.name, latency, ', '.join(
+                    '%s=%.3f' % (phase, entry[phase])
+                    for phase in ['queue', 'deserialize', 'execute', 'serialize', 'handoff']
+                    if entry[phase] is not None
+                )
+            ))
+    #}
+    def _sleep(self, seconds):  #{
+        "Sleep without blocking other requests (subclasses override it)"
+        sleep(seconds)
+    #}
+
+    def _set_options(self, name, options):  #{
+        "Validate and store options of a procedure"
+        unknown = set(options) - set(self._OPTIONS)
+        if unknown:
+            raise TypeError("unknown procedure options: %s" % ', '.join(sorted(unknown)))
+
+        if 'max_queue' in options and not options.get('max_concurrency'):
+            raise ValueError("max_queue requires max_concurrency")
+        if ('max_batch' in options or 'max_wait_ms' in options) and not options.get('batch'):
+            raise ValueError("max_batch and max_wait_ms require batch")
+        if options.get('inline') and options.get('batch'):
+            raise ValueError("batch procedures can not be inline")
+
+        if options:
+            self.proc_options[name] = options
+        else:
+            self.proc_options.pop(name, None)
+
+        if options.get('max_concurrency'):
+            self._bulkheads[name] = _Bulkhead(options['max_concurrency'], options.get('max_queue', 0))
+        else:
+            self._bulkheads.pop(name, None)
+
+        if options.get('batch'):
+            self._batches[name] = _Batch(options.get('max_batch', 256), options.get('max_wait_ms', 2))
+        else:
+            self._batches.pop(name, None)
+    #}
 
     #-------------------------------------------------------------------------
     # Public API
     #-------------------------------------------------------------------------
 
-    def register(self, func=None, name=None):  #{
+    def register(self, func=None, name=None, **options):  #{
         """ A decorator to register a callable as a service task.
 
             Examples:
@@ -348,17 +909,57 @@ class RPCServiceBase(RPCBase):  #{
             def do_nothing():
                 pass
 
+            @service.proc(cache=LRU(maxsize=1000, ttl=60))
+            def lookup(key):
+                return db.get(key)
+
+            @service.proc(batch=True, max_batch=100)
+            def score(calls):
+                return model.predict([features for (features,) in calls])
+
             service.register(lambda: None, name='dummy')
+
+            Options
+            =======
+            cache           : <LRU>
+                A cache object with get(key) and set(key, value) methods.
+                Calls with identical serialized arguments are answered with
+                the cached serialized result without invoking the procedure.
+            single_flight   : <bool>
+                Concurrent calls with identical serialized arguments share
+                a single execution of the procedure and its serialized result
+                (ignored calls always run on their own).
+            max_concurrency : <int>
+                A maximum number of concurrent executions of the procedure,
+                excess calls are queued or rejected with RPCBusyError.
+            max_queue       : <int>
+                A maximum number of calls waiting for a free slot (0 by default).
+            batch           : <bool>
+                Concurrent calls are collected and the procedure is called once
+                with a list of their positional argument tuples. It should return
+                a list of results in the same order, an exception instance in
+                place of a result fails that call only.
+            max_batch       : <int>
+                A maximum number of calls in a batch (256 by default).
+            max_wait_ms     : <float>
+                Milliseconds to wait for more calls after the first one
+                of a batch (2 by default).
+            inline          : <bool>
+                Run the procedure right in the I/O thread/greenlet that has
+                received the request, without a thread pool or a greenlet
+                handoff. Only for quick non-blocking procedures since nothing
+                else is received until it returns.
         """
         if func is None:
-            if name is None:
+            if name is None and not options:
                 raise ValueError("at least one argument is required")
-            return partial(self.register, name=name)
+            return partial(self.register, name=name, **options)
         else:
             if not callable(func):
                 raise ValueError("func argument should be callable")
             if name is None:
                 name = func.__name__
+            self._set_options(name, options)
             self.procedures[name] = func
 
         return func
@@ -367,11 +968,12 @@ class RPCServiceBase(RPCBase):  #{
     task = register  # alias
     proc = register  # alias
 
-    def register_object(self, obj, restricted=[], namespace=''):  #{
+    def register_object(self, obj, restricted=[], namespace='', **options):  #{
         """
         Register public functions of a given object as service tasks.
         Give the possibility to not register some restricted functions.
         Give the possibility to prefix the service name with a namespace.
+        Procedure options (see register) are applied to every function.
 
         Example:
 
@@ -408,7 +1010,113 @@ class RPCServiceBase(RPCBase):  #{
             try:    proc = getattr(obj, name)
             except: continue
             if callable(proc):
-                self.procedures['.'.join([namespace, name]).lstrip('.')] = proc
+                name = '.'.join([namespace, name]).lstrip('.')
+                self._set_options(name, options)
+                self.procedures[name] = proc
+    #}
+
+    def occupancy(self):  #{
+        """ Returns occupancy of procedures with a concurrency limit:
+
+            {<name> : {'active':<int>, 'queued':<int>, 'rejected':<int>,
+                       'max_concurrency':<int>, 'max_queue':<int>}}
+        """
+        return dict((name, bulkhead.occupancy()) for name, bulkhead in self._bulkheads.items())
+    #}
+
+    def workload(self):  #{
+        """ Returns a snapshot of the work on hand:
+
+            {'inflight':<int>}  # requests received but not finished yet
+        """
+        return dict(inflight=self._inflight)
+    #}
+
+    def stats(self, reset=False, buckets=None):  #{
+        """ Returns statistics of called procedures (see ProcStats):
+
+            {<name> : {'calls':<int>, 'errors':<int>, 'bytes_in':<int>, 'bytes_out':<int>,
+                       'latency':<dict>, 'queue':<dict>, 'deserialize':<dict>,
+                       'execute':<dict>, 'serialize':<dict>}}
+
+            where the timings are summaries of histograms in seconds
+            (see Histogram.snapshot). The same is available remotely
+            as the '_netcall.stats' procedure.
+
+            Parameters
+            ==========
+            reset   : <bool> whether to start counting over after the snapshot
+            buckets : [optional] (<float>, ...) ascending histogram bounds,
+                      if passed the timings are (<cumulative counts>, <sum>, <count>)
+                      tuples instead (see ProcStats.export)
+        """
+        if self._stats is None:
+            return {}
+
+        with self._stats_lock:
+            items = self._stats.items()
+
+        snapshot = {}
+        for name, stats in items:
+            snapshot[name] = stats.snapshot() if buckets is None else stats.export(buckets)
+            if reset:
+                stats.reset()
+        return snapshot
+    #}
+
+    def slow_requests(self, n=None):  #{
+        """ Returns the last n (all by default) requests handled longer than
+            slow_threshold seconds, the most recent first:
+
+            [{'time':<float>, 'procedure':<str>, 'req_id':<bytes>, 'route':[<hex str>, ...],
+              'bytes_in':<int>, 'bytes_out':<int>, 'failed':<bool>, 'total':<float>,
+              'parse':<float>, 'queue':<float>, 'deserialize':<float>, 'execute':<float>,
+              'serialize':<float>, 'handoff':<float>}, ...]
+
+            where the phases are in seconds (None if a phase has not happened,
+            e.g. for a cached result) and handoff is the time spent handing the
+            reply over to the I/O thread/socket. The same is available remotely
+            as the '_netcall.slow_requests' procedure.
+        """
+        entries = list(self._slow_log)
+        entries.reverse()
+        return entries[:n] if n else entries
+    #}
+
+    def drain(self, timeout=None):  #{
+        """ Shut the service down gracefully (blocking):
+
+            - new requests are rejected with RPCBusyError
+            - in-flight requests are let finish (up to timeout seconds)
+            - their replies are flushed (within the rest of the timeout)
+              and the socket is closed
+
+            The endpoints stay bound/connected while draining so the replies
+            are not lost, peers are not told to stop sending requests here.
+            Behind a plain ROUTER/DEALER front (or with clients connected to
+            several services) the requests still coming in fail with a
+            RPCBusyError, drain is error-free only behind a Broker
+            (see BrokerWorker.drain, PreforkServer).
+
+            Returns True if all the in-flight requests have finished in time.
+        """
+        deadline = None if timeout is None else time() + timeout
+        with self._inflight_lock:
+            self._draining = True
+
+        while self._inflight > 0:
+            if deadline is not None and time() >= deadline:
+                break
+            self._sleep(0.01)
+
+        finished = self._inflight <= 0
+        if not finished:
+            logger.warning('%s requests are still in-flight' % self._inflight)
+
+        linger = -1 if deadline is None else int(max(0, deadline - time()) * 1000)
+        self.shutdown(linger=linger)
+
+        return finished
     #}
 
     @abstractmethod
@@ -438,6 +1146,25 @@ class RPCServiceBase(RPCBase):  #{
 class RPCClientBase(RPCBase):  #{
     """A service proxy to for talking to an RPCService."""
 
+    _HOOKS = ('before_send', 'on_reply')
+
+    def __init__(self, *args, **kwargs):  #{
+        """
+        Parameters
+        ==========
+        serializer : [optional] <Serializer>
+            An instance of a Serializer subclass that will be used to serialize
+            and deserialize args, kwargs and the result.
+
+        metrics    : <bool>
+            Whether to track calls in self.metrics (True by default),
+            see ClientMetrics.
+        """
+        # set before anything else since missing attributes are remote methods
+        self.metrics = ClientMetrics() if kwargs.pop('metrics', True) else None
+
+        super(RPCClientBase, self).__init__(*args, **kwargs)
+    #}
     def _create_socket(self):  #{
         super(RPCClientBase, self)._create_socket()
 
@@ -447,27 +1174,32 @@ class RPCClientBase(RPCBase):  #{
     def _build_request(self, method, args, kwargs, ignore=False):  #{
         req_id = b'%x' % randint(0, 0xFFFFFFFF)
         method = bytes(method)
+        if self._before_send:
+            call = dict(req_id=req_id, name=method, args=args, kwargs=kwargs, ignore=ignore)
+            for hook in self._before_send:
+                hook(call)
+            args, kwargs = call['args'], call['kwargs']
         msg_list = [b'|', req_id, method]
         data_list = self._serializer.serialize_args_kwargs(args, kwargs)
         msg_list.extend(data_list)
         msg_list.append(bytes(int(ignore)))
+        context = current_trace()
+        if context is not None:
+            msg_list.append(context.encode())
+        if not ignore and self.metrics is not None:
+            self.metrics.sent(req_id, method)
         return req_id, msg_list
     #}
     def _parse_reply(self, msg_list):  #{
         """
-        Parse a reply from service
+        Parse a reply from service and account it in self.metrics
         (should not raise an exception)
 
         The reply is received as a multipart message:
 
         [b'|', req_id, type, payload ...]
 
-        Returns either None or a dict {
-            'type'   : <message_type:bytes>       # ACK | OK | FAIL
-            'req_id' : <id:bytes>,                # unique message id
-            'srv_id' : <service_id:bytes> | None  # only for ACK messages
-            'result' : <object>
-        }
+        Returns either None or a Reply (see netcall.messages)
         """
         if len(msg_list) < 4 or msg_list[0] != b'|':
             logger.error('bad reply: %r' % msg_list)
@@ -496,12 +1228,13 @@ class RPCClientBase(RPCBase):  #{
         else:
             result = RPCError('bad message type: %r' % msg_type)
 
-        return dict(
-            type   = msg_type,
-            req_id = msg_list[1],
-            srv_id = srv_id,
-            result = result,
-        )
+        reply = Reply(msg_type, msg_list[1], srv_id, result)
+        if self.metrics is not None:
+            self.metrics.received(reply)
+        if self._on_reply:
+            self._run_hooks(self._on_reply, reply)
+
+        return reply
     #}
 
     def __getattr__(self, name):  #{
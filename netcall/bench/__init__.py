@@ -0,0 +1,49 @@
+# vim: fileencoding=utf-8 et ts=4 sts=4 sw=4 tw=0 fdm=marker fmr=#{,#}
+
+"""
+NetCall benchmarks.
+
+Authors:
+
+* Alexander Glyzov
+
+Launches local service/client pairs of every backend (sync, threading,
+tornado, gevent, eventlet) over inproc, ipc and tcp loopback and sweeps
+payload size, serializer and concurrency reporting throughput and latency
+percentiles.
+
+Example
+-------
+
+    python -m netcall.bench --backends threading,gevent --payloads 16,65536 \\
+                            --concurrency 1,16,64 --requests 5000 --json results.json
+
+    from netcall.bench import run
+    run('gevent', 'ipc', payload=1024, concurrency=16)
+
+Micro-benchmarks of the message hot path with JSON baselines and
+a regression gate live in netcall.bench.micro:
+
+    python -m netcall.bench.micro --save baseline.json
+    python -m netcall.bench.micro --compare baseline.json --tolerance 0.1
+
+Traffic captured from a service (see netcall.capture) is replayed
+at the original or a scaled rate by netcall.bench.replay:
+
+    python -m netcall.bench.replay traffic.ncap tcp://127.0.0.1:5555 --speed 2
+"""
+
+#-----------------------------------------------------------------------------
+#  Copyright (C) 2012-2014. Brian Granger, Min Ragan-Kelley, Alexander Glyzov
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file LICENSE distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+# Imports
+#-----------------------------------------------------------------------------
+
+from __future__ import absolute_import
+
+from .runner import BACKENDS, TRANSPORTS, SERIALIZERS, run, sweep
@@ -0,0 +1,107 @@
+# vim: fileencoding=utf-8 et ts=4 sts=4 sw=4 tw=0 fdm=marker fmr=#{,#}
+
+"""
+The NetCall benchmark command line:
+
+    python -m netcall.bench --help
+"""
+
+#-----------------------------------------------------------------------------
+#  Copyright (C) 2012-2014. Brian Granger, Min Ragan-Kelley, Alexander Glyzov
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file LICENSE distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+# Imports
+#-----------------------------------------------------------------------------
+
+from __future__ import absolute_import
+
+import sys
+
+from logging  import WARNING
+from argparse import ArgumentParser
+
+from zmq.utils import jsonapi
+
+from ..utils   import setup_logger
+from .runner  import BACKENDS, TRANSPORTS, SERIALIZERS, sweep
+
+
+#-----------------------------------------------------------------------------
+# Command line
+#-----------------------------------------------------------------------------
+
+HEADER = '%-10s %-7s %-8s %8s %5s %10s %9s %9s %9s %7s' % (
+    'backend', 'trans', 'serial', 'payload', 'conc', 'req/s', 'p50 ms', 'p99 ms', 'p999 ms', 'errors'
+)
+
+def _list(kind):  #{
+    def parse(value):
+        return [kind(item) for item in value.split(',') if item]
+    return parse
+#}
+
+def format_result(result):  #{
+    "Returns a table row of a benchmark result (see HEADER)"
+    latency = result['latency']
+    ms      = lambda value: '%9.3f' % (value * 1000) if value is not None else '%9s' % '-'
+    return '%-10s %-7s %-8s %8s %5s %10.0f %s %s %s %7s' % (
+        result['backend'], result['transport'], result['serializer'],
+        result['payload'], result['concurrency'], result['throughput'],
+        ms(latency['p50']), ms(latency['p99']), ms(latency['p999']), result['errors'],
+    )
+#}
+
+def main(argv=None):  #{
+    parser = ArgumentParser(prog='python -m netcall.bench',
+                            description='Benchmark NetCall backends with echo calls.')
+    parser.add_argument('-b', '--backends', type=_list(str), default=sorted(BACKENDS),
+                        help='comma separated: %s (default: all)' % ','.join(sorted(BACKENDS)))
+    parser.add_argument('-t', '--transports', type=_list(str), default=TRANSPORTS,
+                        help='comma separated: %s (default: all)' % ','.join(TRANSPORTS))
+    parser.add_argument('-p', '--payloads', type=_list(int), default=[16, 1024, 65536],
+                        help='comma separated payload sizes in bytes (default: 16,1024,65536)')
+    parser.add_argument('-s', '--serializers', type=_list(str), default=['pickle'],
+                        help='comma separated: %s (default: pickle)' % ','.join(sorted(SERIALIZERS)))
+    parser.add_argument('-c', '--concurrency', type=_list(int), default=[1, 16],
+                        help='comma separated numbers of concurrent callers (default: 1,16)')
+    parser.add_argument('-n', '--requests', type=int, default=2000,
+                        help='calls per benchmark (default: 2000)')
+    parser.add_argument('-w', '--warmup', type=int, default=200,
+                        help='calls before measuring (default: 200)')
+    parser.add_argument('--json', metavar='FILE',
+                        help='save the results as JSON ("-" for stdout)')
+    args = parser.parse_args(argv)
+
+    for name, known in [('backends', BACKENDS), ('transports', TRANSPORTS), ('serializers', SERIALIZERS)]:
+        unknown = set(getattr(args, name)) - set(known)
+        if unknown:
+            parser.error('unknown %s: %s' % (name, ', '.join(sorted(unknown))))
+
+    setup_logger(level=WARNING)
+
+    output  = sys.stderr if args.json == '-' else sys.stdout
+    results = []
+
+    print >>output, HEADER
+    for result in sweep(args.backends, args.transports, args.payloads, args.serializers,
+                        args.concurrency, args.requests, args.warmup):
+        results.append(result)
+        print >>output, format_result(result)
+        output.flush()
+
+    if args.json == '-':
+        print jsonapi.dumps(results)
+    elif args.json:
+        with open(args.json, 'w') as f:
+            f.write(jsonapi.dumps(results))
+
+    return 0
+#}
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,316 @@
+# vim: fileencoding=utf-8 et ts=4 sts=4 sw=4 tw=0 fdm=marker fmr=#{,#}
+
+"""
+Micro-benchmarks of the per-message hot path with JSON baselines.
+
+Authors:
+
+* Alexander Glyzov
+
+Measures building/parsing of requests and replies, the serializers and
+Future set/wait in nanoseconds per operation (the best of a few repeats).
+
+Example
+-------
+
+    # on the base revision
+    python -m netcall.bench.micro --save baseline.json
+
+    # on a change (exits with 1 if anything got slower by more than 10%)
+    python -m netcall.bench.micro --compare baseline.json --tolerance 0.1
+"""
+
+#-----------------------------------------------------------------------------
+#  Copyright (C) 2012-2014. Brian Granger, Min Ragan-Kelley, Alexander Glyzov
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file LICENSE distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+# Imports
+#-----------------------------------------------------------------------------
+
+from __future__ import absolute_import
+
+import sys
+
+from time        import time
+from timeit      import default_timer
+from logging     import WARNING
+from argparse    import ArgumentParser
+from platform    import python_version, platform
+from collections import OrderedDict
+
+from zmq.utils import jsonapi
+
+from ..sync       import SyncRPCClient
+from ..threading  import ThreadingRPCService, ThreadPool
+from ..futures    import Future
+from ..metrics    import ClientMetrics
+from ..messages   import Reply
+from ..serializer import msgpack
+from ..utils      import get_zmq_classes, setup_logger
+from .runner      import SERIALIZERS
+
+
+#-----------------------------------------------------------------------------
+# Benchmarks
+#-----------------------------------------------------------------------------
+
+# a typical small call
+ARGS   = (b'x' * 16, 42)
+KWARGS = {'flag': True}
+RESULT = {'status': 'ok', 'value': b'x' * 16}
+
+class _Fixtures(object):  #{
+    """ A client and a service (not started) to call the hot path methods of """
+
+    def __init__(self):  #{
+        Context, _ = get_zmq_classes()
+        self.context = Context()
+        self.pool    = ThreadPool(1)
+        self.client  = SyncRPCClient(context=self.context, metrics=False)
+        self.service = ThreadingRPCService(context=self.context, pool=self.pool)
+        self.service.register(lambda *args, **kwargs: RESULT, name='echo')
+
+        _, msg_list  = self.client._build_request('echo', ARGS, KWARGS)
+        self.request = [b'caller'] + msg_list
+        self.reply   = [b'|', msg_list[1], b'OK'] + self.service._serializer.serialize_result(RESULT)
+    #}
+    def close(self):  #{
+        self.client.shutdown()
+        self.service.shutdown()
+        self.context.term()
+        self.pool.close()
+        self.pool.join()
+    #}
+#}
+
+def _build_request(fx):  #{
+    build = fx.client._build_request
+    return lambda: build('echo', ARGS, KWARGS)
+#}
+def _parse_request(fx):  #{
+    parse, msg_list = fx.service._parse_request, fx.request
+    return lambda: parse(msg_list)
+#}
+def _build_reply(fx):  #{
+    build   = fx.service._build_reply
+    request = fx.service._parse_request(fx.request)
+    data    = fx.reply[3:]
+    return lambda: build(request, b'OK', data)
+#}
+def _parse_reply(fx):  #{
+    parse, msg_list = fx.client._parse_reply, fx.reply
+    return lambda: parse(msg_list)
+#}
+def _client_metrics(fx):  #{
+    metrics = ClientMetrics()
+    reply   = Reply(b'OK', b'1', None, None)
+    def track():
+        metrics.sent(b'1', 'echo')
+        metrics.received(reply)
+    return track
+#}
+def _future(fx):  #{
+    def set_wait():
+        future = Future()
+        future.set_result(RESULT)
+        return future.result()
+    return set_wait
+#}
+def _serializer(name, method):  #{
+    def setup(fx):
+        serializer = SERIALIZERS[name]()
+        func       = getattr(serializer, method)
+        if method == 'serialize_args_kwargs':
+            return lambda: func(ARGS, KWARGS)
+        if method == 'serialize_result':
+            return lambda: func(RESULT)
+        if method == 'deserialize_args_kwargs':
+            data = serializer.serialize_args_kwargs(ARGS, KWARGS)
+        else:
+            data = serializer.serialize_result(RESULT)
+        return lambda: func(data)
+    return setup
+#}
+
+BENCHMARKS = OrderedDict([
+    ('client.build_request', _build_request),
+    ('service.parse_request', _parse_request),
+    ('service.build_reply', _build_reply),
+    ('client.parse_reply', _parse_reply),
+    ('client.metrics', _client_metrics),
+    ('future.set_wait', _future),
+])
+for _name in sorted(SERIALIZERS):
+    if _name == 'msgpack' and msgpack is None:
+        continue
+    for _method in ['serialize_args_kwargs', 'deserialize_args_kwargs',
+                    'serialize_result', 'deserialize_result']:
+        BENCHMARKS['serializer.%s.%s' % (_name, _method)] = _serializer(_name, _method)
+
+
+#-----------------------------------------------------------------------------
+# Measuring and comparing
+#-----------------------------------------------------------------------------
+
+def measure(func, repeat=5, min_time=0.1):  #{
+    """ Returns the best time of a call of func (seconds) out of a number
+        of repeats, every repeat loops for at least min_time seconds
+    """
+    number = 1
+    while True:
+        started = default_timer()
+        for _ in xrange(number):
+            func()
+        elapsed = default_timer() - started
+        if elapsed >= min_time:
+            break
+        number *= 10
+
+    best = elapsed / number
+    for _ in xrange(repeat - 1):
+        started = default_timer()
+        for _ in xrange(number):
+            func()
+        best = min(best, (default_timer() - started) / number)
+    return best
+#}
+
+def run_micro(names=None, repeat=5, min_time=0.1):  #{
+    """ Run micro-benchmarks (all by default or those with names containing
+        any of the given substrings), returns {<name> : <nanoseconds per op>}
+    """
+    fixtures = _Fixtures()
+    results  = OrderedDict()
+    try:
+        for name, setup in BENCHMARKS.items():
+            if names and not any(part in name for part in names):
+                continue
+            results[name] = measure(setup(fixtures), repeat, min_time) * 1e9
+    finally:
+        fixtures.close()
+    return results
+#}
+
+def save_baseline(results, path):  #{
+    "Save results of run_micro() as a JSON baseline"
+    baseline = dict(
+        meta    = dict(time=time(), python=python_version(), platform=platform()),
+        results = results,
+    )
+    with open(path, 'w') as f:
+        f.write(jsonapi.dumps(baseline))
+#}
+
+def load_baseline(path):  #{
+    "Returns results of a JSON baseline"
+    with open(path) as f:
+        return jsonapi.loads(f.read())['results']
+#}
+
+def compare(baseline, results, tolerance=0.1):  #{
+    """ Compare results with a baseline (both {<name> : <ns per op>}),
+        returns a list of dicts {
+            'name'     : <str>,
+            'baseline' : <float> | None,
+            'current'  : <float> | None,
+            'change'   : <float> | None,  # relative, positive is slower
+            'status'   : 'ok' | 'regression' | 'improvement' | 'new' | 'missing',
+        }
+    """
+    report = []
+    for name in list(results) + sorted(set(baseline) - set(results)):
+        base, current = baseline.get(name), results.get(name)
+        change = None
+        if base is None:
+            status = 'new'
+        elif current is None:
+            status = 'missing'
+        else:
+            change = (current - base) / base
+            if change > tolerance:
+                status = 'regression'
+            elif change < -tolerance:
+                status = 'improvement'
+            else:
+                status = 'ok'
+        report.append(dict(name=name, baseline=base, current=current, change=change, status=status))
+    return report
+#}
+
+
+#-----------------------------------------------------------------------------
+# Command line
+#-----------------------------------------------------------------------------
+
+def main(argv=None):  #{
+    parser = ArgumentParser(prog='python -m netcall.bench.micro',
+                            description='Micro-benchmarks of the NetCall message hot path.')
+    parser.add_argument('names', nargs='*',
+                        help='run benchmarks with names containing any of these (default: all)')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='repeats per benchmark, the best one counts (default: 5)')
+    parser.add_argument('-m', '--min-time', type=float, default=0.1,
+                        help='minimal seconds per repeat (default: 0.1)')
+    parser.add_argument('--save', metavar='FILE',
+                        help='save the results as a JSON baseline')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='compare with a JSON baseline, exit with 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='relative slowdown tolerated by --compare (default: 0.1)')
+    args = parser.parse_args(argv)
+
+    setup_logger(level=WARNING)
+
+    results = run_micro(args.names, args.repeat, args.min_time)
+
+    if args.save:
+        save_baseline(results, args.save)
+
+    if not args.compare:
+        print '%-45s %12s %12s' % ('benchmark', 'ns/op', 'ops/s')
+        for name, ns in results.items():
+            print '%-45s %12.0f %12.0f' % (name, ns, 1e9 / ns)
+        return 0
+
+    baseline = load_baseline(args.compare)
+    if args.names:
+        baseline = dict((name, ns) for name, ns in baseline.items()
+                        if any(part in name for part in args.names))
+
+    report = compare(baseline, results, args.tolerance)
+    number = lambda value, fmt: fmt % value if value is not None else '%12s' % '-'
+
+    print '%-45s %12s %12s %8s  %s' % ('benchmark', 'baseline ns', 'current ns', 'change', 'status')
+    for item in report:
+        print '%-45s %s %s %s  %s' % (
+            item['name'],
+            number(item['baseline'], '%12.0f'),
+            number(item['current'],  '%12.0f'),
+            number(item['change'] and item['change'] * 100, '%+7.1f%%').rjust(8),
+            item['status'].upper() if item['status'] == 'regression' else item['status'],
+        )
+
+    regressions = [item for item in report if item['status'] == 'regression']
+    if regressions:
+        print '\n%s regression(s) beyond %.0f%%' % (len(regressions), args.tolerance * 100)
+        return 1
+    return 0
+#}
+
+
+__all__ = [
+    'BENCHMARKS',
+    'measure',
+    'run_micro',
+    'save_baseline',
+    'load_baseline',
+    'compare',
+]
+
+
+if __name__ == '__main__':
+    sys.exit(main())
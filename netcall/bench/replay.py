@@ -0,0 +1,245 @@
+# vim: fileencoding=utf-8 et ts=4 sts=4 sw=4 tw=0 fdm=marker fmr=#{,#}
+
+"""
+Replay of captured NetCall traffic (see netcall.capture).
+
+Authors:
+
+* Alexander Glyzov
+
+Requests are sent open-loop on the schedule of the capture (scaled by
+speed) regardless of how fast they are answered, so a service sees the
+original traffic shape and latency includes queueing under that load.
+
+Example
+-------
+
+    python -m netcall.bench.replay /tmp/traffic.ncap                    # a summary
+    python -m netcall.bench.replay /tmp/traffic.ncap tcp://127.0.0.1:5555 --speed 2
+
+    from netcall.bench.replay import replay
+    result = replay('/tmp/traffic.ncap', 'tcp://127.0.0.1:5555', speed=2)
+"""
+
+#-----------------------------------------------------------------------------
+#  Copyright (C) 2012-2014. Brian Granger, Min Ragan-Kelley, Alexander Glyzov
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file LICENSE distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+# Imports
+#-----------------------------------------------------------------------------
+
+from __future__ import absolute_import
+
+import sys
+
+from time        import time
+from logging     import WARNING
+from argparse    import ArgumentParser
+from collections import defaultdict
+
+import zmq
+from zmq.utils import jsonapi
+
+from ..capture import read_capture
+from ..metrics import Histogram
+from ..utils   import setup_logger
+
+
+#-----------------------------------------------------------------------------
+# Replay
+#-----------------------------------------------------------------------------
+
+def summary(path):  #{
+    """ Returns a summary of a capture file: {
+            'requests'   : <int>,
+            'seconds'    : <float>,  # from the first request to the last one
+            'rate'       : <float>,  # requests per second
+            'procedures' : {<name> : <number of requests>},
+        }
+    """
+    first = last = None
+    procedures = defaultdict(int)
+    for timestamp, frames in read_capture(path):
+        first = timestamp if first is None else first
+        last  = timestamp
+        procedures[frames[1]] += 1
+
+    requests = sum(procedures.values())
+    seconds  = (last - first) if requests else 0.0
+    return dict(
+        requests   = requests,
+        seconds    = seconds,
+        rate       = requests / seconds if seconds else 0.0,
+        procedures = dict(procedures),
+    )
+#}
+
+def replay(path, urls, speed=1.0, timeout=5.0, limit=None, context=None):  #{
+    """ Send captured requests to a service and wait for their replies,
+        returns a dict {
+            'requests'   : <int>,    # requests sent
+            'replied'    : <int>,    # OK/FAIL replies received
+            'errors'     : <int>,    # FAIL replies
+            'lost'       : <int>,    # requests not answered within timeout
+            'seconds'    : <float>,  # from the first request to the last reply
+            'rate'       : <float>,  # requests sent per second
+            'lag'        : <float>,  # the maximum delay of a request behind schedule
+            'latency'    : <dict>,   # seconds, see Histogram.snapshot
+            'procedures' : {<name> : <dict>},  # latency per procedure
+        }
+
+        Parameters
+        ==========
+        path    : <str> a capture file
+        urls    : <str> | [<str>, ...] urls of the service to connect to
+        speed   : <float> a rate multiplier (2 - twice as fast as captured)
+        timeout : <float> seconds to wait for replies after the last request
+        limit   : [optional] <int> a maximum number of requests to send
+        context : [optional] <zmq.Context>
+    """
+    if speed <= 0:
+        raise ValueError('speed should be positive')
+    if isinstance(urls, basestring):
+        urls = [urls]
+
+    context = context or zmq.Context.instance()
+    socket  = context.socket(zmq.DEALER)
+    for url in urls:
+        socket.connect(url)
+    poller = zmq.Poller()
+    poller.register(socket, zmq.POLLIN)
+
+    latency    = Histogram()
+    procedures = defaultdict(Histogram)
+    pending    = {}  # {<req_id> : (<name>, <sent>)}
+    stats      = dict(requests=0, replied=0, errors=0, lag=0.0)
+
+    def receive(wait):
+        "Receive replies for up to wait seconds"
+        if not poller.poll(max(0, wait) * 1000):
+            return
+        while True:
+            try:
+                msg_list = socket.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                return
+            if len(msg_list) < 3 or msg_list[2] == b'ACK':
+                continue
+            item = pending.pop(msg_list[1], None)
+            if item is None:
+                continue
+            name, sent = item
+            elapsed = time() - sent
+            latency.record(elapsed)
+            procedures[name].record(elapsed)
+            stats['replied'] += 1
+            stats['errors']  += msg_list[2] == b'FAIL'
+
+    started = first = None
+    try:
+        for timestamp, frames in read_capture(path):
+            if limit is not None and stats['requests'] >= limit:
+                break
+            if len(frames) < 5:
+                continue
+
+            if started is None:
+                started, first = time(), timestamp
+            due = started + (timestamp - first) / speed
+            receive(0)  # the ready replies are read even when behind schedule
+            while True:
+                wait = due - time()
+                if wait <= 0:
+                    break
+                receive(wait)
+
+            req_id = b'%x' % stats['requests']
+            now    = time()
+            socket.send_multipart([b'|', req_id] + frames[1:5])
+            if frames[4] != b'1':  # not ignored
+                pending[req_id] = (frames[1], now)
+            stats['requests'] += 1
+            stats['lag'] = max(stats['lag'], now - due)
+
+        deadline = time() + timeout
+        while pending and time() < deadline:
+            receive(deadline - time())
+        finished = time()
+    finally:
+        socket.close(linger=0)
+
+    seconds = (finished - started) if started is not None else 0.0
+    stats.update(
+        lost       = len(pending),
+        seconds    = seconds,
+        rate       = stats['requests'] / seconds if seconds else 0.0,
+        latency    = latency.snapshot(),
+        procedures = dict((name, hist.snapshot()) for name, hist in procedures.items()),
+    )
+    return stats
+#}
+
+
+#-----------------------------------------------------------------------------
+# Command line
+#-----------------------------------------------------------------------------
+
+def main(argv=None):  #{
+    parser = ArgumentParser(prog='python -m netcall.bench.replay',
+                            description='Replay captured NetCall traffic against a service '
+                                        '(or summarize a capture without an url).')
+    parser.add_argument('path', help='a capture file')
+    parser.add_argument('urls', nargs='*', help='urls of the service')
+    parser.add_argument('-s', '--speed', type=float, default=1.0,
+                        help='a rate multiplier (default: 1.0)')
+    parser.add_argument('-t', '--timeout', type=float, default=5.0,
+                        help='seconds to wait for replies after the last request (default: 5)')
+    parser.add_argument('-n', '--limit', type=int,
+                        help='a maximum number of requests to send')
+    parser.add_argument('--json', action='store_true', help='print the result as JSON')
+    args = parser.parse_args(argv)
+
+    setup_logger(level=WARNING)
+
+    if not args.urls:
+        result = summary(args.path)
+        if args.json:
+            print jsonapi.dumps(result)
+            return 0
+        print '%s requests in %.3f sec (%.1f req/s)' % (result['requests'], result['seconds'], result['rate'])
+        for name, count in sorted(result['procedures'].items(), key=lambda item: -item[1]):
+            print '  %-40s %8s' % (name, count)
+        return 0
+
+    result = replay(args.path, args.urls, args.speed, args.timeout, args.limit)
+    if args.json:
+        print jsonapi.dumps(result)
+        return 0 if not result['lost'] else 1
+
+    ms = lambda value: '%9.3f' % (value * 1000) if value is not None else '%9s' % '-'
+    print '%s requests in %.3f sec (%.1f req/s), %s replied, %s errors, %s lost, max lag %.3f ms' % (
+        result['requests'], result['seconds'], result['rate'], result['replied'],
+        result['errors'], result['lost'], result['lag'] * 1000,
+    )
+    print '%-40s %8s %9s %9s %9s %9s' % ('procedure', 'calls', 'p50 ms', 'p99 ms', 'p999 ms', 'max ms')
+    rows = sorted(result['procedures'].items()) + [('(all)', result['latency'])]
+    for name, hist in rows:
+        print '%-40s %8s %s %s %s %s' % (
+            name, hist['count'], ms(hist['p50']), ms(hist['p99']), ms(hist['p999']), ms(hist['max'])
+        )
+    return 0 if not result['lost'] else 1
+#}
+
+
+__all__ = [
+    'summary',
+    'replay',
+]
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,394 @@
+# vim: fileencoding=utf-8 et ts=4 sts=4 sw=4 tw=0 fdm=marker fmr=#{,#}
+
+"""
+End-to-end benchmarks: a local service/client pair per backend.
+
+Authors:
+
+* Alexander Glyzov
+
+Example
+-------
+
+    from netcall.bench import run, sweep
+
+    print run('threading', 'tcp', payload=1024, concurrency=16, requests=10000)
+
+    for result in sweep(backends=['sync', 'gevent'], payloads=[16, 65536]):
+        print result['backend'], result['throughput'], result['latency']['p99']
+"""
+
+#-----------------------------------------------------------------------------
+#  Copyright (C) 2012-2014. Brian Granger, Min Ragan-Kelley, Alexander Glyzov
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file LICENSE distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+# Imports
+#-----------------------------------------------------------------------------
+
+from __future__ import absolute_import
+
+from time      import time
+from abc       import ABCMeta, abstractmethod
+from random    import randint
+from shutil    import rmtree
+from tempfile  import mkdtemp
+from threading import Thread
+from itertools import product
+
+from ..serializer import PickleSerializer, JSONSerializer, MsgPackSerializer, msgpack
+from ..metrics    import Histogram
+from ..utils      import logger, get_zmq_classes, get_green_tools
+
+
+#-----------------------------------------------------------------------------
+# Service/client pairs
+#-----------------------------------------------------------------------------
+
+def _echo(data):  #{
+    return data
+#}
+
+class _Driver(object):  #{
+    """ A local service and its client(s) of a backend, base class.
+
+        Every worker runs a loop of calls in its own thread, greenlet
+        or coroutine depending on the backend.
+    """
+    __metaclass__ = ABCMeta
+
+    def __init__(self, transport, serializer):  #{
+        """
+        Parameters
+        ==========
+        transport  : <str> 'inproc' | 'ipc' | 'tcp'
+        serializer : <Serializer>
+        """
+        self.transport  = transport
+        self.serializer = serializer
+        self.clients    = []
+        self.url        = None
+        self._tmp_dir   = None
+        self.service    = self._create_service()
+        self.service.register(_echo, name='echo')
+        self._bind()
+        self.service.start()
+    #}
+    def _bind(self):  #{
+        if self.transport == 'tcp':
+            port = self.service.bind_ports('127.0.0.1', 0)
+            self.url = 'tcp://127.0.0.1:%s' % port
+            return
+        if self.transport == 'ipc':
+            self._tmp_dir = mkdtemp(prefix='netcall-bench-')
+            self.url = 'ipc://%s/service' % self._tmp_dir
+        else:
+            self.url = 'inproc://netcall-bench-%08x' % randint(0, 0xFFFFFFFF)
+        self.service.bind(self.url)
+    #}
+    @abstractmethod
+    def _create_service(self):  #{
+        """ Returns a service of the backend (not started yet) """
+        pass
+    #}
+    @abstractmethod
+    def _create_client(self):  #{
+        """ Returns a client of the backend (not connected yet) """
+        pass
+    #}
+    def caller(self):  #{
+        """ Returns a callable sending a payload to the echo procedure
+            (a client is shared by the workers unless a backend says otherwise)
+        """
+        if not self.clients:
+            client = self._create_client()
+            client.connect(self.url)
+            self.clients.append(client)
+        client = self.clients[0]
+        return lambda data: client.call('echo', (data,))
+    #}
+    def _loop(self, call, data, count, hist):  #{
+        "Make a number of calls recording their latency, returns a number of errors"
+        errors = 0
+        for _ in xrange(count):
+            started = time()
+            try:
+                call(data)
+            except Exception:
+                errors += 1
+            else:
+                hist.record(time() - started)
+        return errors
+    #}
+    def execute(self, jobs):  #{
+        """ Run [(<call>, <data>, <count>, <Histogram>), ...] concurrently
+            in threads, returns a total number of errors
+        """
+        errors  = []
+        threads = [Thread(target=lambda job=job: errors.append(self._loop(*job))) for job in jobs]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return sum(errors)
+    #}
+    def close(self):  #{
+        for client in self.clients:
+            client.shutdown()
+        self.service.shutdown()
+        if self._tmp_dir is not None:
+            rmtree(self._tmp_dir, ignore_errors=True)
+    #}
+#}
+
+class _ThreadingDriver(_Driver):  #{
+    """ ThreadingRPCService + ThreadingRPCClient shared by worker threads """
+
+    def __init__(self, transport, serializer):  #{
+        Context, _ = get_zmq_classes()
+        self.context = Context()
+        super(_ThreadingDriver, self).__init__(transport, serializer)
+    #}
+    def _create_service(self):  #{
+        from ..threading import ThreadingRPCService
+        return ThreadingRPCService(context=self.context, serializer=self.serializer)
+    #}
+    def _create_client(self):  #{
+        from ..threading import ThreadingRPCClient
+        return ThreadingRPCClient(context=self.context, serializer=self.serializer)
+    #}
+    def close(self):  #{
+        super(_ThreadingDriver, self).close()
+        self.context.term()
+    #}
+#}
+
+class _SyncDriver(_ThreadingDriver):  #{
+    """ ThreadingRPCService + a SyncRPCClient per worker thread """
+
+    def _create_client(self):  #{
+        from ..sync import SyncRPCClient
+        return SyncRPCClient(context=self.context, serializer=self.serializer)
+    #}
+    def caller(self):  #{
+        client = self._create_client()
+        client.connect(self.url)
+        self.clients.append(client)
+        return lambda data: client.call('echo', (data,))
+    #}
+#}
+
+class _GreenDriver(_Driver):  #{
+    """ GreenRPCService + GreenRPCClient shared by worker greenlets """
+
+    green_env = None
+
+    def __init__(self, transport, serializer):  #{
+        Context, _ = get_zmq_classes(env=self.green_env)
+        self.context  = Context()
+        self._spawn   = get_green_tools(env=self.green_env)[0]
+        super(_GreenDriver, self).__init__(transport, serializer)
+    #}
+    def _create_service(self):  #{
+        from ..green import GreenRPCService
+        return GreenRPCService(context=self.context, green_env=self.green_env,
+                               serializer=self.serializer)
+    #}
+    def _create_client(self):  #{
+        from ..green import GreenRPCClient
+        return GreenRPCClient(context=self.context, green_env=self.green_env,
+                              serializer=self.serializer)
+    #}
+    def execute(self, jobs):  #{
+        errors    = []
+        greenlets = [self._spawn(lambda job=job: errors.append(self._loop(*job))) for job in jobs]
+        for greenlet in greenlets:
+            greenlet.join()
+        return sum(errors)
+    #}
+    def close(self):  #{
+        super(_GreenDriver, self).close()
+        self.context.term()
+    #}
+#}
+
+class _GeventDriver(_GreenDriver):  #{
+    green_env = 'gevent'
+#}
+
+class _EventletDriver(_GreenDriver):  #{
+    green_env = 'eventlet'
+#}
+
+class _TornadoDriver(_Driver):  #{
+    """ TornadoRPCService + TornadoRPCClient on one IOLoop,
+        worker coroutines share the client
+    """
+    def __init__(self, transport, serializer):  #{
+        from zmq                  import Context
+        from zmq.eventloop.ioloop import IOLoop
+        from tornado              import gen
+
+        self.context = Context()
+        self.ioloop  = IOLoop()
+        self._gen    = gen
+        super(_TornadoDriver, self).__init__(transport, serializer)
+    #}
+    def _create_service(self):  #{
+        from ..tornado import TornadoRPCService
+        return TornadoRPCService(context=self.context, ioloop=self.ioloop, serializer=self.serializer)
+    #}
+    def _create_client(self):  #{
+        from ..tornado import TornadoRPCClient
+        return TornadoRPCClient(context=self.context, ioloop=self.ioloop, serializer=self.serializer)
+    #}
+    def execute(self, jobs):  #{
+        gen = self._gen
+
+        @gen.coroutine
+        def loop(call, data, count, hist):
+            errors = 0
+            for _ in xrange(count):
+                started = time()
+                try:
+                    yield call(data)
+                except Exception:
+                    errors += 1
+                else:
+                    hist.record(time() - started)
+            raise gen.Return(errors)
+
+        @gen.coroutine
+        def main():
+            errors = yield [loop(*job) for job in jobs]
+            raise gen.Return(sum(errors))
+
+        return self.ioloop.run_sync(main)
+    #}
+    def close(self):  #{
+        super(_TornadoDriver, self).close()
+        self.ioloop.close(all_fds=True)
+        self.context.term()
+    #}
+#}
+
+
+#-----------------------------------------------------------------------------
+# Benchmarks
+#-----------------------------------------------------------------------------
+
+BACKENDS = {
+    'sync'      : _SyncDriver,
+    'threading' : _ThreadingDriver,
+    'tornado'   : _TornadoDriver,
+    'gevent'    : _GeventDriver,
+    'eventlet'  : _EventletDriver,
+}
+TRANSPORTS  = ['inproc', 'ipc', 'tcp']
+SERIALIZERS = {
+    'pickle'  : PickleSerializer,
+    'json'    : JSONSerializer,
+    'msgpack' : MsgPackSerializer,
+}
+
+def run(backend='threading', transport='inproc', payload=100, serializer='pickle',
+        concurrency=1, requests=1000, warmup=100):  #{
+    """ Benchmark echo calls of a payload and return a dict {
+            'backend'     : <str>,
+            'transport'   : <str>,
+            'serializer'  : <str>,
+            'payload'     : <int>,
+            'concurrency' : <int>,
+            'requests'    : <int>,    # calls made
+            'errors'      : <int>,    # calls failed
+            'seconds'     : <float>,  # wall time
+            'throughput'  : <float>,  # successful calls per second
+            'latency'     : <dict>,   # seconds, see Histogram.snapshot
+        }
+
+        Parameters
+        ==========
+        backend     : <str> one of BACKENDS
+        transport   : <str> one of TRANSPORTS
+        payload     : <int> a size of the echoed bytes
+        serializer  : <str> one of SERIALIZERS
+        concurrency : <int> a number of concurrent callers
+        requests    : <int> a total number of calls (split between the callers)
+        warmup      : <int> calls made before measuring (split as well)
+
+        Raises ImportError if a backend or a serializer is not available.
+    """
+    if backend not in BACKENDS:
+        raise ValueError('unknown backend %r' % backend)
+    if transport not in TRANSPORTS:
+        raise ValueError('unknown transport %r' % transport)
+    if serializer not in SERIALIZERS:
+        raise ValueError('unknown serializer %r' % serializer)
+    if serializer == 'msgpack' and msgpack is None:
+        raise ImportError('msgpack is not installed')
+
+    data   = b'x' * payload
+    count  = max(1, requests // concurrency)
+    driver = BACKENDS[backend](transport, SERIALIZERS[serializer]())
+    try:
+        calls = [driver.caller() for _ in range(concurrency)]
+        driver.execute([(call, data, max(1, warmup // concurrency), Histogram()) for call in calls])
+
+        hists   = [Histogram() for _ in calls]
+        started = time()
+        errors  = driver.execute([(call, data, count, hist) for call, hist in zip(calls, hists)])
+        seconds = time() - started
+    finally:
+        driver.close()
+
+    latency = hists[0]
+    for hist in hists[1:]:
+        latency.merge(hist)
+
+    return dict(
+        backend     = backend,
+        transport   = transport,
+        serializer  = serializer,
+        payload     = payload,
+        concurrency = concurrency,
+        requests    = count * concurrency,
+        errors      = errors,
+        seconds     = seconds,
+        throughput  = latency.count / seconds if seconds else 0.0,
+        latency     = latency.snapshot(),
+    )
+#}
+
+def sweep(backends=None, transports=None, payloads=(16, 1024, 65536), serializers=('pickle',),
+          concurrency=(1, 16), requests=1000, warmup=100):  #{
+    """ Run benchmarks for every combination of the parameters
+        (all backends and transports by default) yielding their results
+        (see run). Unavailable backends and serializers are skipped.
+    """
+    backends   = sorted(BACKENDS) if backends is None else backends
+    transports = TRANSPORTS if transports is None else transports
+    missing    = set()
+
+    for backend, serializer, transport, payload, workers in product(
+        backends, serializers, transports, payloads, concurrency
+    ):
+        if (backend, serializer) in missing:
+            continue
+        try:
+            yield run(backend, transport, payload, serializer, workers, requests, warmup)
+        except ImportError, e:
+            logger.warning('skipping %s/%s: %s' % (backend, serializer, e))
+            missing.add((backend, serializer))
+#}
+
+
+__all__ = [
+    'BACKENDS',
+    'TRANSPORTS',
+    'SERIALIZERS',
+    'run',
+    'sweep',
+]
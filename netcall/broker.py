@@ -0,0 +1,640 @@
+# vim: fileencoding=utf-8 et ts=4 sts=4 sw=4 tw=0 fdm=marker fmr=#{,#}
+
+"""
+A broker exposing many services on a single endpoint. Requests are routed
+by procedure name (or namespace) to the pools of workers serving them and
+only to workers with free capacity (a variation of the "Paranoid Pirate"
+pattern from the ZeroMQ guide).
+
+Authors:
+
+* Alexander Glyzov
+
+Example
+-------
+
+The broker:
+
+    from netcall.broker import Broker
+
+    broker = Broker()
+    broker.bind_frontend('tcp://127.0.0.1:5555')  # clients connect here
+    broker.bind_backend('tcp://127.0.0.1:5556')   # workers connect here
+    broker.serve()
+
+Workers (any service flavour can be used):
+
+    from netcall.broker    import BrokerWorker
+    from netcall.threading import ThreadingRPCService
+
+    echo = ThreadingRPCService()
+    echo.register(lambda s: s, name='echo')
+
+    # announces all the registered procedures (kept up to date)
+    worker = BrokerWorker(echo, 'tcp://127.0.0.1:5556', capacity=16)
+    worker.start()
+    echo.start()
+
+    math = ThreadingRPCService()
+    math.register_object(MathObject(), namespace='math')
+
+    # announces the whole 'math' namespace
+    worker = BrokerWorker(math, 'tcp://127.0.0.1:5556', namespaces=['math'])
+    worker.start()
+    math.start()
+
+A client connects to the frontend only and calls both `echo` and `math.*`.
+
+Workers talk to the broker over a DEALER socket. Apart from the RPC replies
+they send control messages starting with an empty frame:
+
+    [b'', b'READY', <capacity>, <pattern>, ...]   a worker is ready to serve
+    [b'', b'PROCS', <pattern>, ...]               a worker updates its patterns
+    [b'', b'HEARTBEAT']                           both ways, every `heartbeat` sec
+    [b'', b'DISCONNECT']                          a worker leaves (no new requests),
+                                                  the broker confirms it with the same
+
+A pattern is either a procedure name, a namespace with a trailing dot
+(b'math.') or an empty string meaning any procedure. A worker announcing
+no patterns serves any procedure.
+"""
+
+#-----------------------------------------------------------------------------
+#  Copyright (C) 2012-2014. Brian Granger, Min Ragan-Kelley, Alexander Glyzov
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file LICENSE distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+# Imports
+#-----------------------------------------------------------------------------
+
+from __future__ import absolute_import
+
+from time        import time, sleep
+from abc         import ABCMeta, abstractmethod
+from random      import randint
+from collections import deque
+
+import zmq
+
+from zmq.utils import jsonapi
+
+from .utils import logger, get_zmq_classes, start_native_thread, pool_size
+
+
+READY      = b'READY'
+PROCS      = b'PROCS'
+HEARTBEAT  = b'HEARTBEAT'
+DISCONNECT = b'DISCONNECT'
+
+
+#-----------------------------------------------------------------------------
+# Utilities
+#-----------------------------------------------------------------------------
+
+class _Runner(object):  #{
+    """ Runs a poll loop in a native thread and steers it over a PAIR socket """
+    __metaclass__ = ABCMeta
+
+    def __init__(self, context=None):  #{
+        if context is None:
+            Context, _ = get_zmq_classes()
+            context = Context.instance()
+
+        # a native (non-green) view of the same underlying context
+        self.context = context
+        self._native = zmq.Context.shadow(context.underlying)
+
+        ctrl_addr = 'inproc://%s-ctrl-%08x' % (self.__class__.__name__, randint(0, 0xFFFFFFFF))
+        self._ctrl_in = self._native.socket(zmq.PAIR)
+        self._ctrl_in.bind(ctrl_addr)
+        self._ctrl = context.socket(zmq.PAIR)
+        self._ctrl.connect(ctrl_addr)
+
+        self._started = False
+        self._done    = False
+    #}
+    @abstractmethod
+    def _loop(self):  #{
+        """ The poll loop (in the native thread) """
+        pass
+    #}
+    def _run(self):  #{
+        try:
+            self._loop()
+        except zmq.ContextTerminated:
+            pass
+        except Exception, e:
+            logger.error(e, exc_info=True)
+        finally:
+            self._close()
+            self._ctrl_in.close(0)
+            self._done = True
+            logger.debug('%s thread exited' % self.__class__.__name__)
+    #}
+    def _close(self):  #{
+        pass
+    #}
+
+    def start(self):  #{
+        """ Start serving in a native thread (non-blocking) """
+        assert not self._started, 'already started'
+        self._started = True
+        start_native_thread(self._run)
+    #}
+    def serve(self):  #{
+        """ Start serving and wait for the thread to exit (blocking) """
+        self._started or self.start()
+        self.join()
+    #}
+    def is_alive(self):  #{
+        return self._started and not self._done
+    #}
+    def join(self, timeout=None):  #{
+        """ Wait for the thread to exit """
+        deadline = None if timeout is None else time() + timeout
+        while self._started and not self._done:
+            if deadline is not None and time() >= deadline:
+                break
+            sleep(0.01)
+    #}
+    def stop(self, timeout=None):  #{
+        """ Signal the thread to exit and wait for it """
+        if self.is_alive():
+            self._ctrl.send(b'TERMINATE')
+            self.join(timeout)
+        elif not self._started:
+            self._close()
+            self._ctrl_in.close(0)
+        self._ctrl.close(0)
+    #}
+#}
+
+def _parse_route(msg_list):  #{
+    """ Returns (key, boundary) of a request/reply or (None, None) when
+        the message is malformed. The key identifies a request:
+        (<id>, ..., b'|', req_id)
+    """
+    try:
+        boundary = msg_list.index(b'|')
+    except ValueError:
+        return None, None
+    if len(msg_list) < boundary + 3:
+        return None, None
+    return tuple(msg_list[:boundary+2]), boundary
+#}
+
+
+#-----------------------------------------------------------------------------
+# Broker
+#-----------------------------------------------------------------------------
+
+class _Worker(object):  #{
+    """ Broker-side state of a worker """
+
+    def __init__(self, identity, capacity, expiry):
+        self.identity = identity
+        self.capacity = capacity
+        self.expiry   = expiry
+        self.patterns = set()  # names or namespaces it serves
+        self.requests = {}     # {<key> : <ignore:bool>}
+        self.active   = True   # False after DISCONNECT
+
+    def has_credit(self):
+        return self.active and len(self.requests) < self.capacity
+#}
+
+class Broker(_Runner):  #{
+    """ A ROUTER-ROUTER broker routing requests by procedure name to pools
+        of workers. Within a pool a request goes to the least recently used
+        worker with free capacity or waits in the pool queue. Dead workers
+        are detected with heartbeats and their outstanding requests are
+        failed immediately.
+    """
+    def __init__(self, context=None, heartbeat=1.0, liveness=3, max_queue=10000):  #{
+        """
+        Parameters
+        ==========
+        context   : <Context>
+            An existing ZMQ Context instance (plain or green), if not passed
+            get_zmq_classes() will be used to obtain a compatible Context class.
+        heartbeat : <float> seconds between heartbeats
+        liveness  : <int> number of missed heartbeats before a worker is dead
+        max_queue : <int>
+            Max number of requests waiting for a free worker, the broker stops
+            reading clients when it is reached.
+        """
+        super(Broker, self).__init__(context)
+
+        self.heartbeat = heartbeat
+        self.liveness  = liveness
+        self.max_queue = max_queue
+
+        self.frontend = self._native.socket(zmq.ROUTER)
+        self.backend  = self._native.socket(zmq.ROUTER)
+        self.backend.setsockopt(zmq.ROUTER_HANDOVER, 1)
+
+        self.workers = {}  # {<identity> : <_Worker>}
+        self.pools   = {}  # {<pattern>  : deque([<identity>, ...])}
+        self.queues  = {}  # {<pattern>  : deque([<request>, ...])}
+        self._queued = 0
+    #}
+    def _close(self):  #{
+        self.frontend.close(0)
+        self.backend.close(0)
+    #}
+    def _fail(self, key, ename, evalue):  #{
+        """ Send a FAIL reply on behalf of a worker """
+        data = jsonapi.dumps(dict(
+            ename     = ename,
+            evalue    = evalue,
+            traceback = None,
+        ))
+        self.frontend.send_multipart(list(key) + [b'FAIL', data])
+    #}
+    def _resolve(self, name):  #{
+        """ Returns a pattern of the pool serving a procedure or None """
+        pools = self.pools
+        if name in pools:
+            return name
+        while name:
+            name = name.rpartition('.')[0]
+            if name + '.' in pools:
+                return name + '.'
+        if '' in pools:
+            return ''
+        return None
+    #}
+    def _set_patterns(self, worker, patterns):  #{
+        patterns = set(patterns)
+        identity = worker.identity
+        pools    = self.pools
+
+        for pattern in worker.patterns - patterns:
+            pool = pools[pattern]
+            pool.remove(identity)
+            if not pool:
+                del pools[pattern]
+                self._drop_queue(pattern, 'no workers serve %r' % pattern)
+
+        for pattern in patterns - worker.patterns:
+            pools.setdefault(pattern, deque()).append(identity)
+
+        worker.patterns = patterns
+        self._on_credit(worker)
+    #}
+    def _drop_queue(self, pattern, error):  #{
+        for msg_list in self.queues.pop(pattern, ()):
+            self._queued -= 1
+            key, _ = _parse_route(msg_list)
+            self._fail(key, 'RPCError', error)
+    #}
+    def _purge(self, worker, reason):  #{
+        """ Forget a worker failing all its outstanding requests """
+        logger.warning('worker %r is %s' % (worker.identity, reason))
+        self.workers.pop(worker.identity, None)
+        self._set_patterns(worker, ())
+        for key, ignore in worker.requests.iteritems():
+            if not ignore:
+                self._fail(key, 'RPCError', 'worker %r is %s' % (worker.identity, reason))
+        worker.requests.clear()
+    #}
+    def _on_control(self, identity, cmd, args):  #{
+        worker = self.workers.get(identity)
+
+        if cmd == READY:
+            if worker is not None:
+                self._purge(worker, 'restarted')
+            worker = _Worker(identity, int(args[0]), 0)
+            self.workers[identity] = worker
+            self._set_patterns(worker, args[1:] or [''])
+            logger.debug('worker %r is ready (capacity=%s, patterns=%r)' % (
+                identity, worker.capacity, sorted(worker.patterns)
+            ))
+
+        elif cmd == PROCS and worker is not None:
+            self._set_patterns(worker, args or [''])
+
+        elif cmd == DISCONNECT and worker is not None:
+            logger.debug('worker %r disconnects' % identity)
+            worker.active = False
+            # nothing is routed to it after the confirmation
+            self.backend.send_multipart([identity, b'', DISCONNECT])
+            if not worker.requests:
+                self._purge(worker, 'disconnected')
+    #}
+    def _on_credit(self, worker):  #{
+        """ Pass queued requests to a worker that has free capacity """
+        queues = self.queues
+        for pattern in worker.patterns:
+            queue = queues.get(pattern)
+            while queue and worker.has_credit():
+                self._queued -= 1
+                self._send(worker, queue.popleft())
+            if queue is not None and not queue:
+                del queues[pattern]
+    #}
+    def _on_reply(self, worker, msg_list):  #{
+        key, boundary = _parse_route(msg_list)
+        if key is None:
+            logger.error('bad reply: %r' % msg_list)
+            return
+
+        self.frontend.send_multipart(msg_list)
+
+        if worker is None:
+            return
+
+        msg_type = msg_list[boundary+2]
+        requests = worker.requests
+
+        if msg_type == b'ACK' and not requests.get(key, False):
+            return  # wait for the result unless the result is ignored
+
+        if requests.pop(key, None) is None:
+            return
+
+        if not worker.active:
+            if not requests:
+                self._purge(worker, 'disconnected')
+        else:
+            self._on_credit(worker)
+    #}
+    def _send(self, worker, msg_list):  #{
+        key, boundary = _parse_route(msg_list)
+        worker.requests[key] = msg_list[boundary+5] == b'1'
+        self.backend.send_multipart([worker.identity] + msg_list)
+    #}
+    def _dispatch(self, msg_list):  #{
+        key, boundary = _parse_route(msg_list)
+        if key is None or len(msg_list) < boundary + 6:
+            logger.error('bad request: %r' % msg_list)
+            return
+
+        name    = msg_list[boundary+2]
+        pattern = self._resolve(name)
+        if pattern is None:
+            self._fail(key, 'NotImplementedError', 'Unregistered procedure %r' % name)
+            return
+
+        pool = self.pools[pattern]
+        for _ in xrange(len(pool)):
+            identity = pool[0]
+            pool.rotate(-1)
+            worker = self.workers[identity]
+            if worker.has_credit():
+                self._send(worker, msg_list)
+                return
+
+        self.queues.setdefault(pattern, deque()).append(msg_list)
+        self._queued += 1
+    #}
+    def _loop(self):  #{
+        frontend = self.frontend
+        backend  = self.backend
+        ctrl     = self._ctrl_in
+        workers  = self.workers
+        interval = self.heartbeat
+
+        poll_all = zmq.Poller()
+        poll_all.register(ctrl,     zmq.POLLIN)
+        poll_all.register(backend,  zmq.POLLIN)
+        poll_all.register(frontend, zmq.POLLIN)
+
+        poll_workers = zmq.Poller()
+        poll_workers.register(ctrl,    zmq.POLLIN)
+        poll_workers.register(backend, zmq.POLLIN)
+
+        heartbeat_at = time() + interval
+
+        while True:
+            # stop reading clients when the queues are full
+            poller = poll_all if self._queued < self.max_queue else poll_workers
+            events = dict(poller.poll(max(0, heartbeat_at - time()) * 1000))
+
+            if ctrl in events:
+                ctrl.recv()
+                break
+
+            now = time()
+
+            if backend in events:
+                msg_list = backend.recv_multipart()
+                identity = msg_list[0]
+                worker   = workers.get(identity)
+
+                if worker is not None:
+                    worker.expiry = now + interval * self.liveness
+
+                if len(msg_list) > 2 and msg_list[1] == b'':
+                    self._on_control(identity, msg_list[2], msg_list[3:])
+                    worker = workers.get(identity)
+                    if worker is not None:
+                        worker.expiry = now + interval * self.liveness
+                else:
+                    self._on_reply(worker, msg_list[1:])
+
+            if frontend in events:
+                self._dispatch(frontend.recv_multipart())
+
+            if now >= heartbeat_at:
+                for identity, worker in workers.items():
+                    if now > worker.expiry:
+                        self._purge(worker, 'dead')
+                    else:
+                        backend.send_multipart([identity, b'', HEARTBEAT])
+                heartbeat_at = now + interval
+    #}
+
+    #-------------------------------------------------------------------------
+    # Public API
+    #-------------------------------------------------------------------------
+
+    def bind_frontend(self, url):  #{
+        """ Bind the client side of the broker """
+        self.frontend.bind(url)
+    #}
+    def bind_backend(self, url):  #{
+        """ Bind the worker side of the broker """
+        self.backend.bind(url)
+    #}
+#}
+
+
+#-----------------------------------------------------------------------------
+# Broker Worker
+#-----------------------------------------------------------------------------
+
+class BrokerWorker(_Runner):  #{
+    """ Connects a service to a Broker.
+
+        The service is bound to a private inproc endpoint and the worker
+        relays requests and replies between it and the broker, announcing
+        the capacity of the service and the procedures it serves and
+        exchanging heartbeats. If the broker stays silent for `liveness`
+        heartbeats the worker reconnects.
+    """
+    def __init__(self, service, url, capacity=None, namespaces=None, heartbeat=1.0, liveness=3):  #{
+        """
+        Parameters
+        ==========
+        service    : <RPCServiceBase> a service instance (not started yet)
+        url        : <str> the backend url of a Broker
+        capacity   : [optional] <int>
+            Number of requests the service can handle concurrently
+            (default: the capacity of a threading service or 128).
+        namespaces : [optional] [<str>, ...]
+            Namespaces to announce (an empty string means any procedure).
+            By default the names of all the registered procedures (except
+            the reserved '_netcall.*' ones) are announced and updated as
+            new procedures get registered.
+        heartbeat  : <float> seconds between heartbeats
+        liveness   : <int> number of missed heartbeats before reconnecting
+        """
+        super(BrokerWorker, self).__init__(service.context)
+
+        if capacity is None:
+            capacity = getattr(service, 'capacity', None) or pool_size(None)
+
+        self.service    = service
+        self.url        = url
+        self.capacity   = capacity
+        self.namespaces = namespaces
+        self.heartbeat  = heartbeat
+        self.liveness   = liveness
+
+        self.inproc_url = 'inproc://%s-%s' % (self.__class__.__name__, service.identity)
+        service.bind(self.inproc_url)
+
+        self.frontend   = None
+        self.backend    = self._native.socket(zmq.DEALER)
+        self._announced = []
+
+        self.backend.connect(self.inproc_url)
+    #}
+    def _connect(self):  #{
+        """ (Re)connect to the broker announcing readiness """
+        if self.frontend is not None:
+            self.frontend.close(0)
+        socket = self._native.socket(zmq.DEALER)
+        socket.setsockopt(zmq.IDENTITY, self.service.identity)
+        socket.connect(self.url)
+        socket.send_multipart(self._ready_msg())
+        self.frontend = socket
+        return socket
+    #}
+    def _patterns(self):  #{
+        if self.namespaces is None:
+            # the reserved procedures answer for a particular worker,
+            # they are called on its service directly
+            return sorted(name for name in self.service.procedures.keys()
+                          if not name.startswith('_netcall.'))
+        return sorted(ns and ns + '.' for ns in self.namespaces)
+    #}
+    def _ready_msg(self):  #{
+        self._announced = self._patterns()
+        return [b'', READY, bytes(self.capacity)] + self._announced
+    #}
+    def _close(self):  #{
+        # let the last replies reach the broker
+        self.frontend is not None and self.frontend.close(int(self.heartbeat * 1000))
+        self.backend.close(0)
+    #}
+    def _loop(self):  #{
+        ctrl     = self._ctrl_in
+        backend  = self.backend
+        frontend = self._connect()
+        interval = self.heartbeat
+        leaving  = False   # DISCONNECT is sent
+        left     = False   # ... and confirmed by the broker
+        pending  = {}      # {<key> : <ignore:bool>} requests relayed to the service
+
+        poller = zmq.Poller()
+        poller.register(ctrl,     zmq.POLLIN)
+        poller.register(backend,  zmq.POLLIN)
+        poller.register(frontend, zmq.POLLIN)
+
+        heartbeat_at = time() + interval
+        expiry       = time() + interval * self.liveness
+
+        while True:
+            events = dict(poller.poll(max(0, heartbeat_at - time()) * 1000))
+
+            if ctrl in events:
+                cmd = ctrl.recv()
+                if not leaving:
+                    frontend.send_multipart([b'', DISCONNECT])
+                    leaving = True
+                if cmd != DISCONNECT:
+                    # relay the replies left
+                    while backend.poll(0):
+                        frontend.send_multipart(backend.recv_multipart())
+                    break
+
+            now = time()
+
+            if frontend in events:
+                msg_list = frontend.recv_multipart()
+                expiry   = now + interval * self.liveness
+                if msg_list[0] != b'':
+                    key, boundary = _parse_route(msg_list)
+                    if key is not None and len(msg_list) > boundary + 5:
+                        pending[key] = msg_list[boundary+5] == b'1'
+                    backend.send_multipart(msg_list)
+                elif msg_list[1:2] == [DISCONNECT]:
+                    left = True
+
+            if backend in events:
+                msg_list = backend.recv_multipart()
+                key, boundary = _parse_route(msg_list)
+                if key is not None and (msg_list[boundary+2] != b'ACK' or pending.get(key)):
+                    pending.pop(key, None)
+                frontend.send_multipart(msg_list)
+
+            if left and not pending:
+                ctrl.send(DISCONNECT)  # let drain() shut the service down
+                left = None
+
+            if now >= heartbeat_at and leaving:
+                # stay alive until the broker forgets us (no reconnects)
+                frontend.send_multipart([b'', HEARTBEAT])
+                heartbeat_at = now + interval
+            elif now >= heartbeat_at:
+                if now > expiry:
+                    logger.warning('broker %s is silent, reconnecting' % self.url)
+                    poller.unregister(frontend)
+                    frontend = self._connect()
+                    poller.register(frontend, zmq.POLLIN)
+                    expiry = now + interval * self.liveness
+                else:
+                    frontend.send_multipart([b'', HEARTBEAT])
+                    patterns = self._patterns()
+                    if patterns != self._announced:
+                        self._announced = patterns
+                        frontend.send_multipart([b'', PROCS] + patterns)
+                heartbeat_at = now + interval
+    #}
+
+    def drain(self, timeout=None):  #{
+        """ Leave the broker gracefully (blocking).
+
+            The broker stops routing new requests to the worker and confirms
+            it, the requests relayed before are let finish and their replies
+            are relayed, then the service is shut down (see RPCServiceBase.drain).
+            No request is rejected as the service only drains once nothing
+            is left in flight (or the timeout has passed).
+
+            Returns True if all the in-flight requests have finished in time.
+        """
+        deadline = None if timeout is None else time() + timeout
+        if self.is_alive():
+            self._ctrl.send(DISCONNECT)
+            if self._ctrl.poll(None if deadline is None else max(0, deadline - time()) * 1000):
+                self._ctrl.recv()
+        finished = self.service.drain(None if deadline is None else max(0, deadline - time()))
+        self.stop(None if deadline is None else max(0, deadline - time()))
+        return finished
+    #}
+#}
@@ -0,0 +1,101 @@
+# vim: fileencoding=utf-8 et ts=4 sts=4 sw=4 tw=0 fdm=marker fmr=#{,#}
+
+"""
+Result caches for NetCall services.
+
+Authors:
+
+* Alexander Glyzov
+
+Example
+-------
+
+    from netcall       import LRU
+    from netcall.green import GreenRPCService
+
+    service = GreenRPCService()
+
+    @service.register(cache=LRU(maxsize=1000, ttl=60))
+    def lookup(key):
+        return db.get(key)
+"""
+
+#-----------------------------------------------------------------------------
+#  Copyright (C) 2012-2014. Brian Granger, Min Ragan-Kelley, Alexander Glyzov
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file LICENSE distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+# Imports
+#-----------------------------------------------------------------------------
+
+from __future__ import absolute_import
+
+from time        import time
+from threading   import Lock
+from collections import OrderedDict
+
+
+#-----------------------------------------------------------------------------
+# LRU cache
+#-----------------------------------------------------------------------------
+
+class LRU(object):  #{
+    """ A thread-safe least recently used cache with an optional time-to-live.
+
+        A service keeps the serialized result frames here keyed by
+        the procedure name and the raw argument frames of a request.
+    """
+    def __init__(self, maxsize=1024, ttl=None):  #{
+        """
+        Parameters
+        ==========
+        maxsize : <int> a maximum number of entries
+        ttl     : [optional] <float>
+            Seconds an entry stays valid (no expiration by default).
+        """
+        if maxsize < 1:
+            raise ValueError('maxsize should be positive')
+
+        self.maxsize = maxsize
+        self.ttl     = ttl
+        self.hits    = 0
+        self.misses  = 0
+
+        self._data = OrderedDict()  # {<key> : (<expires>, <value>)}
+        self._lock = Lock()
+    #}
+    def get(self, key, default=None):  #{
+        """ Returns a cached value or default if there is no such key
+            or the entry has expired
+        """
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is not None:
+                expires, value = item
+                if expires is None or expires > time():
+                    self._data[key] = item  # most recently used
+                    self.hits += 1
+                    return value
+            self.misses += 1
+            return default
+    #}
+    def set(self, key, value):  #{
+        """ Store a value evicting the least recently used entry if full """
+        expires = None if self.ttl is None else time() + self.ttl
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (expires, value)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+    #}
+    def clear(self):  #{
+        with self._lock:
+            self._data.clear()
+    #}
+    def __len__(self):  #{
+        return len(self._data)
+    #}
+#}
@@ -0,0 +1,220 @@
+# vim: fileencoding=utf-8 et ts=4 sts=4 sw=4 tw=0 fdm=marker fmr=#{,#}
+
+"""
+Capturing of NetCall requests to a compact file (see netcall.bench.replay).
+
+Authors:
+
+* Alexander Glyzov
+
+Example
+-------
+
+    from netcall.capture import Capture, read_capture
+
+    capture = Capture('/tmp/traffic.ncap', sample=0.1)  # every 10th request
+    service.add_middleware(capture)
+    ...
+    service.remove_middleware(capture)
+    capture.close()
+
+    for timestamp, frames in read_capture('/tmp/traffic.ncap'):
+        req_id, name, args, kwargs, ignore = frames[:5]
+
+File format: a magic header followed by records of a timestamp (a double),
+a number of frames (uint16) and the frames, each prefixed with its length
+(uint32), all little-endian. Frames of a request are stored without its
+route: [req_id, proc_name, <ser_args>, <ser_kwargs>, <ignore>].
+"""
+
+#-----------------------------------------------------------------------------
+#  Copyright (C) 2012-2014. Brian Granger, Min Ragan-Kelley, Alexander Glyzov
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file LICENSE distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+# Imports
+#-----------------------------------------------------------------------------
+
+from __future__ import absolute_import
+
+from time        import time, sleep
+from struct      import Struct
+from random      import random
+from threading   import Lock
+from collections import deque
+
+from .utils import logger, get_original, start_native_thread
+
+
+#-----------------------------------------------------------------------------
+# File format
+#-----------------------------------------------------------------------------
+
+MAGIC   = b'NCAP\x01'
+_RECORD = Struct('<dH')  # timestamp, number of frames
+_FRAME  = Struct('<I')   # frame length
+
+def read_capture(path):  #{
+    """ Yields (<timestamp>, [<frame>, ...]) records of a capture file
+        (a path or a file object). A truncated last record (e.g. written
+        by a crashed service) ends the iteration.
+    """
+    f = open(path, 'rb') if isinstance(path, basestring) else path
+    try:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('not a capture file: %r' % path)
+        while True:
+            header = f.read(_RECORD.size)
+            if len(header) < _RECORD.size:
+                return  # the end (or a truncated record)
+            timestamp, count = _RECORD.unpack(header)
+            frames = []
+            for _ in xrange(count):
+                header = f.read(_FRAME.size)
+                if len(header) < _FRAME.size:
+                    return
+                size, = _FRAME.unpack(header)
+                frame = f.read(size)
+                if len(frame) < size:
+                    return
+                frames.append(frame)
+            yield timestamp, frames
+    finally:
+        if f is not path:
+            f.close()
+#}
+
+
+#-----------------------------------------------------------------------------
+# Capture
+#-----------------------------------------------------------------------------
+
+class Capture(object):  #{
+    """ Writes requests to a capture file.
+
+        It is a service middleware (see RPCServiceBase.add_middleware)
+        recording every accepted request (or a random sample of them)
+        except the reserved '_netcall.*' procedures. Raw frames could
+        be written with write() as well.
+
+        Records are queued in memory and written to the file by a native
+        writer thread every flush_interval seconds, so the disk latency
+        does not land on the I/O thread (or the hub) handling requests.
+    """
+    def __init__(self, path, sample=1.0, limit=None, flush_interval=0.1):  #{
+        """
+        Parameters
+        ==========
+        path   : <str> | <file> a file to write to (truncated)
+        sample : <float> a fraction of requests to capture (0..1]
+        limit  : [optional] <int> a maximum number of records
+        flush_interval : <float> seconds between writes of the queued records
+        """
+        if not 0 < sample <= 1:
+            raise ValueError('sample should be within (0, 1]')
+
+        self.file   = open(path, 'wb') if isinstance(path, basestring) else path
+        self.sample = sample
+        self.limit  = limit
+        self.count  = 0
+        self._lock  = Lock()
+
+        self.flush_interval = flush_interval
+
+        self._queue    = deque()  # records waiting for the writer thread
+        self._io_lock  = get_original('thread', 'allocate_lock')()  # a native lock of the file
+        self._closing  = False
+        self._done     = False
+
+        self.file.write(MAGIC)
+        start_native_thread(self._writer)
+    #}
+    def _drain(self):  #{
+        "Write the queued records to the file"
+        queue = self._queue
+        with self._io_lock:
+            if not queue:
+                return
+            chunks = []
+            while queue:
+                chunks.append(queue.popleft())
+            self.file.write(b''.join(chunks))
+    #}
+    def _writer(self):  #{
+        """ The writer thread """
+        native_sleep = get_original('time', 'sleep')
+        try:
+            while not self._closing:
+                native_sleep(self.flush_interval)
+                self._drain()
+        except Exception, e:
+            logger.error(e, exc_info=True)
+        finally:
+            self._done = True
+    #}
+    @property
+    def closed(self):  #{
+        return self._closing
+    #}
+    def write(self, frames, timestamp=None):  #{
+        """ Write a record of frames (a request without its route),
+            returns False if the capture is closed or full
+        """
+        chunks = [_RECORD.pack(timestamp or time(), len(frames))]
+        for frame in frames:
+            frame = bytes(frame)
+            chunks.append(_FRAME.pack(len(frame)))
+            chunks.append(frame)
+
+        with self._lock:
+            if self._closing:
+                return False
+            if self.limit is not None and self.count >= self.limit:
+                return False
+            self._queue.append(b''.join(chunks))
+            self.count += 1
+        return True
+    #}
+    def before_dispatch(self, request):  #{
+        name = request.name
+        if name.startswith('_netcall.') or (self.sample < 1 and random() >= self.sample):
+            return
+        frames = [request.req_id, name]
+        frames.extend(request.data)
+        frames.append(b'1' if request.ignore else b'0')
+        try:
+            self.write(frames, request.received)
+        except Exception:
+            logger.error('failed to capture a request', exc_info=True)
+    #}
+    def flush(self):  #{
+        """ Write the queued records and flush the file (blocking) """
+        if self.file is None:
+            return
+        self._drain()
+        with self._io_lock:
+            self.file.flush()
+    #}
+    def close(self):  #{
+        """ Stop the writer thread, write the queued records and close the file """
+        with self._lock:
+            if self._closing:
+                return
+            self._closing = True
+
+        while not self._done:
+            sleep(0.01)
+        self._drain()
+        self.file.close()
+        self.file = None
+    #}
+#}
+
+
+__all__ = [
+    'Capture',
+    'read_capture',
+]
@@ -0,0 +1,305 @@
+# vim: fileencoding=utf-8 et ts=4 sts=4 sw=4 tw=0 fdm=marker fmr=#{,#}
+
+"""
+ZeroMQ devices to put in front of NetCall services.
+
+Authors:
+
+* Alexander Glyzov
+
+Example
+-------
+
+    from netcall.devices import ProxyDevice
+
+    device = ProxyDevice()              # ROUTER -> DEALER
+    device.bind_in('tcp://127.0.0.1:5555')
+    device.bind_out('ipc:///tmp/echo.service')
+    device.start()
+    ...
+    device.pause()
+    device.resume()
+    device.stats()
+    device.terminate()
+
+    # copy a tenth of the requests to a shadow service, its replies are discarded
+    device = ProxyDevice(shadow='tcp://10.0.0.2:5555', shadow_fraction=0.1)
+"""
+
+#-----------------------------------------------------------------------------
+#  Copyright (C) 2012-2014. Brian Granger, Min Ragan-Kelley, Alexander Glyzov
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file LICENSE distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+# Imports
+#-----------------------------------------------------------------------------
+
+from __future__ import absolute_import
+
+from time      import time, sleep
+from struct    import unpack
+from random    import randint, random
+from threading import Lock
+
+import zmq
+
+from .utils import logger, get_zmq_classes, start_native_thread
+
+
+# the frame after req_id in replies (see RPCServiceBase._build_reply)
+_REPLY_TYPES = frozenset([b'ACK', b'OK', b'FAIL'])
+
+#-----------------------------------------------------------------------------
+# Proxy Device
+#-----------------------------------------------------------------------------
+
+class ProxyDevice(object):  #{
+    """ A proxy device running zmq.proxy_steerable in a native thread.
+
+        Unlike utils.green_device it shuttles messages in C without holding the GIL,
+        so it works at full speed even in a Gevent/Eventlet process. The device
+        is steered (paused/resumed/terminated) over an internal control socket.
+
+        Requests could be mirrored to a shadow endpoint: the proxy copies
+        messages to an internal PUB socket (never blocking it) and a mirror
+        thread forwards a sample of the requests with non-blocking sends,
+        so a slow shadow loses copies instead of slowing the primary path.
+    """
+    def __init__(self, in_type=zmq.ROUTER, out_type=zmq.DEALER, context=None, capture=None,
+                 shadow=None, shadow_fraction=1.0, shadow_hwm=1000):  #{
+        """
+        Parameters
+        ==========
+        in_type  : <int> a ZMQ socket type of the front (ROUTER by default)
+        out_type : <int> a ZMQ socket type of the back (DEALER by default)
+        context  : <Context>
+            An existing ZMQ Context instance (plain or green), if not passed
+            get_zmq_classes() will be used to obtain a compatible Context class.
+            The device shares it so inproc endpoints work as usual.
+        capture  : [optional] <str>
+            An url to bind a PUB socket to, all the messages passing through
+            the device are copied there.
+        shadow   : [optional] <str> | [<str>, ...]
+            Url(s) of a shadow service to copy requests to (not the reserved
+            '_netcall.*' ones). Its replies are discarded.
+        shadow_fraction : <float> a fraction of requests to copy (0..1]
+        shadow_hwm      : <int> a number of copies queued for the shadow
+            before new ones are dropped
+        """
+        if shadow is not None and not 0 < shadow_fraction <= 1:
+            raise ValueError('shadow_fraction should be within (0, 1]')
+        if isinstance(shadow, basestring):
+            shadow = [shadow]
+
+        if context is None:
+            Context, _ = get_zmq_classes()
+            context = Context.instance()
+
+        # a native (non-green) view of the same underlying context
+        native = zmq.Context.shadow(context.underlying)
+
+        self.context        = context
+        self.in_socket      = native.socket(in_type)
+        self.out_socket     = native.socket(out_type)
+        self.capture_socket = None
+        self.mirror_socket  = None
+        self.shadow_socket  = None
+
+        if capture is not None or shadow is not None:
+            self.capture_socket = native.socket(zmq.PUB)
+        if capture is not None:
+            self.capture_socket.bind(capture)
+        if shadow is not None:
+            mirror_addr = 'inproc://%s-mirror-%08x' % (self.__class__.__name__, randint(0, 0xFFFFFFFF))
+            self.capture_socket.bind(mirror_addr)
+            self.mirror_socket = native.socket(zmq.SUB)
+            self.mirror_socket.setsockopt(zmq.SUBSCRIBE, b'')
+            self.mirror_socket.connect(mirror_addr)
+
+            self.shadow_socket = native.socket(zmq.DEALER)
+            self.shadow_socket.setsockopt(zmq.SNDHWM, shadow_hwm)
+            self.shadow_socket.setsockopt(zmq.LINGER, 0)
+            for url in shadow:
+                self.shadow_socket.connect(url)
+
+        self.shadow_fraction = shadow_fraction
+        self._shadow_stats   = dict(mirrored=0, dropped=0, replies=0)
+
+        ctrl_addr = 'inproc://%s-ctrl-%08x' % (self.__class__.__name__, randint(0, 0xFFFFFFFF))
+        self._ctrl_dev = native.socket(zmq.PAIR)
+        self._ctrl_dev.bind(ctrl_addr)
+        self._ctrl = context.socket(zmq.PAIR)
+        self._ctrl.connect(ctrl_addr)
+
+        self._lock    = Lock()
+        self._started = False
+        self._done    = False
+    #}
+    def _sockets(self):  #{
+        return filter(None, [self.in_socket, self.out_socket, self.capture_socket, self._ctrl_dev])
+    #}
+    def _run(self):  #{
+        """ The device thread """
+        try:
+            zmq.proxy_steerable(self.in_socket, self.out_socket, self.capture_socket, self._ctrl_dev)
+        except zmq.ContextTerminated:
+            pass
+        except Exception, e:
+            logger.error(e, exc_info=True)
+        finally:
+            for socket in self._sockets():
+                socket.close(0)
+            self._done = True
+            logger.debug('device thread exited')
+    #}
+    def _mirror(self):  #{
+        """ The mirror thread: forwards copies of requests to the shadow
+            and discards its replies
+        """
+        mirror, shadow = self.mirror_socket, self.shadow_socket
+        fraction = self.shadow_fraction
+        counters = self._shadow_stats
+        poller   = zmq.Poller()
+        poller.register(mirror, zmq.POLLIN)
+        poller.register(shadow, zmq.POLLIN)
+        try:
+            while not self._done:
+                for socket, _ in poller.poll(100):
+                    if socket is shadow:
+                        shadow.recv_multipart()
+                        counters['replies'] += 1
+                        continue
+
+                    msg_list = mirror.recv_multipart()
+                    try:
+                        boundary = msg_list.index(b'|')
+                    except ValueError:
+                        continue
+                    # the capture taps both directions: skip the replies (their
+                    # req_id is followed by a reply type, not a procedure name)
+                    if len(msg_list) - boundary < 6:
+                        continue
+                    proc = msg_list[boundary+2]
+                    if proc in _REPLY_TYPES or proc.startswith(b'_netcall.'):
+                        continue
+                    if fraction < 1 and random() >= fraction:
+                        continue
+                    try:
+                        shadow.send_multipart(msg_list[boundary:], zmq.NOBLOCK)
+                    except zmq.Again:
+                        counters['dropped'] += 1
+                    else:
+                        counters['mirrored'] += 1
+        except zmq.ContextTerminated:
+            pass
+        except Exception, e:
+            logger.error(e, exc_info=True)
+        finally:
+            mirror.close(0)
+            shadow.close(0)
+            logger.debug('mirror thread exited')
+    #}
+    def _command(self, cmd, reply=False):  #{
+        if not self._started or self._done:
+            raise RuntimeError('the device is not running')
+        with self._lock:
+            self._ctrl.send(cmd)
+            if reply:
+                return self._ctrl.recv_multipart()
+    #}
+
+    #-------------------------------------------------------------------------
+    # Public API
+    #-------------------------------------------------------------------------
+
+    def bind_in(self, url):  #{
+        self.in_socket.bind(url)
+    #}
+    def connect_in(self, url):  #{
+        self.in_socket.connect(url)
+    #}
+    def bind_out(self, url):  #{
+        self.out_socket.bind(url)
+    #}
+    def connect_out(self, url):  #{
+        self.out_socket.connect(url)
+    #}
+
+    def start(self):  #{
+        """ Start the device in a native thread (non-blocking) """
+        assert not self._started, 'already started'
+        self._started = True
+        start_native_thread(self._run)
+        if self.shadow_socket is not None:
+            start_native_thread(self._mirror)
+    #}
+    def pause(self):  #{
+        """ Stop passing messages (they are queued up to the HWM) """
+        self._command(b'PAUSE')
+    #}
+    def resume(self):  #{
+        """ Resume passing messages after pause() """
+        self._command(b'RESUME')
+    #}
+    def stats(self):  #{
+        """ Returns message/byte counters of the device (RuntimeError if libzmq < 4.3):
+
+            {
+                'frontend' : {'msgs_in':<int>, 'bytes_in':<int>, 'msgs_out':<int>, 'bytes_out':<int>},
+                'backend'  : {'msgs_in':<int>, 'bytes_in':<int>, 'msgs_out':<int>, 'bytes_out':<int>},
+            }
+
+            plus shadow counters if requests are mirrored (see shadow_stats).
+        """
+        if zmq.zmq_version_info() < (4, 3):
+            raise RuntimeError('proxy statistics require libzmq 4.3+ (running %s)' % zmq.zmq_version())
+
+        values = [unpack('=Q', frame)[0] for frame in self._command(b'STATISTICS', reply=True)]
+        keys   = ['msgs_in', 'bytes_in', 'msgs_out', 'bytes_out']
+        stats  = dict(
+            frontend = dict(zip(keys, values[:4])),
+            backend  = dict(zip(keys, values[4:])),
+        )
+        if self.shadow_socket is not None:
+            stats['shadow'] = self.shadow_stats()
+        return stats
+    #}
+    def shadow_stats(self):  #{
+        """ Returns counters of mirrored requests: {
+                'mirrored' : <int>,  # copies sent to the shadow
+                'dropped'  : <int>,  # copies dropped as the shadow was behind
+                'replies'  : <int>,  # shadow replies discarded (ACKs included)
+            }
+        """
+        return dict(self._shadow_stats)
+    #}
+    def is_alive(self):  #{
+        return self._started and not self._done
+    #}
+    def join(self, timeout=None):  #{
+        """ Wait for the device thread to exit """
+        deadline = None if timeout is None else time() + timeout
+        while self._started and not self._done:
+            if deadline is not None and time() >= deadline:
+                break
+            sleep(0.01)
+    #}
+    def terminate(self, timeout=None):  #{
+        """ Stop the device and close its sockets """
+        if self.is_alive():
+            self._command(b'TERMINATE')
+            self.join(timeout)
+        elif not self._started:
+            for socket in self._sockets() + filter(None, [self.mirror_socket, self.shadow_socket]):
+                socket.close(0)
+        self._ctrl.close(0)
+    #}
+#}
+
+
+__all__ = [
+    'ProxyDevice',
+]
@@ -29,3 +29,9 @@ class RemoteRPCError(RPCError):  #{
 class RPCTimeoutError(RPCError):  #{
     pass
 #}
+class RPCBusyError(RPCError):  #{
+    """A procedure is at its concurrency limit (see register)
+       or the service is draining (see RPCServiceBase.drain)
+    """
+    pass
+#}
@@ -0,0 +1,307 @@
+# vim: fileencoding=utf-8 et ts=4 sts=4 sw=4 tw=0 fdm=marker fmr=#{,#}
+
+"""
+A Prometheus exporter of NetCall service and client metrics.
+
+Authors:
+
+* Alexander Glyzov
+
+Example
+-------
+
+    from netcall.exporter import MetricsExporter
+
+    exporter = MetricsExporter(services=[service], clients=[client])
+    exporter.serve(9108)  # http://127.0.0.1:9108/metrics
+    ...
+    text = exporter.render()  # or embed it into an existing HTTP server
+"""
+
+#-----------------------------------------------------------------------------
+#  Copyright (C) 2012-2014. Brian Granger, Min Ragan-Kelley, Alexander Glyzov
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file LICENSE distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+# Imports
+#-----------------------------------------------------------------------------
+
+from __future__ import absolute_import
+
+from threading      import Thread
+from collections    import OrderedDict
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+from .utils import logger, pool_stats
+
+
+#-----------------------------------------------------------------------------
+# Metric definitions
+#-----------------------------------------------------------------------------
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# default histogram bounds (seconds)
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+           0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# (<ProcStats attribute>, <metric name>, <help>)
+SERVICE_COUNTERS = [
+    ('calls',     'requests_total',       'Requests finished by a procedure.'),
+    ('errors',    'errors_total',         'Requests answered with a FAIL.'),
+    ('bytes_in',  'received_bytes_total', 'Serialized arguments received.'),
+    ('bytes_out', 'sent_bytes_total',     'Reply payloads sent.'),
+]
+SERVICE_TIMINGS = [
+    ('latency',     'latency_seconds',     'From receipt of a request to its reply.'),
+    ('queue',       'queue_seconds',       'From receipt of a request to the start of the work on it.'),
+    ('deserialize', 'deserialize_seconds', 'Deserialization of arguments.'),
+    ('execute',     'execute_seconds',     'Execution of a procedure.'),
+    ('serialize',   'serialize_seconds',   'Serialization of a result.'),
+]
+
+# (<CallStats attribute>, <metric name>, <help>)
+CLIENT_COUNTERS = [
+    ('calls',    'calls_total',    'Calls answered with a result.'),
+    ('errors',   'errors_total',   'Calls answered with a FAIL.'),
+    ('timeouts', 'timeouts_total', 'Calls timed out.'),
+]
+CLIENT_TIMINGS = [
+    ('latency', 'latency_seconds', 'From sending a request to its result.'),
+    ('ack',     'ack_seconds',     'From sending a request to its ACK.'),
+    ('result',  'result_seconds',  'From the ACK of a request to its result.'),
+]
+
+
+#-----------------------------------------------------------------------------
+# Text format
+#-----------------------------------------------------------------------------
+
+def _escape(value):  #{
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+#}
+def _labels(labels):  #{
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape(value)) for name, value in labels)
+#}
+def _number(value):  #{
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+#}
+
+class _Writer(object):  #{
+    """ Collects samples grouped into metric families """
+
+    def __init__(self, prefix):  #{
+        self.prefix    = prefix
+        self._families = OrderedDict()  # {<name> : (<type>, <help>, [<line>, ...])}
+    #}
+    def _family(self, name, typ, help):  #{
+        name = '%s_%s' % (self.prefix, name)
+        if name not in self._families:
+            self._families[name] = (typ, help, [])
+        return name, self._families[name][2]
+    #}
+    def sample(self, name, typ, help, labels, value):  #{
+        name, lines = self._family(name, typ, help)
+        lines.append('%s%s %s' % (name, _labels(labels), _number(value)))
+    #}
+    def histogram(self, name, help, labels, bounds, histogram):  #{
+        """ histogram is a tuple (<cumulative counts>, <sum>, <count>) """
+        name, lines = self._family(name, 'histogram', help)
+        cumulative, total, count = histogram
+        for bound, seen in zip(bounds, cumulative):
+            lines.append('%s_bucket%s %s' % (name, _labels(labels + [('le', '%g' % bound)]), seen))
+        lines.append('%s_bucket%s %s' % (name, _labels(labels + [('le', '+Inf')]), count))
+        lines.append('%s_sum%s %s'    % (name, _labels(labels), _number(total)))
+        lines.append('%s_count%s %s'  % (name, _labels(labels), count))
+    #}
+    def render(self):  #{
+        output = []
+        for name, (typ, help, lines) in self._families.items():
+            output.append('# HELP %s %s' % (name, help))
+            output.append('# TYPE %s %s' % (name, typ))
+            output.extend(lines)
+        output.append('')
+        return '\n'.join(output)
+    #}
+#}
+
+
+#-----------------------------------------------------------------------------
+# Exporter
+#-----------------------------------------------------------------------------
+
+class MetricsExporter(object):  #{
+    """ Renders metrics of services and clients in the Prometheus text format
+        and optionally serves them over HTTP.
+
+        Besides the per-procedure statistics it exports requests in flight
+        (each one is a greenlet in a green service), occupancy of procedures
+        with a concurrency limit, depths of the internal res_queue/req_queue
+        of threading services/clients and the size and backlog of their
+        thread pools.
+    """
+    def __init__(self, services=(), clients=(), buckets=BUCKETS, prefix='netcall'):  #{
+        """
+        Parameters
+        ==========
+        services : [<RPCServiceBase>, ...]
+        clients  : [<RPCClientBase>, ...]
+        buckets  : (<float>, ...) ascending histogram bounds in seconds
+        prefix   : <str> a prefix of all the metric names
+        """
+        self.services = list(services)
+        self.clients  = list(clients)
+        self.buckets  = tuple(buckets)
+        self.prefix   = prefix
+        self.server   = None
+    #}
+    def add_service(self, service):  #{
+        self.services.append(service)
+    #}
+    def add_client(self, client):  #{
+        self.clients.append(client)
+    #}
+
+    def _pool(self, out, kind, labels, pool):  #{
+        "Export the size and backlog of a thread pool snapshot (if any, see utils.pool_stats)"
+        if pool is None:
+            return
+        out.sample(kind+'_pool_workers', 'gauge', 'Threads in the pool.', labels, pool['workers'])
+        out.sample(kind+'_pool_queued_tasks', 'gauge', 'Tasks waiting for a free thread.', labels, pool['queued'])
+    #}
+    def _stats(self, out, name, labels, export, counters, timings):  #{
+        "Export counters and histograms of a ProcStats/CallStats export"
+        for attr, metric, help in counters:
+            out.sample(name+'_'+metric, 'counter', help, labels, export[attr])
+        for attr, metric, help in timings:
+            out.histogram(name+'_'+metric, help, labels, self.buckets, export[attr])
+    #}
+    def _service(self, out, service):  #{
+        labels   = [('service', service.service_id)]
+        workload = service.workload()
+
+        out.sample('service_inflight_requests', 'gauge',
+                   'Requests received but not finished yet.', labels, workload['inflight'])
+
+        for name, occupancy in sorted(service.occupancy().items()):
+            proc = labels + [('procedure', name)]
+            out.sample('service_active_requests', 'gauge',
+                       'Requests running under a concurrency limit.', proc, occupancy['active'])
+            out.sample('service_queued_requests', 'gauge',
+                       'Requests waiting for a concurrency slot.', proc, occupancy['queued'])
+            out.sample('service_rejected_total', 'counter',
+                       'Requests rejected at a concurrency limit.', proc, occupancy['rejected'])
+
+        if 'res_queue' in workload:
+            out.sample('service_res_queue_depth', 'gauge',
+                       'Replies waiting for the I/O thread.', labels, workload['res_queue'])
+        self._pool(out, 'service', labels, workload.get('pool'))
+
+        for name, export in sorted(service.stats(buckets=self.buckets).items()):
+            self._stats(out, 'service', labels + [('procedure', name)], export,
+                        SERVICE_COUNTERS, SERVICE_TIMINGS)
+    #}
+    def _client(self, out, client):  #{
+        labels = [('client', client.identity)]
+
+        req_queue = getattr(client, 'req_queue', None)
+        if req_queue is not None:
+            out.sample('client_req_queue_depth', 'gauge',
+                       'Requests waiting for the I/O thread.', labels, req_queue.qsize())
+        pool = getattr(client, 'pool', None)
+        self._pool(out, 'client', labels, pool and pool_stats(pool))
+
+        metrics = client.metrics
+        if metrics is None:
+            return
+        export = metrics.export(self.buckets)
+
+        out.sample('client_inflight_calls', 'gauge',
+                   'Calls waiting for a result.', labels, export['in_flight'])
+        out.sample('client_orphaned_total', 'counter',
+                   'Results of unknown (e.g. timed out) calls.', labels, export['orphaned'])
+        out.sample('client_evicted_total', 'counter',
+                   'Calls dropped from tracking as too many were waiting.', labels, export['evicted'])
+
+        for name, stats in sorted(export['procedures'].items()):
+            self._stats(out, 'client', labels + [('procedure', name)], stats,
+                        CLIENT_COUNTERS, CLIENT_TIMINGS)
+        for srv_id, stats in sorted(export['services'].items()):
+            self._stats(out, 'client_service', labels + [('service', srv_id)], stats,
+                        CLIENT_COUNTERS, CLIENT_TIMINGS)
+    #}
+
+    #-------------------------------------------------------------------------
+    # Public API
+    #-------------------------------------------------------------------------
+
+    def render(self):  #{
+        """ Returns the metrics in the Prometheus text format """
+        out = _Writer(self.prefix)
+        for service in self.services:
+            self._service(out, service)
+        for client in self.clients:
+            self._client(out, client)
+        return out.render()
+    #}
+
+    __call__ = render
+
+    def serve(self, port=9108, host='127.0.0.1'):  #{
+        """ Serve the metrics over HTTP in a background thread (non-blocking).
+
+            Returns the (host, port) the listener is bound to
+            (pass port=0 to bind to a random port).
+        """
+        assert self.server is None, 'already serving'
+
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):  #{
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                try:
+                    body = exporter.render()
+                except Exception:
+                    logger.error('failed to render metrics', exc_info=True)
+                    self.send_error(500)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug('exporter: ' + format % args)
+        #}
+
+        self.server = HTTPServer((host, port), Handler)
+        thread = Thread(target=self.server.serve_forever, name='MetricsExporter')
+        thread.daemon = True
+        thread.start()
+
+        return self.server.server_address
+    #}
+    def shutdown(self):  #{
+        """ Stop the HTTP listener """
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+    #}
+#}
+
+
+__all__ = [
+    'MetricsExporter',
+]
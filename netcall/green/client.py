@@ -59,7 +59,7 @@ class GreenRPCClient(RPCClientBase):
 
         super(GreenRPCClient, self).__init__(**kwargs)  # base class
 
-        spawn, _, Event, _ = get_green_tools(env=self.green_env)
+        spawn, self._spawn_later, Event, self._Condition = get_green_tools(env=self.green_env)
 
         self._ready_ev = Event()
         self._exit_ev  = Event()
@@ -115,9 +115,9 @@ class GreenRPCClient(RPCClientBase):
                     #logger.debug('skipping invalid reply')
                     continue
 
-                req_id   = reply['req_id']
-                msg_type = reply['type']
-                result   = reply['result']
+                req_id   = reply.req_id
+                msg_type = reply.type
+                result   = reply.result
 
                 if msg_type == b'ACK':
                     #logger.debug('skipping ACK, req_id=%r' % req_id)
@@ -184,12 +184,14 @@ class GreenRPCClient(RPCClientBase):
 
         req_id, msg_list = self._build_request(proc_name, args, kwargs, ignore)
 
-        self.socket.send_multipart(msg_list)
-
         if ignore:
+            self.socket.send_multipart(msg_list)
             return None
 
-        _, spawn_later, _, Condition = get_green_tools(env=self.green_env)
+        # register the future before sending so that a quick reply is not lost
+        future = Future(condition=self._Condition())
+        self._futures[req_id] = future
+        self.socket.send_multipart(msg_list)
 
         if timeout and timeout > 0:
             def _abort_request():
@@ -197,11 +199,11 @@ class GreenRPCClient(RPCClientBase):
                 if future is not None:
                     tout_msg  = "Request %s timed out after %s sec" % (req_id, timeout)
                     logger.debug(tout_msg)
+                    if self.metrics is not None:
+                        self.metrics.timed_out(req_id)
                     future.set_exception(RPCTimeoutError(tout_msg))
-            spawn_later(timeout, _abort_request)
+            self._spawn_later(timeout, _abort_request)
 
-        future = Future(condition=Condition())
-        self._futures[req_id] = future
         #logger.debug('waiting for result=%r' % result)
         return future.result()  # block waiting for a reply passed by ._reader
     #}
@@ -23,7 +23,7 @@ Authors:
 import zmq
 
 from ..base  import RPCServiceBase
-from ..utils import logger, get_zmq_classes, detect_green_env, get_green_tools
+from ..utils import logger, get_zmq_classes, detect_green_env, get_green_tools, get_green_tpool
 
 
 #-----------------------------------------------------------------------------
@@ -35,7 +35,15 @@ class GreenRPCService(RPCServiceBase):
         Using green threads for concurrency.
         Green environment is provided by either Gevent, Eventlet or Greenhouse
         and can be autodetected.
+
+        Procedures doing CPU work or calling non-patched blocking libraries
+        should be registered with threadpool=True to run in a native thread
+        (Gevent and Eventlet only):
+
+            service.register(blocking_func, threadpool=True)
     """
+    _OPTIONS = RPCServiceBase._OPTIONS + ['threadpool']
+
     def __init__(self, green_env=None, context=None, **kwargs):  #{
         """
         Parameters
@@ -58,50 +66,42 @@ class GreenRPCService(RPCServiceBase):
             assert isinstance(context, Context)
             self.context = context
 
+        try:
+            self._tpool_apply = get_green_tpool(env=self.green_env)
+        except ValueError:
+            self._tpool_apply = None
+
         super(GreenRPCService, self).__init__(**kwargs)
 
         self.greenlet = None
+        self._spawn, self._spawn_later, self._Event, _ = get_green_tools(env=self.green_env)
     #}
     def _create_socket(self):  #{
         super(GreenRPCService, self)._create_socket()
         self.socket = self.context.socket(zmq.ROUTER)
     #}
-    def _handle_request(self, msg_list):  #{
-        """Handle an incoming request.
-
-        The request is received as a multipart message:
-
-        [<id>..<id>, b'|', req_id, proc_name, <ser_args>, <ser_kwargs>, <ignore>]
-
-        First, the service sends back a notification that the message was
-        indeed received:
-
-        [<id>..<id>, b'|', req_id, b'ACK',  service_id]
-
-        Next, the actual reply depends on if the call was successful or not:
-
-        [<id>..<id>, b'|', req_id, b'OK',   <serialized result>]
-        [<id>..<id>, b'|', req_id, b'FAIL', <JSON dict of ename, evalue, traceback>]
-
-        Here the (ename, evalue, traceback) are utf-8 encoded unicode.
+    def _execute(self, func, *args):  #{
+        "Run func(*args) in a new greenlet"
+        self._spawn(func, *args)
+    #}
+    def _call_later(self, delay, func, *args):  #{
+        self._spawn_later(delay, func, *args)
+    #}
+    def _invoke(self, request, args, kwargs):  #{
+        """ Call the procedure of a request (in a native thread if the
+            procedure was registered with threadpool=True)
         """
-        req = self._parse_request(msg_list)
-        if req is None:
-            return
-        self._send_ack(req)
-
-        ignore = req['ignore']
-
-        try:
-            # raise any parsing errors here
-            if req['error']:
-                raise req['error']
-            # call procedure
-            res = req['proc'](*req['args'], **req['kwargs'])
-        except Exception:
-            not ignore and self._send_fail(req)
-        else:
-            not ignore and self._send_ok(req, res)
+        if request.options.get('threadpool'):
+            return self._tpool_apply(request.proc, args, kwargs)
+        return request.proc(*args, **kwargs)
+    #}
+    def _sleep(self, seconds):  #{
+        self._Event().wait(seconds)
+    #}
+    def _set_options(self, name, options):  #{
+        if options.get('threadpool') and self._tpool_apply is None:
+            raise ValueError('native thread pools are not supported in %r' % self.green_env)
+        super(GreenRPCService, self)._set_options(name, options)
     #}
     def start(self):  #{
         """ Start the RPC service (non-blocking).
@@ -112,7 +112,7 @@ class GreenRPCService(RPCServiceBase):
         assert self.bound or self.connected, 'not bound/connected?'
         assert self.greenlet is None, 'already started'
 
-        spawn = get_green_tools(env=self.green_env)[0]
+        spawn = self._spawn
 
         def receive_reply():
             while True:
@@ -121,7 +121,7 @@ class GreenRPCService(RPCServiceBase):
                 except Exception, e:
                     logger.warning(e)
                     break
-                spawn(self._handle_request, request)
+                self._handle_request(request)
             logger.debug('receive_reply exited')
 
         self.greenlet = spawn(receive_reply)
@@ -143,10 +143,14 @@ class GreenRPCService(RPCServiceBase):
         self.bind(bound)
         self.connect(connected)
     #}
-    def shutdown(self):  #{
+    def shutdown(self, linger=0):  #{
         """Close the socket and signal the reader greenlet to exit"""
-        self.stop()
-        self.socket.close(0)
+        # keep flushing replies (if linger), the reader exits on the closed
+        # socket; not via stop() since it restores bindings of a new socket
+        self.socket.close(linger)
+        if self.greenlet is not None:
+            self.greenlet.join()
+            self.greenlet = None
     #}
     def serve(self):  #{
         """ Serve RPC requests (blocking)
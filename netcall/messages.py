@@ -0,0 +1,158 @@
+# vim: fileencoding=utf-8 et ts=4 sts=4 sw=4 tw=0 fdm=marker fmr=#{,#}
+
+"""
+Parsed NetCall requests and replies.
+
+Authors:
+
+* Alexander Glyzov
+
+Both are plain objects with __slots__ (no per-instance dict) created once
+per message on the hot path. Middleware hooks get them as well, fields are
+read and set as attributes (or as keys, like the dicts they replace).
+
+Example
+-------
+
+    class Audit(object):
+        def before_dispatch(self, request):
+            log(request.name, request.route)
+
+        def on_reply(self, reply):
+            log(reply.type, reply.req_id)
+"""
+
+#-----------------------------------------------------------------------------
+#  Copyright (C) 2012-2014. Brian Granger, Min Ragan-Kelley, Alexander Glyzov
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file LICENSE distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+# Imports
+#-----------------------------------------------------------------------------
+
+from __future__ import absolute_import
+
+
+#-----------------------------------------------------------------------------
+# Messages
+#-----------------------------------------------------------------------------
+
+class _Message(object):  #{
+    """ A slotted message with a read/write mapping view of its fields """
+
+    __slots__ = ()
+
+    def __getitem__(self, key):  #{
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+    #}
+    def __setitem__(self, key, value):  #{
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+    #}
+    def get(self, key, default=None):  #{
+        return getattr(self, key, default)
+    #}
+    def as_dict(self):  #{
+        return dict((key, getattr(self, key)) for key in self.__slots__)
+    #}
+#}
+
+class Request(_Message):  #{
+    """ A request parsed by a service (see RPCServiceBase._parse_request):
+
+        header   : [<id>..<id>, b'|', req_id]   # a prefix of every reply to it
+        req_id   : <bytes>                      # unique message id
+        name     : <bytes>                      # a procedure name
+        proc     : <callable> | None            # a task callable
+        data     : [<ser_args>, <ser_kwargs>]   # serialized arguments
+        options  : {<option> : <value>}         # procedure options (see register)
+        ignore   : <bool>                       # ignore result flag
+        error    : None | <Exception>
+        flight   : None | <cache key>           # set if it leads a single-flight
+        bulkhead : None | <_Bulkhead>           # set if it holds a concurrency slot
+        trace    : None | <TraceContext>        # a span of the request in a caller's trace
+
+        # accounting (see RPCServiceBase._account)
+        received     : <float>                  # time of receipt
+        parsed       : <float>                  # the request is parsed
+        started      : None | <float>           # the work on it has started
+        deserialized : None | <float>           # arguments are deserialized
+        executed     : None | <float>           # the result is ready
+        serialized   : None | <float>           # the result is serialized
+        replied      : None | <float>           # the reply is handed over
+        failed       : <bool>                   # answered with a FAIL
+        bytes_out    : <int>                    # size of the reply payload
+
+        and a route property: [<id:bytes>, ...] (a return path).
+    """
+    __slots__ = (
+        'header', 'req_id', 'name', 'proc', 'data', 'options', 'ignore', 'error',
+        'flight', 'bulkhead', 'trace',
+        'received', 'parsed', 'started', 'deserialized', 'executed', 'serialized', 'replied',
+        'failed', 'bytes_out',
+    )
+
+    def __init__(self, header, name, proc, data, options, ignore, error, trace, received, parsed):  #{
+        self.header       = header
+        self.req_id       = header[-1]
+        self.name         = name
+        self.proc         = proc
+        self.data         = data
+        self.options      = options
+        self.ignore       = ignore
+        self.error        = error
+        self.flight       = None
+        self.bulkhead     = None
+        self.trace        = trace
+        self.received     = received
+        self.parsed       = parsed
+        self.started      = None
+        self.deserialized = None
+        self.executed     = None
+        self.serialized   = None
+        self.replied      = None
+        self.failed       = False
+        self.bytes_out    = 0
+    #}
+    @property
+    def route(self):  #{
+        return self.header[:-2]
+    #}
+    def __repr__(self):  #{
+        return '<Request %r to %r>' % (self.req_id, self.name)
+    #}
+#}
+
+class Reply(_Message):  #{
+    """ A reply parsed by a client (see RPCClientBase._parse_reply):
+
+        type   : <bytes>          # ACK | OK | FAIL
+        req_id : <bytes>          # unique message id
+        srv_id : <bytes> | None   # only for ACK messages
+        result : <object>
+    """
+    __slots__ = ('type', 'req_id', 'srv_id', 'result')
+
+    def __init__(self, type, req_id, srv_id, result):  #{
+        self.type   = type
+        self.req_id = req_id
+        self.srv_id = srv_id
+        self.result = result
+    #}
+    def __repr__(self):  #{
+        return '<Reply %r %s>' % (self.req_id, self.type)
+    #}
+#}
+
+
+__all__ = [
+    'Request',
+    'Reply',
+]
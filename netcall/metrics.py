@@ -0,0 +1,495 @@
+# vim: fileencoding=utf-8 et ts=4 sts=4 sw=4 tw=0 fdm=marker fmr=#{,#}
+
+"""
+Low-overhead metrics of NetCall services.
+
+Authors:
+
+* Alexander Glyzov
+
+Example
+-------
+
+    from netcall.metrics import Histogram
+
+    hist = Histogram()
+    hist.record(0.0025)  # seconds
+    hist.percentile(99)
+    hist.snapshot()
+
+Every service keeps a ProcStats per procedure, see RPCServiceBase.stats()
+or call the '_netcall.stats' procedure remotely. Clients keep CallStats per
+procedure and per service in client.metrics (see ClientMetrics).
+"""
+
+#-----------------------------------------------------------------------------
+#  Copyright (C) 2012-2014. Brian Granger, Min Ragan-Kelley, Alexander Glyzov
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file LICENSE distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+# Imports
+#-----------------------------------------------------------------------------
+
+from __future__ import absolute_import
+
+from math      import frexp, ldexp, ceil
+from time      import time
+from threading import Lock
+
+
+#-----------------------------------------------------------------------------
+# Histogram
+#-----------------------------------------------------------------------------
+
+class Histogram(object):  #{
+    """ A log-linear histogram of non-negative values (like HdrHistogram).
+
+        Values are counted in units (a microsecond by default), every power
+        of two of them is split into 2**precision linear buckets so recording
+        is a couple of arithmetic operations and a percentile is off by less
+        than 1/2**precision of its value (6% by default).
+
+        Note: it is not thread-safe on its own (see ProcStats).
+    """
+    def __init__(self, unit=1e-6, precision=4, max_exp=40):  #{
+        """
+        Parameters
+        ==========
+        unit      : <float> the smallest value distinguished (1us by default)
+        precision : <int>   log2 of the number of buckets per power of two
+        max_exp   : <int>
+            Values above 2**max_exp units are counted in the last bucket
+            (about 12 days with the default unit).
+        """
+        self.unit      = unit
+        self.precision = precision
+        self.max_exp   = max_exp
+
+        self._sub    = 1 << precision
+        self._counts = [0] * (max_exp * self._sub + 1)
+        self.count   = 0
+        self.sum     = 0.0
+        self.min     = None
+        self.max     = None
+    #}
+    def _index(self, units):  #{
+        if units < 1:
+            return 0
+        mantissa, exp = frexp(units)  # units = mantissa * 2**exp, 0.5 <= mantissa < 1
+        if exp > self.max_exp:
+            return len(self._counts) - 1
+        sub = self._sub
+        return 1 + (exp - 1) * sub + int((mantissa * 2 - 1) * sub)
+    #}
+    def _value(self, index):  #{
+        "The middle value of a bucket"
+        if index == 0:
+            return 0.5 * self.unit
+        exp, sub = divmod(index - 1, self._sub)
+        return ldexp(1 + (sub + 0.5) / self._sub, exp) * self.unit
+    #}
+    def record(self, value):  #{
+        """ Count a value (negative values are counted as zeros) """
+        if value < 0:
+            value = 0.0
+        self._counts[self._index(value / self.unit)] += 1
+        self.count += 1
+        self.sum   += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+    #}
+    def percentile(self, q):  #{
+        """ Returns an approximate q-th percentile (0 <= q <= 100)
+            or None if nothing has been recorded
+        """
+        if not self.count:
+            return None
+        rank = max(1, int(ceil(q / 100.0 * self.count)))
+        if rank == 1:
+            return self.min
+        if rank >= self.count:
+            return self.max
+        seen = 0
+        for index, count in enumerate(self._counts):
+            seen += count
+            if seen >= rank:
+                return min(max(self._value(index), self.min), self.max)
+        return self.max
+    #}
+    def cumulative(self, bounds):  #{
+        """ Returns approximate numbers of values less or equal to each
+            of the ascending bounds (a bucket is counted by its middle value)
+        """
+        counts = self._counts
+        result = []
+        seen   = 0
+        index  = 0
+        for bound in bounds:
+            while index < len(counts) and self._value(index) <= bound:
+                seen  += counts[index]
+                index += 1
+            result.append(seen)
+        return result
+    #}
+    def merge(self, other):  #{
+        """ Add counts of another histogram with the same layout """
+        if (other.unit, other.precision, other.max_exp) != (self.unit, self.precision, self.max_exp):
+            raise ValueError('histograms have different layouts')
+        counts = self._counts
+        for index, count in enumerate(other._counts):
+            if count:
+                counts[index] += count
+        self.count += other.count
+        self.sum   += other.sum
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+    #}
+    def reset(self):  #{
+        self._counts = [0] * len(self._counts)
+        self.count   = 0
+        self.sum     = 0.0
+        self.min     = None
+        self.max     = None
+    #}
+    def snapshot(self):  #{
+        """ Returns a summary:
+
+            {'count':<int>, 'sum':<float>, 'min':<float>, 'max':<float>, 'mean':<float>,
+             'p50':<float>, 'p90':<float>, 'p99':<float>, 'p999':<float>}
+        """
+        count = self.count
+        return dict(
+            count = count,
+            sum   = self.sum,
+            min   = self.min,
+            max   = self.max,
+            mean  = self.sum / count if count else None,
+            p50   = self.percentile(50),
+            p90   = self.percentile(90),
+            p99   = self.percentile(99),
+            p999  = self.percentile(99.9),
+        )
+    #}
+#}
+
+
+#-----------------------------------------------------------------------------
+# Statistics
+#-----------------------------------------------------------------------------
+
+class _Stats(object):  #{
+    """ A set of counters and histograms guarded by a lock """
+
+    COUNTERS = ()
+    TIMINGS  = ()
+
+    def __init__(self):  #{
+        for name in self.COUNTERS:
+            setattr(self, name, 0)
+        for name in self.TIMINGS:
+            setattr(self, name, Histogram())
+        self._lock = Lock()
+    #}
+    def reset(self):  #{
+        with self._lock:
+            for name in self.COUNTERS:
+                setattr(self, name, 0)
+            for name in self.TIMINGS:
+                getattr(self, name).reset()
+    #}
+    def snapshot(self):  #{
+        """ Returns a dict of the counters and histogram summaries
+            (see Histogram.snapshot) keyed by their names
+        """
+        with self._lock:
+            snapshot = dict((name, getattr(self, name)) for name in self.COUNTERS)
+            for name in self.TIMINGS:
+                snapshot[name] = getattr(self, name).snapshot()
+        return snapshot
+    #}
+    def export(self, bounds):  #{
+        """ Returns a dict of the counters and histogram tuples
+            (<cumulative counts>, <sum>, <count>) for the bounds
+            (see Histogram.cumulative) keyed by their names
+        """
+        with self._lock:
+            export = dict((name, getattr(self, name)) for name in self.COUNTERS)
+            for name in self.TIMINGS:
+                hist = getattr(self, name)
+                export[name] = (hist.cumulative(bounds), hist.sum, hist.count)
+        return export
+    #}
+#}
+
+def request_phases(request, now=None):  #{
+    """ Returns durations (seconds) of the phases of a service request
+        (see RPCServiceBase._parse_request) finished at a given time:
+
+        {'parse':<float>, 'queue':<float>, 'deserialize':<float>,
+         'execute':<float>, 'serialize':<float>, 'handoff':<float>}
+
+        A phase that has not happened (e.g. for a cached result) is None,
+        handoff is the time spent handing the reply over to the socket or to
+        the I/O thread. A threading service finishes a request in its worker
+        thread, so the wait until the I/O thread actually sends the reply is
+        not a part of it.
+    """
+    now          = now or time()
+    parsed       = request.parsed
+    started      = request.started
+    deserialized = request.deserialized
+    executed     = request.executed or now
+    serialized   = request.serialized
+    replied      = request.replied
+    return dict(
+        parse       = parsed - request.received,
+        queue       = started and started - parsed,
+        deserialize = deserialized and deserialized - started,
+        execute     = deserialized and executed - deserialized,
+        serialize   = serialized and serialized - executed,
+        handoff     = replied and replied - (serialized or request.executed or parsed),
+    )
+#}
+
+class ProcStats(_Stats):  #{
+    """ Counters and timings (in seconds) of a single procedure of a service:
+
+        calls       - finished requests
+        errors      - requests answered with a FAIL
+        bytes_in    - serialized arguments received
+        bytes_out   - reply payloads sent
+        latency     - from receipt of a request to its reply
+        queue       - from receipt to the start of the work on it
+        deserialize - deserialization of arguments
+        execute     - the procedure call (until its result is ready)
+        serialize   - serialization of the result
+    """
+    COUNTERS = ('calls', 'errors', 'bytes_in', 'bytes_out')
+    TIMINGS  = ('latency', 'queue', 'deserialize', 'execute', 'serialize')
+
+    def record(self, failed, bytes_in, bytes_out, latency,
+               queue=None, deserialize=None, execute=None, serialize=None):  #{
+        """ Account a finished request, timings that do not apply
+            (e.g. for a cached result) are None
+        """
+        with self._lock:
+            self.calls     += 1
+            self.errors    += bool(failed)
+            self.bytes_in  += bytes_in
+            self.bytes_out += bytes_out
+            self.latency.record(latency)
+            if queue is not None:
+                self.queue.record(queue)
+            if deserialize is not None:
+                self.deserialize.record(deserialize)
+            if execute is not None:
+                self.execute.record(execute)
+            if serialize is not None:
+                self.serialize.record(serialize)
+    #}
+#}
+
+class CallStats(_Stats):  #{
+    """ Counters and timings (in seconds) of calls made by a client:
+
+        calls    - calls answered with a result (OK or FAIL)
+        errors   - calls answered with a FAIL
+        timeouts - calls given up on by the client
+        latency  - from sending a request to its result
+        ack      - from sending a request to its ACK (network and queueing)
+        result   - from the ACK to the result (mostly the execution)
+    """
+    COUNTERS = ('calls', 'errors', 'timeouts')
+    TIMINGS  = ('latency', 'ack', 'result')
+
+    def record(self, failed, latency, ack=None, result=None):  #{
+        """ Account an answered call (ack and result are None
+            if the ACK has not been seen)
+        """
+        with self._lock:
+            self.calls  += 1
+            self.errors += bool(failed)
+            self.latency.record(latency)
+            if ack is not None:
+                self.ack.record(ack)
+            if result is not None:
+                self.result.record(result)
+    #}
+    def timeout(self, ack=None):  #{
+        """ Account a timed out call """
+        with self._lock:
+            self.timeouts += 1
+            if ack is not None:
+                self.ack.record(ack)
+    #}
+#}
+
+
+#-----------------------------------------------------------------------------
+# Client metrics
+#-----------------------------------------------------------------------------
+
+class ClientMetrics(object):  #{
+    """ Tracks calls of a client from their requests to their replies
+        and keeps CallStats per procedure and per service (srv_id of ACKs)
+        so a degrading service instance stands out.
+
+        orphaned - results that came for unknown requests (e.g. timed out)
+        evicted  - the oldest calls dropped from tracking when more than
+                   max_pending were waiting for a result (e.g. calls without
+                   a timeout never answered), they are accounted as timeouts
+    """
+    def __init__(self, max_pending=10000):  #{
+        """
+        Parameters
+        ==========
+        max_pending : <int> a maximum number of calls waiting for a result
+                      to track, a tenth of them (the oldest) is evicted beyond that
+        """
+        self.procedures  = {}  # {<name>   : <CallStats>}
+        self.services    = {}  # {<srv_id> : <CallStats>}
+        self.orphaned    = 0
+        self.evicted     = 0
+        self.max_pending = max_pending
+
+        self._pending = {}  # {<req_id> : [<name>, <sent>, <acked>, <srv_id>]}
+        self._lock    = Lock()
+    #}
+    @property
+    def in_flight(self):  #{
+        "A number of calls waiting for a result"
+        return len(self._pending)
+    #}
+    def _stats(self, stats, key):  #{
+        "Returns CallStats for a key creating them if needed (called under the lock)"
+        try:
+            return stats[key]
+        except KeyError:
+            return stats.setdefault(key, CallStats())
+    #}
+    def sent(self, req_id, name):  #{
+        """ Account a request waiting for a result """
+        evicted = ()
+        with self._lock:
+            pending = self._pending
+            pending[req_id] = [name, time(), None, None]
+            if len(pending) > self.max_pending:
+                # rarely (once per a tenth of max_pending calls at most)
+                oldest  = sorted(pending.items(), key=lambda item: item[1][1])
+                evicted = [(pending.pop(key), self._targets(call))
+                           for key, call in oldest[:len(pending) - self.max_pending * 9 // 10]]
+                self.evicted += len(evicted)
+
+        for (name, sent, acked, srv_id), targets in evicted:
+            for stats in targets:
+                stats.timeout(ack=acked and acked - sent)
+    #}
+    def _targets(self, call):  #{
+        "Returns CallStats of a call's procedure and service (called under the lock)"
+        targets = [self._stats(self.procedures, call[0])]
+        if call[3] is not None:
+            targets.append(self._stats(self.services, call[3]))
+        return targets
+    #}
+    def received(self, reply):  #{
+        """ Account a parsed reply (see RPCClientBase._parse_reply) """
+        now    = time()
+        req_id = reply.req_id
+        with self._lock:
+            call = self._pending.get(req_id)
+            if call is None:
+                if reply.type != b'ACK':
+                    self.orphaned += 1
+                return
+            if reply.type == b'ACK':
+                call[2] = now
+                call[3] = reply.srv_id
+                return
+            del self._pending[req_id]
+            name, sent, acked, srv_id = call
+            targets = self._targets(call)
+
+        failed = reply.type != b'OK'
+        for stats in targets:
+            stats.record(
+                failed  = failed,
+                latency = now - sent,
+                ack     = acked and acked - sent,
+                result  = acked and now - acked,
+            )
+    #}
+    def timed_out(self, req_id):  #{
+        """ Account a call given up on (a late reply is an orphan) """
+        with self._lock:
+            call = self._pending.pop(req_id, None)
+            if call is None:
+                return
+            name, sent, acked, srv_id = call
+            targets = self._targets(call)
+
+        for stats in targets:
+            stats.timeout(ack=acked and acked - sent)
+    #}
+    def reset(self):  #{
+        """ Start counting over (calls in flight are still tracked) """
+        with self._lock:
+            self.procedures = {}
+            self.services   = {}
+            self.orphaned   = 0
+            self.evicted    = 0
+    #}
+    def snapshot(self, reset=False):  #{
+        """ Returns a dict:
+
+            {
+                'in_flight'  : <int>,
+                'orphaned'   : <int>,
+                'evicted'    : <int>,
+                'procedures' : {<name>   : <CallStats snapshot>},
+                'services'   : {<srv_id> : <CallStats snapshot>},
+            }
+        """
+        procedures, services, snapshot = self._counters()
+        if reset:
+            self.reset()
+
+        snapshot['procedures'] = dict((name, stats.snapshot()) for name, stats in procedures)
+        snapshot['services']   = dict((srv_id, stats.snapshot()) for srv_id, stats in services)
+        return snapshot
+    #}
+    def export(self, bounds):  #{
+        """ Returns the same dict as snapshot() but with CallStats exports
+            for the histogram bounds (see CallStats.export)
+        """
+        procedures, services, export = self._counters()
+
+        export['procedures'] = dict((name, stats.export(bounds)) for name, stats in procedures)
+        export['services']   = dict((srv_id, stats.export(bounds)) for srv_id, stats in services)
+        return export
+    #}
+    def _counters(self):  #{
+        "Returns (<procedure items>, <service items>, <counters>) taken under the lock"
+        with self._lock:
+            return self.procedures.items(), self.services.items(), dict(
+                in_flight = len(self._pending),
+                orphaned  = self.orphaned,
+                evicted   = self.evicted,
+            )
+    #}
+#}
+
+
+__all__ = [
+    'Histogram',
+    'ProcStats',
+    'CallStats',
+    'ClientMetrics',
+    'request_phases',
+]
@@ -0,0 +1,412 @@
+# vim: fileencoding=utf-8 et ts=4 sts=4 sw=4 tw=0 fdm=marker fmr=#{,#}
+
+"""
+A prefork supervisor that runs a NetCall service in several worker processes
+fronted by a Broker.
+
+Authors:
+
+* Alexander Glyzov
+
+Example
+-------
+
+    from netcall.prefork   import PreforkServer
+    from netcall.threading import ThreadingRPCService
+
+    def make_service():
+        echo = ThreadingRPCService()
+        echo.register(lambda s: s, name='echo')
+        return echo
+
+    server = PreforkServer(make_service, 'tcp://127.0.0.1:5555')
+    server.serve()  # SIGHUP - rolling restart, SIGTERM/SIGINT - shutdown
+"""
+
+#-----------------------------------------------------------------------------
+#  Copyright (C) 2012-2014. Brian Granger, Min Ragan-Kelley, Alexander Glyzov
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file LICENSE distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+# Imports
+#-----------------------------------------------------------------------------
+
+from os              import getpid, kill, strerror
+from sys             import platform
+from time            import time, sleep
+from shutil          import rmtree
+from ctypes          import CDLL, c_ulong, sizeof, byref, get_errno
+from ctypes.util     import find_library
+from signal          import signal, SIGTERM, SIGINT, SIGHUP, SIGKILL, SIG_IGN, SIG_DFL
+from tempfile        import mkdtemp
+from multiprocessing import Process, cpu_count
+
+from .broker import Broker, BrokerWorker
+from .utils  import logger
+
+
+#-----------------------------------------------------------------------------
+# Utilities
+#-----------------------------------------------------------------------------
+
+def _libc_setaffinity(pid, cpus):  #{
+    """ Calls sched_setaffinity(2) of the C library (Linux) """
+    bits = sizeof(c_ulong) * 8
+    mask = (c_ulong * (1024 // bits))()  # a cpu_set_t of CPU_SETSIZE bits
+    for cpu in cpus:
+        mask[cpu // bits] |= 1 << (cpu % bits)
+
+    libc = CDLL(find_library('c') or 'libc.so.6', use_errno=True)
+    if libc.sched_setaffinity(pid, sizeof(mask), byref(mask)) != 0:
+        errno = get_errno()
+        raise OSError(errno, strerror(errno))
+#}
+def set_cpu_affinity(cpu, pid=0):  #{
+    """ Pin a process (the current one by default) to a single CPU core.
+
+        Uses os.sched_setaffinity when available (Python 3), sched_setaffinity
+        of the C library on Linux and falls back to psutil (an optional
+        dependency: pip install netcall[affinity]).
+        Returns False if neither is available on this platform, raises
+        OSError if the core could not be set (e.g. it is out of the cpuset).
+    """
+    try:
+        from os import sched_setaffinity
+    except ImportError:
+        pass
+    else:
+        sched_setaffinity(pid, [cpu])
+        return True
+
+    if platform.startswith('linux'):
+        _libc_setaffinity(pid, [cpu])
+        return True
+
+    try:
+        import psutil
+    except ImportError:
+        return False
+    psutil.Process(pid or getpid()).cpu_affinity([cpu])
+
+    return True
+#}
+
+
+#-----------------------------------------------------------------------------
+# Prefork Server
+#-----------------------------------------------------------------------------
+
+class PreforkServer(object):  #{
+    """ Runs a NetCall service in a number of forked worker processes.
+
+        The supervisor binds a Broker to the public urls; every worker
+        connects its service to the backend side of the broker with a
+        BrokerWorker. Crashed workers are respawned and SIGHUP triggers
+        a rolling restart. A worker leaving the broker (see BrokerWorker.drain)
+        is taken out of rotation before it drains, so restarts do not fail
+        any request.
+    """
+    def __init__(self, factory, urls, workers=None, backend=None, pin_cpus=True,
+                 warmup=1.0, min_uptime=1.0, restart_delay=1.0, stop_timeout=10.0,
+                 drain_timeout=5.0, heartbeat=1.0):  #{
+        """
+        Parameters
+        ==========
+        factory       : <callable>
+            Called in every worker process (without arguments) to create
+            a service instance. The service must not be bound/connected.
+        urls          : <str> | [<str>, ...]
+            Public urls of the form proto://address to bind the front to.
+        workers       : [optional] <int>
+            Number of worker processes (default: number of CPU cores).
+        backend       : [optional] <str>
+            An url the workers connect to (default: ipc in a temp directory).
+        pin_cpus      : <bool>
+            Whether to pin every worker to its own CPU core.
+        warmup        : <float>
+            Seconds to let a fresh worker connect before its predecessor is
+            stopped during a rolling restart (and to let the workers connect
+            on start).
+        min_uptime    : <float>
+            A worker exiting sooner than that is considered crash-looping
+            and is respawned only after restart_delay seconds.
+        restart_delay : <float>
+        stop_timeout  : <float>
+            Seconds to wait for a worker to exit after SIGTERM before
+            it gets killed.
+        drain_timeout : <float>
+            Seconds a worker lets its in-flight requests finish after SIGTERM
+            (see BrokerWorker.drain), should be less than stop_timeout.
+            Set to 0 to shut workers down immediately.
+        heartbeat     : <float>
+            Seconds between broker heartbeats, a worker that has crashed
+            is forgotten by the broker after 3 of them.
+        """
+        if isinstance(urls, basestring):
+            urls = [urls]
+
+        self.factory       = factory
+        self.urls          = set(urls)
+        self.size          = workers or cpu_count()
+        self.pin_cpus      = pin_cpus
+        self.warmup        = warmup
+        self.min_uptime    = min_uptime
+        self.restart_delay = restart_delay
+        self.stop_timeout  = stop_timeout
+        self.drain_timeout = drain_timeout
+        self.heartbeat     = heartbeat
+
+        self._tmp_dir = None
+        if backend is None:
+            self._tmp_dir = mkdtemp(prefix='netcall-prefork-')
+            backend = 'ipc://%s/backend' % self._tmp_dir
+
+        self.backend  = backend
+        self.broker   = None
+        self.workers  = {}   # {<slot> : <Process>}
+
+        self._started    = {}    # {<slot> : <start time>}
+        self._respawn_at = {}    # {<slot> : <time>}
+        self._rolling    = []    # [<slot>, ...] waiting for a rolling restart
+        self._retiring   = None  # (<Process>, <warm time>) replaced by a fresh worker
+        self._stopping   = {}    # {<Process> : <kill time>} asked to exit
+        self._running    = False
+        self._restart    = False
+    #}
+    def _run_worker(self, slot):  #{
+        """ A worker process entry point """
+        def _exit(signum, frame):
+            raise SystemExit(0)
+
+        signal(SIGTERM, _exit)
+        signal(SIGINT,  SIG_IGN)  # the supervisor takes care of Ctrl-C
+        signal(SIGHUP,  SIG_DFL)
+
+        # a thread of the supervisor (e.g. the broker) could hold a handler
+        # lock at the moment of the fork, Python 2 has no at-fork hooks
+        log = logger
+        while log is not None:
+            for handler in log.handlers:
+                handler.createLock()
+            log = log.parent
+
+        if self.pin_cpus:
+            cpu = slot % cpu_count()
+            try:
+                if not set_cpu_affinity(cpu):
+                    logger.warning('CPU affinity is not supported on this platform '
+                                   '(install psutil), worker #%s is not pinned' % slot)
+            except Exception, e:
+                logger.warning('failed to pin worker #%s to CPU %s: %s' % (slot, cpu, e))
+
+        service = self.factory()
+        worker  = BrokerWorker(service, self.backend, heartbeat=self.heartbeat)
+        try:
+            worker.start()
+            service.start()
+            service.serve()
+        except SystemExit:
+            pass
+        finally:
+            signal(SIGTERM, SIG_IGN)
+            if self.drain_timeout:
+                worker.drain(self.drain_timeout)
+            else:
+                worker.stop()
+                service.shutdown()
+    #}
+    def _spawn(self, slot):  #{
+        worker = Process(target=self._run_worker, args=(slot,),
+                         name='%s-%s' % (self.__class__.__name__, slot))
+        worker.start()
+        logger.debug('spawned worker #%s (pid=%s)' % (slot, worker.pid))
+
+        self.workers[slot] = worker
+        self._started[slot] = time()
+        self._respawn_at.pop(slot, None)
+
+        return worker
+    #}
+    def _terminate(self, worker):  #{
+        """ Ask a worker to exit, kill it if it does not within stop_timeout """
+        if worker.is_alive():
+            worker.terminate()  # SIGTERM
+            worker.join(self.stop_timeout)
+        self._kill(worker)
+    #}
+    def _kill(self, worker):  #{
+        if worker.is_alive():
+            logger.warning('killing worker pid=%s' % worker.pid)
+            try:    kill(worker.pid, SIGKILL)
+            except: pass
+        worker.join()
+    #}
+    def _retire(self, worker):  #{
+        """ Ask a worker to exit without waiting for it (see _collect) """
+        if worker.is_alive():
+            worker.terminate()  # SIGTERM
+        self._stopping[worker] = time() + self.stop_timeout
+    #}
+    def _collect(self):  #{
+        """ Join retired workers that have exited, kill the ones
+            still running after stop_timeout
+        """
+        now = time()
+        for worker, kill_at in self._stopping.items():
+            if worker.is_alive() and kill_at > now:
+                continue
+            self._kill(worker)
+            del self._stopping[worker]
+    #}
+    def _roll(self):  #{
+        """ Advance a rolling restart by a step (non-blocking):
+            a fresh worker replaces the next slot and its predecessor
+            is retired after the warmup.
+
+            Returns True while the restart is in progress.
+        """
+        now = time()
+        if self._retiring is not None:
+            old, warm_at = self._retiring
+            if now < warm_at:
+                return True
+            self._retire(old)
+            self._retiring = None
+
+        while self._rolling:
+            slot = self._rolling.pop(0)
+            old  = self.workers.get(slot)
+            if old is None:
+                continue
+            self._spawn(slot)
+            self._retiring = (old, now + self.warmup)
+            return True
+
+        return False
+    #}
+    def _reap(self):  #{
+        """ Respawn workers that have exited """
+        now = time()
+
+        for slot, worker in self.workers.items():
+            if worker.is_alive():
+                continue
+
+            if slot not in self._respawn_at:
+                worker.join()
+                logger.warning('worker #%s (pid=%s) exited with code %s' % (
+                    slot, worker.pid, worker.exitcode
+                ))
+                uptime = now - self._started.get(slot, now)
+                delay  = self.restart_delay if uptime < self.min_uptime else 0
+                self._respawn_at[slot] = now + delay
+
+            if self._respawn_at[slot] <= now:
+                self._spawn(slot)
+    #}
+
+    #-------------------------------------------------------------------------
+    # Public API
+    #-------------------------------------------------------------------------
+
+    def start(self):  #{
+        """ Start the broker and fork the workers (non-blocking) """
+        assert self.broker is None, 'already started'
+
+        broker = Broker(heartbeat=self.heartbeat)
+        for url in self.urls:
+            broker.bind_frontend(url)
+        broker.bind_backend(self.backend)
+        broker.start()
+        self.broker = broker
+
+        for slot in range(self.size):
+            self._spawn(slot)
+
+        # let the workers announce themselves (up to the warmup)
+        deadline = time() + self.warmup
+        while len(broker.workers) < self.size and time() < deadline:
+            sleep(0.01)
+
+        self._running = True
+    #}
+    def restart(self, block=True):  #{
+        """ Restart the workers one by one (rolling restart).
+
+            A fresh worker is started before its predecessor is asked to exit
+            so the service stays available all the time.
+
+            Parameters
+            ==========
+            block : <bool>
+                Whether to wait until all the old workers have exited,
+                otherwise the restart is advanced by the supervisor loop
+                (see serve) which keeps respawning crashed workers meanwhile.
+        """
+        self._rolling = sorted(self.workers)
+
+        while block and (self._roll() or self._stopping):
+            self._collect()
+            sleep(0.05)
+    #}
+    def stop(self):  #{
+        """ Signal the supervisor loop to exit (non-blocking) """
+        self._running = False
+    #}
+    def shutdown(self):  #{
+        """ Stop all the workers and clean up """
+        self._running = False
+
+        workers = self.workers.values() + self._stopping.keys()
+        if self._retiring is not None:
+            workers.append(self._retiring[0])
+        for worker in workers:
+            worker.is_alive() and worker.terminate()
+        for worker in workers:
+            self._terminate(worker)
+        self.workers.clear()
+        self._stopping.clear()
+        self._rolling  = []
+        self._retiring = None
+
+        if self.broker is not None:
+            self.broker.stop()
+            self.broker = None
+
+        if self._tmp_dir is not None:
+            rmtree(self._tmp_dir, ignore_errors=True)
+    #}
+    def serve(self):  #{
+        """ Supervise the workers (blocking)
+
+            SIGTERM/SIGINT stop the server, SIGHUP triggers a rolling restart.
+        """
+        if not self._running:
+            self.start()
+
+        def _stop(signum, frame):
+            self.stop()
+
+        def _restart(signum, frame):
+            self._restart = True
+
+        signal(SIGTERM, _stop)
+        signal(SIGINT,  _stop)
+        signal(SIGHUP,  _restart)
+
+        try:
+            while self._running:
+                if self._restart:
+                    self._restart = False
+                    self.restart(block=False)
+                self._roll()
+                self._collect()
+                self._reap()
+                sleep(0.1)
+        finally:
+            self.shutdown()
+    #}
+#}
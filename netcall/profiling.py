@@ -0,0 +1,306 @@
+# vim: fileencoding=utf-8 et ts=4 sts=4 sw=4 tw=0 fdm=marker fmr=#{,#}
+
+"""
+On-demand profiling of NetCall procedures.
+
+Authors:
+
+* Alexander Glyzov
+
+Every service has a Profiler controlled remotely by reserved procedures:
+
+    client.call('_netcall.profile.start', kwargs=dict(name='slow', calls=100))
+    ...
+    print client.call('_netcall.profile.result')  # None until finished
+    print client.call('_netcall.profile.stop')    # finish right away
+
+    # flame graphs (collapsed stacks)
+    client.call('_netcall.profile.start', kwargs=dict(seconds=10, mode='sampling'))
+"""
+
+#-----------------------------------------------------------------------------
+#  Copyright (C) 2012-2014. Brian Granger, Min Ragan-Kelley, Alexander Glyzov
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file LICENSE distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+# Imports
+#-----------------------------------------------------------------------------
+
+from __future__ import absolute_import
+
+from sys         import _current_frames
+from time        import time, sleep
+from marshal     import dumps
+from pstats      import Stats
+from cProfile    import Profile
+from functools   import partial
+from threading   import Lock
+from cStringIO   import StringIO
+from collections import defaultdict
+from os.path     import basename
+
+from .utils import logger, start_native_thread
+
+
+#-----------------------------------------------------------------------------
+# Profiling sessions
+#-----------------------------------------------------------------------------
+
+class _Session(object):  #{
+    """ A single profiling session, base class """
+
+    def __init__(self, name=None, seconds=None, calls=None):  #{
+        self.name     = name
+        self.started  = time()
+        self.deadline = None if seconds is None else self.started + seconds
+        self.calls    = calls
+        self.accepted = 0
+        self.profiled = 0
+        self.stopped  = None
+        self._lock    = Lock()
+    #}
+    @property
+    def done(self):  #{
+        if self.stopped is None:
+            if (self.calls is not None and self.profiled >= self.calls) \
+            or (self.deadline is not None and time() >= self.deadline):
+                self.stopped = time()
+        return self.stopped is not None
+    #}
+    def stop(self):  #{
+        if self.stopped is None:
+            self.stopped = time()
+    #}
+    def accept(self, name):  #{
+        "Whether to wrap a call of a procedure to be profiled"
+        if name.startswith('_netcall.') or (self.name is not None and name != self.name):
+            return False
+        return not self.done
+    #}
+    def _enter(self):  #{
+        """ Whether a wrapped call is to be profiled (counts it if so),
+            called by run() so that nothing is held for calls that never run
+        """
+        with self._lock:
+            if self.done or (self.calls is not None and self.accepted >= self.calls):
+                return False
+            self.accepted += 1
+            return True
+    #}
+    def _header(self):  #{
+        return '# %s calls of %s profiled in %.3f sec\n' % (
+            self.profiled, self.name or 'all procedures', (self.stopped or time()) - self.started
+        )
+    #}
+#}
+
+class _CProfileSession(_Session):  #{
+    """ Deterministic profiling with cProfile, the results are aggregated
+        as pstats. Calls are profiled one at a time since the profiler
+        hook is per thread and greenlets share a thread.
+    """
+    def __init__(self, *args, **kwargs):  #{
+        super(_CProfileSession, self).__init__(*args, **kwargs)
+        self.stats = None
+        self._busy = Lock()
+    #}
+    def run(self, proc, *args, **kwargs):  #{
+        if not self._busy.acquire(False):
+            return proc(*args, **kwargs)  # another call is being profiled
+        try:
+            if not self._enter():
+                return proc(*args, **kwargs)
+            profile = Profile()
+            try:
+                return profile.runcall(proc, *args, **kwargs)
+            finally:
+                with self._lock:
+                    if self.stats is None:
+                        self.stats = Stats(profile)
+                    else:
+                        self.stats.add(profile)
+                    self.profiled += 1
+        finally:
+            self._busy.release()
+    #}
+    def report(self, limit=50, raw=False):  #{
+        """ Returns pstats text sorted by cumulative time (limited to a number
+            of lines) or a marshal dump loadable by pstats.Stats if raw is True
+        """
+        with self._lock:
+            stats = self.stats
+            if raw:
+                return dumps(stats.stats if stats is not None else {})
+            output = StringIO()
+            output.write(self._header())
+            if stats is not None:
+                stats.stream = output
+                stats.sort_stats('cumulative').print_stats(limit)
+            return output.getvalue()
+    #}
+#}
+
+class _SamplingSession(_Session):  #{
+    """ Statistical profiling, stacks of the running calls are sampled from
+        a native thread every interval seconds and counted as collapsed
+        stacks (the input format of flamegraph.pl and speedscope).
+        Only procedures written in Python can be sampled.
+    """
+    def __init__(self, name=None, seconds=None, calls=None, interval=0.005):  #{
+        super(_SamplingSession, self).__init__(name, seconds, calls)
+        self.interval = interval
+        self.samples  = defaultdict(int)  # {<collapsed stack> : <count>}
+        self._running = {}                # {<code> : <number of calls>}
+        start_native_thread(self._sampler)
+    #}
+    def run(self, proc, *args, **kwargs):  #{
+        if not self._enter():
+            return proc(*args, **kwargs)
+        code = getattr(getattr(proc, '__func__', proc), '__code__', None)
+        with self._lock:
+            self._running[code] = self._running.get(code, 0) + 1
+        try:
+            return proc(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._running[code] -= 1
+                if not self._running[code]:
+                    del self._running[code]
+                self.profiled += 1
+    #}
+    def _sampler(self):  #{
+        try:
+            while not self.done:
+                sleep(self.interval)
+                with self._lock:
+                    running = set(self._running)
+                if running:
+                    self._sample(running)
+        except Exception, e:
+            logger.error(e, exc_info=True)
+    #}
+    def _sample(self, running):  #{
+        "Count stacks from the frames of profiled procedures down"
+        for frame in _current_frames().values():
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('%s (%s:%s)' % (code.co_name, basename(code.co_filename), code.co_firstlineno))
+                if code in running:
+                    break
+                frame = frame.f_back
+            else:
+                continue  # not a profiled call
+            with self._lock:
+                self.samples[';'.join(reversed(stack))] += 1
+    #}
+    def report(self, limit=None, raw=False):  #{
+        """ Returns collapsed stacks: '<frame>;<frame>;... <count>' lines
+            (the most frequent first, all of them by default)
+        """
+        with self._lock:
+            samples = sorted(self.samples.items(), key=lambda item: -item[1])
+        if limit:
+            samples = samples[:limit]
+        return '\n'.join('%s %s' % item for item in samples)
+    #}
+#}
+
+
+#-----------------------------------------------------------------------------
+# Profiler
+#-----------------------------------------------------------------------------
+
+class Profiler(object):  #{
+    """ Profiles procedure calls of a service on demand.
+
+        A service passes every procedure through wrap() while a session
+        is active; an idle profiler costs a single attribute check.
+    """
+    MODES = {
+        'cprofile' : _CProfileSession,
+        'sampling' : _SamplingSession,
+    }
+
+    def __init__(self):  #{
+        self.session = None  # an active session
+        self.last    = None  # the last session (active or finished)
+        self._lock   = Lock()
+    #}
+    def wrap(self, name, proc):  #{
+        """ Returns proc wrapped to be profiled if the active session
+            is interested in the procedure, otherwise proc itself
+        """
+        session = self.session
+        if session is None:
+            return proc
+        if session.done:
+            self.session = None
+            return proc
+        if not session.accept(name):
+            return proc
+        return partial(session.run, proc)
+    #}
+
+    #-------------------------------------------------------------------------
+    # Control procedures
+    #-------------------------------------------------------------------------
+
+    def start(self, name=None, seconds=None, calls=None, mode='cprofile', interval=0.005):  #{
+        """ Start profiling (finishes after seconds or a number of calls
+            whatever happens first, or on stop)
+
+            Parameters
+            ==========
+            name     : [optional] <str> a procedure to profile (all by default)
+            seconds  : [optional] <float>
+            calls    : [optional] <int>
+            mode     : <str>
+                'cprofile' - deterministic profiling reported as pstats
+                'sampling' - statistical profiling reported as collapsed stacks
+            interval : <float> seconds between samples (the sampling mode)
+        """
+        if mode not in self.MODES:
+            raise ValueError('unknown profiling mode %r' % mode)
+        if seconds is None and calls is None:
+            raise ValueError('seconds or calls is required')
+
+        with self._lock:
+            if self.last is not None and not self.last.done:
+                raise RuntimeError('profiling is already in progress')
+            options = dict(interval=interval) if mode == 'sampling' else {}
+            self.session = self.last = self.MODES[mode](name, seconds, calls, **options)
+        return True
+    #}
+    def result(self, limit=50, raw=False):  #{
+        """ Returns a report of the last session if it has finished
+            or None (see stop)
+        """
+        session = self.last
+        if session is None or not session.done:
+            return None
+        return session.report(limit, raw)
+    #}
+    def stop(self, limit=50, raw=False):  #{
+        """ Finish profiling and return a report:
+
+            - pstats text sorted by cumulative time (limited to a number of
+              lines) or a marshal dump loadable by pstats.Stats if raw is True
+            - collapsed stacks for the sampling mode (the most frequent first)
+        """
+        session = self.last
+        if session is None:
+            raise RuntimeError('profiling has not been started')
+        session.stop()
+        self.session = None
+        return session.report(limit, raw)
+    #}
+#}
+
+
+__all__ = [
+    'Profiler',
+]
@@ -82,6 +82,8 @@ class SyncRPCClient(RPCClientBase):  #{
                     msg = self.socket.recv_multipart()
                     return msg
                 else:
+                    if self.metrics is not None:
+                        self.metrics.timed_out(req_id)
                     raise RPCTimeoutError("Request %s timed out after %s sec" % (req_id, timeout))
         else:
             recv_multipart = self.socket.recv_multipart
@@ -93,19 +95,19 @@ class SyncRPCClient(RPCClientBase):  #{
             reply = self._parse_reply(msg_list)
 
             if reply is None \
-            or reply['req_id'] != req_id:
+            or reply.req_id != req_id:
                 continue
 
-            if reply['type'] == b'ACK':
+            if reply.type == b'ACK':
                 if ignore:
                     return None
                 else:
                     continue
 
-            if reply['type'] == b'OK':
-                return reply['result']
+            if reply.type == b'OK':
+                return reply.result
             else:
-                raise reply['result']
+                raise reply.result
     #}
 #}
 
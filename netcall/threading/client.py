@@ -32,7 +32,7 @@ except ImportError:
 import zmq
 
 from ..base   import RPCClientBase
-from ..utils  import get_zmq_classes, ThreadPool, logger
+from ..utils  import get_zmq_classes, ThreadPool, pool_size, logger
 from ..errors import RPCTimeoutError
 
 
@@ -79,7 +79,7 @@ class ThreadingRPCClient(RPCClientBase):
 
         # request drainage
         self._sync_ev  = Event()
-        self.req_queue = Queue(maxsize=self.pool._workers)
+        self.req_queue = Queue(maxsize=pool_size(self.pool))
         self.req_pub   = self.context.socket(zmq.PUB)
         self.req_addr  = 'inproc://%s-%s' % (
             self.__class__.__name__,
@@ -203,9 +203,9 @@ class ThreadingRPCClient(RPCClientBase):
                     #logger.debug('skipping invalid reply')
                     continue
 
-                req_id   = reply['req_id']
-                msg_type = reply['type']
-                result   = reply['result']
+                req_id   = reply.req_id
+                msg_type = reply.type
+                result   = reply.result
 
                 if msg_type == b'ACK':
                     #logger.debug('skipping ACK, req_id=%r' % req_id)
@@ -258,25 +258,29 @@ class ThreadingRPCClient(RPCClientBase):
 
         req_id, msg_list = self._build_request(proc_name, args, kwargs, ignore)
 
-        self.req_queue.put(msg_list)
-
         if ignore:
+            self.req_queue.put(msg_list)
             return None
 
+        # register the future before sending so that a quick reply is not lost
+        future = Future()
+        self._results[req_id] = future
+        self.req_queue.put(msg_list)
+
         if timeout and timeout > 0:
             def _abort_request():
                 result = self._results.pop(req_id, None)
                 if result is not None:
                     tout_msg  = "Request %s timed out after %s sec" % (req_id, timeout)
                     logger.debug(tout_msg)
+                    if self.metrics is not None:
+                        self.metrics.timed_out(req_id)
                     result.set_exception(RPCTimeoutError(tout_msg))
             timer = Timer(timeout, _abort_request)
             timer.start()
         else:
             timer = None
 
-        future = Future()
-        self._results[req_id] = future
         #logger.debug('waiting for result=%r' % result)
         try:
             result = future.result()  # block waiting for a reply passed by the io_thread
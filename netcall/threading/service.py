@@ -20,14 +20,18 @@ Authors
 # Imports
 #-----------------------------------------------------------------------------
 
+from time      import time
+from heapq     import heappush, heappop
 from random    import randint
 from Queue     import Queue
-from threading import Event
+from thread    import get_ident
+from threading import Event, Lock
+from itertools import count
 
 import zmq
 
 from ..base  import RPCServiceBase
-from ..utils import get_zmq_classes, ThreadPool, logger
+from ..utils import get_zmq_classes, ThreadPool, pool_size, pool_stats, logger
 
 
 #-----------------------------------------------------------------------------
@@ -67,12 +71,21 @@ class ThreadingRPCService(RPCServiceBase):
             self.pool      = pool
             self._ext_pool = True
 
+        # threads of the pool left for requests (the io and res threads take two)
+        self.capacity = max(1, pool_size(self.pool) - 2)
+
         self.io_thread  = None
         self.res_thread = None
+        self._io_ident  = None
+
+        # delayed calls run by the io_thread: a heap of (<deadline>, <seq>, <func>, <args>)
+        self._timers      = []
+        self._timers_lock = Lock()
+        self._timers_seq  = count()
 
         # result drainage
         self._sync_ev  = Event()
-        self.res_queue = Queue(maxsize=self.pool._workers)
+        self.res_queue = Queue(maxsize=pool_size(self.pool))
         self.res_pub   = self.context.socket(zmq.PUB)
         self.res_addr  = 'inproc://%s-%s' % (
             self.__class__.__name__,
@@ -88,47 +101,48 @@ class ThreadingRPCService(RPCServiceBase):
         """ Send a multipart reply to a caller.
             Here we send the reply down the internal res_pub socket
             so that an io_thread could send it back to the caller.
+            Replies made by the io_thread itself (ACKs, cached results)
+            are sent directly.
 
             Notice: reply is a list produced by self._build_reply()
         """
-        self.res_queue.put(reply)
+        if get_ident() == self._io_ident:
+            self.socket.send_multipart(reply)
+        else:
+            self.res_queue.put(reply)
     #}
-    def _handle_request(self, msg_list):  #{
-        """Handle an incoming request.
-
-        The request is received as a multipart message:
-
-        [<id>..<id>, b'|', req_id, proc_name, <ser_args>, <ser_kwargs>, <ignore>]
-
-        First, the service sends back a notification that the message was
-        indeed received:
-
-        [<id>..<id>, b'|', req_id, b'ACK',  service_id]
-
-        Next, the actual reply depends on if the call was successful or not:
-
-        [<id>..<id>, b'|', req_id, b'OK',   <serialized result>]
-        [<id>..<id>, b'|', req_id, b'FAIL', <JSON dict of ename, evalue, traceback>]
-
-        Here the (ename, evalue, traceback) are utf-8 encoded unicode.
+    def _execute(self, func, *args):  #{
+        "Run func(*args) in the thread pool"
+        self.pool.schedule(func, args=args)
+    #}
+    def _call_later(self, delay, func, *args):  #{
+        """ Schedule func(*args) to be called by the io_thread after delay seconds
+            (it polls with a timeout until the nearest deadline)
         """
-        req = self._parse_request(msg_list)
-        if req is None:
-            return
-        self._send_ack(req)
-
-        ignore = req['ignore']
-
-        try:
-            # raise any parsing errors here
-            if req['error']:
-                raise req['error']
-            # call procedure
-            res = req['proc'](*req['args'], **req['kwargs'])
-        except Exception:
-            not ignore and self._send_fail(req)
-        else:
-            not ignore and self._send_ok(req, res)
+        with self._timers_lock:
+            heappush(self._timers, (time() + delay, next(self._timers_seq), func, args))
+        if self._io_ident is not None and get_ident() != self._io_ident:
+            self.res_queue.put([b'', b'WAKE'])  # let the io_thread update its poll timeout
+    #}
+    def _poll_timeout(self):  #{
+        "Milliseconds until the nearest delayed call or None if there are none"
+        with self._timers_lock:
+            if not self._timers:
+                return None
+            return max(0, self._timers[0][0] - time()) * 1000
+    #}
+    def _run_timers(self):  #{
+        "Call the delayed calls that are due (in the io_thread)"
+        due = []
+        now = time()
+        with self._timers_lock:
+            while self._timers and self._timers[0][0] <= now:
+                due.append(heappop(self._timers))
+        for _, _, func, args in due:
+            try:
+                func(*args)
+            except Exception, e:
+                logger.error(e, exc_info=True)
     #}
     def start(self):  #{
         """ Start the RPC service (non-blocking).
@@ -183,6 +197,10 @@ class ThreadingRPCService(RPCServiceBase):
             poll = poller.poll
 
             handle_request = self._handle_request
+            poll_timeout   = self._poll_timeout
+            run_timers     = self._run_timers
+            timers         = self._timers
+            self._io_ident = get_ident()
 
             try:
                 # synchronizing with the res_thread
@@ -194,24 +212,29 @@ class ThreadingRPCService(RPCServiceBase):
                 running = True
 
                 while running:
-                    for socket, _ in poll():
+                    for socket, _ in poll(poll_timeout() if timers else None):
                         if socket is task_sock:
                             request = task_sock.recv_multipart()
-                            # handle request in a thread-pool
-                            self.pool.schedule(handle_request, args=(request,))
+                            # parse the request and pass it to the thread-pool
+                            handle_request(request)
                         elif socket is res_sub:
                             result = res_sub.recv_multipart()
                             #logger.debug('received a result: %r' % result)
                             if not result[0]:
+                                if len(result) > 1:
+                                    continue  # a WAKE signal (see _call_later)
                                 logger.debug('io_thread received an EXIT signal')
                                 running = False
                                 break
                             else:
                                 task_sock.send_multipart(result)
+                    if timers:
+                        run_timers()
             except Exception, e:
                 logger.error(e, exc_info=True)
 
             # -- cleanup --
+            self._io_ident = None
             res_sub.close(0)
 
             logger.debug('io_thread exited')
@@ -222,6 +245,20 @@ class ThreadingRPCService(RPCServiceBase):
 
         return self.res_thread, self.io_thread
     #}
+    def workload(self):  #{
+        """ Returns a snapshot of the work on hand:
+
+            {
+                'inflight'  : <int>,  # requests received but not finished yet
+                'res_queue' : <int>,  # replies waiting for the I/O thread
+                'pool'      : {'workers':<int>, 'queued':<int>} | None,  # see utils.pool_stats
+            }
+        """
+        workload = super(ThreadingRPCService, self).workload()
+        workload['res_queue'] = self.res_queue.qsize()
+        workload['pool']      = pool_stats(self.pool)
+        return workload
+    #}
     def stop(self):  #{
         """ Stop the RPC service (semi-blocking) """
         if self.res_thread and not self.res_thread.ready:
@@ -232,12 +269,16 @@ class ThreadingRPCService(RPCServiceBase):
             self.res_thread = None
             self.io_thread  = None
     #}
-    def shutdown(self):  #{
-        """ Signal the threads to exit and close all sockets """
+    def shutdown(self, linger=0):  #{
+        """ Signal the threads to exit and close all sockets
+
+            Notice: replies queued before are sent before the I/O thread exits,
+            linger is the number of milliseconds to keep flushing them after.
+        """
         self.stop()
 
         logger.debug('closing the sockets')
-        self.socket.close(0)
+        self.socket.close(linger)
         self.res_pub.close(0)
 
         if not self._ext_pool:
@@ -75,9 +75,9 @@ class TornadoRPCClient(RPCClientBase):  #{
         if reply is None:
             return
 
-        req_id   = reply['req_id']
-        msg_type = reply['type']
-        result   = reply['result']
+        req_id   = reply.req_id
+        msg_type = reply.type
+        result   = reply.result
 
         if msg_type == b'ACK':
             return
@@ -142,6 +142,8 @@ class TornadoRPCClient(RPCClientBase):  #{
                 future, _ = future_tout
                 tout_msg  = "Request %s timed out after %s sec" % (req_id, timeout)
                 logger.debug(tout_msg)
+                if self.metrics is not None:
+                    self.metrics.timed_out(req_id)
                 future.set_exception(RPCTimeoutError(tout_msg))
 
         timeout = timeout or 0
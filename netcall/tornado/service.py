@@ -20,15 +20,24 @@ Authors:
 # Imports
 #-----------------------------------------------------------------------------
 
+from types import GeneratorType
+
 import zmq
 
 from zmq.eventloop.zmqstream import ZMQStream
 from zmq.eventloop.ioloop    import IOLoop
 
-from tornado.concurrent import Future
+from tornado            import gen
+from tornado.concurrent import Future, is_future
 
 from ..base import RPCServiceBase
 
+try:
+    from inspect import isawaitable
+except ImportError:  # Python < 3.5
+    def isawaitable(obj):
+        return False
+
 #-----------------------------------------------------------------------------
 # RPC Service
 #-----------------------------------------------------------------------------
@@ -36,7 +45,15 @@ from ..base import RPCServiceBase
 class TornadoRPCService(RPCServiceBase):  #{
     """ An asynchronous RPC service that takes requests over a ROUTER socket.
         Using Tornado compatible IOLoop and ZMQStream from PyZMQ.
+
+        Procedures run on the IOLoop. A procedure may return a Future or be
+        a coroutine (@gen.coroutine, a plain generator or async def), then
+        the reply is sent when it completes. Blocking procedures should be
+        registered with an executor:
+
+            service.register(blocking_func, executor=ThreadPoolExecutor(8))
     """
+    _OPTIONS = RPCServiceBase._OPTIONS + ['executor']
 
     def __init__(self, context=None, ioloop=None, **kwargs):  #{
         """
@@ -63,51 +80,69 @@ class TornadoRPCService(RPCServiceBase):  #{
         socket = self.context.socket(zmq.ROUTER)
         self.socket = ZMQStream(socket, self.ioloop)
     #}
-    def _handle_request(self, msg_list):  #{
+    def _call_later(self, delay, func, *args):  #{
+        self.ioloop.call_later(delay, func, *args)
+    #}
+    def _invoke(self, request, args, kwargs):  #{
+        """ Call the procedure of a request (submit it to the executor if the
+            procedure was registered with one, a Future is returned then)
         """
-        Handle an incoming request.
-
-        The request is received as a multipart message:
-
-        [<id>..<id>, b'|', req_id, proc_name, <ser_args>, <ser_kwargs>, <ignore>]
-
-        First, the service sends back a notification that the message was
-        indeed received:
-
-        [<id>..<id>, b'|', req_id, b'ACK',  service_id]
+        executor = request.options.get('executor')
+        if executor is None:
+            return request.proc(*args, **kwargs)
+        return executor.submit(request.proc, *args, **kwargs)
+    #}
+    def _send_result(self, request, result):  #{
+        "Send a result of a procedure call and finish the request (waits for a Future)"
+        if isinstance(result, GeneratorType):
+            result = gen.coroutine(lambda: result)()
+        elif isawaitable(result):
+            result = gen.convert_yielded(result)
+
+        if not is_future(result):
+            return super(TornadoRPCService, self)._send_result(request, result)
+
+        def send_future_result(fut):
+            try:    res = fut.result()
+            except: self._fail(request)
+            else:   super(TornadoRPCService, self)._send_result(request, res)
+
+        self.ioloop.add_future(result, send_future_result)
+    #}
+    def drain(self, timeout=None):  #{
+        """ Shut the service down gracefully (non-blocking):
 
-        Next, the actual reply depends on if the call was successful or not:
+            - new requests are rejected with RPCBusyError
+            - in-flight requests are let finish (up to timeout seconds)
+            - their replies are flushed (within the rest of the timeout)
+              and the socket is closed
 
-        [<id>..<id>, b'|', req_id, b'OK',   <serialized result>]
-        [<id>..<id>, b'|', req_id, b'FAIL', <JSON dict of ename, evalue, traceback>]
+            Requests still routed here fail with a RPCBusyError, drain is
+            error-free only behind a Broker (see RPCServiceBase.drain).
 
-        Here the (ename, evalue, traceback) are utf-8 encoded unicode.
+            Returns a Future resolved with True if all the in-flight requests
+            have finished in time.
         """
-        req = self._parse_request(msg_list)
-        if req is None:
-            return
-        self._send_ack(req)
-
-        ignore = req['ignore']
-
-        try:
-            # raise any parsing errors here
-            if req['error']:
-                raise req['error']
-            # call procedure
-            res = req['proc'](*req['args'], **req['kwargs'])
-        except Exception:
-            not ignore and self._send_fail(req)
-        else:
-            def send_future_result(fut):
-                try:    res = fut.result()
-                except: not ignore and self._send_fail(req)
-                else:   not ignore and self._send_ok(req, res)
-
-            if isinstance(res, Future):
-                self.ioloop.add_future(res, send_future_result)
-            else:
-                not ignore and self._send_ok(req, res)
+        ioloop   = self.ioloop
+        future   = Future()
+        deadline = None if timeout is None else ioloop.time() + timeout
+
+        def check():
+            now = ioloop.time()
+            if self._inflight > 0 and (deadline is None or now < deadline):
+                ioloop.call_later(0.01, check)
+                return
+            self.socket.flush()
+            linger = -1 if deadline is None else int(max(0, deadline - now) * 1000)
+            finished = self._inflight <= 0
+            self.shutdown(linger=linger)
+            future.set_result(finished)
+
+        with self._inflight_lock:
+            self._draining = True
+        ioloop.add_callback(check)
+
+        return future
     #}
     def start(self):  #{
         """ Start the RPC service (non-blocking) """
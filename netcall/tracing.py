@@ -0,0 +1,240 @@
+# vim: fileencoding=utf-8 et ts=4 sts=4 sw=4 tw=0 fdm=marker fmr=#{,#}
+
+"""
+Distributed tracing of NetCall requests.
+
+Authors:
+
+* Alexander Glyzov
+
+A client attaches the current trace context (if any) to every request as
+an extra frame in the W3C traceparent format. A service restores it while
+the procedure runs, so nested calls continue the trace, and a Tracer
+middleware emits a span with timings of every phase of a sampled request.
+
+Example
+-------
+
+    from netcall.tracing import Tracer, trace
+
+    tracer = Tracer(name=service.service_id, sink=collector.append)
+    service.add_middleware(tracer)
+    ...
+    with trace() as context:  # a new trace (or continue a given context)
+        client.work()         # nested calls made by `work` are traced too
+
+    spans = tracer.get(context.trace_id)
+
+Notice: the context is local to a thread/greenlet. Coroutine procedures
+(tornado) and procedures run in an executor see it only until
+they yield or switch threads; batch procedures do not see it at all.
+"""
+
+#-----------------------------------------------------------------------------
+#  Copyright (C) 2012-2014. Brian Granger, Min Ragan-Kelley, Alexander Glyzov
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file LICENSE distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+# Imports
+#-----------------------------------------------------------------------------
+
+from __future__ import absolute_import
+
+from time        import time
+from random      import getrandbits
+from weakref     import WeakKeyDictionary
+from contextlib  import contextmanager
+from collections import deque
+
+from .metrics import request_phases
+from .utils   import logger
+
+try:
+    from greenlet import getcurrent
+except ImportError:
+    getcurrent = None
+
+
+#-----------------------------------------------------------------------------
+# Trace context
+#-----------------------------------------------------------------------------
+
+class TraceContext(object):  #{
+    """ A position in a trace: the trace, the current span and its parent """
+
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'sampled')
+
+    def __init__(self, trace_id=None, span_id=None, parent_id=None, sampled=True):  #{
+        """
+        Parameters
+        ==========
+        trace_id  : [optional] <bytes> 32 hex digits (a random one by default)
+        span_id   : [optional] <bytes> 16 hex digits (a random one by default)
+        parent_id : [optional] <bytes> a span id of the caller
+        sampled   : <bool> whether spans of the trace are recorded
+        """
+        self.trace_id  = trace_id or b'%032x' % getrandbits(128)
+        self.span_id   = span_id  or b'%016x' % getrandbits(64)
+        self.parent_id = parent_id
+        self.sampled   = sampled
+    #}
+    def child(self):  #{
+        "Returns a context of a new span within the same trace"
+        return TraceContext(self.trace_id, None, self.span_id, self.sampled)
+    #}
+    def encode(self):  #{
+        "Returns a traceparent frame: 00-<trace_id>-<span_id>-<flags>"
+        return b'00-%s-%s-%s' % (self.trace_id, self.span_id, b'01' if self.sampled else b'00')
+    #}
+    @classmethod
+    def decode(cls, frame):  #{
+        """ Returns a context of the caller's span from a traceparent frame
+            or None if the frame is malformed
+        """
+        try:
+            version, trace_id, span_id, flags = frame.split(b'-')
+            if len(trace_id) != 32 or len(span_id) != 16:
+                raise ValueError('bad id length')
+            int(trace_id, 16); int(span_id, 16)
+            sampled = bool(int(flags, 16) & 1)
+        except Exception:
+            logger.warning('bad trace context: %r' % frame)
+            return None
+        return cls(trace_id, span_id, None, sampled)
+    #}
+    def __repr__(self):  #{
+        return '<TraceContext %s/%s parent=%s sampled=%s>' % (
+            self.trace_id, self.span_id, self.parent_id, self.sampled
+        )
+    #}
+#}
+
+
+#-----------------------------------------------------------------------------
+# Context-local storage
+#-----------------------------------------------------------------------------
+
+if getcurrent is not None:
+    # a main greenlet is unique per thread so this covers threads as well
+    _contexts = WeakKeyDictionary()  # {<greenlet> : <TraceContext>}
+
+    def current_trace():  #{
+        "Returns the trace context of the current thread/greenlet or None"
+        return _contexts.get(getcurrent())
+    #}
+    def set_trace(context):  #{
+        "Set (or clear with None) the current trace context, returns the previous one"
+        key = getcurrent()
+        previous = _contexts.pop(key, None)
+        if context is not None:
+            _contexts[key] = context
+        return previous
+    #}
+else:
+    from threading import local
+
+    _local = local()
+
+    def current_trace():  #{
+        "Returns the trace context of the current thread or None"
+        return getattr(_local, 'context', None)
+    #}
+    def set_trace(context):  #{
+        "Set (or clear with None) the current trace context, returns the previous one"
+        previous = getattr(_local, 'context', None)
+        _local.context = context
+        return previous
+    #}
+
+@contextmanager
+def trace(context=None, sampled=True):  #{
+    """ Make a trace context current within a with-block
+        (a new trace by default), yields the context
+    """
+    if context is None:
+        context = TraceContext(sampled=sampled)
+    previous = set_trace(context)
+    try:
+        yield context
+    finally:
+        set_trace(previous)
+#}
+
+
+#-----------------------------------------------------------------------------
+# Tracer
+#-----------------------------------------------------------------------------
+
+class Tracer(object):  #{
+    """ A service middleware (see RPCServiceBase.add_middleware) emitting
+        a span of every sampled request after its reply is sent:
+
+        {'trace_id':<bytes>, 'span_id':<bytes>, 'parent_id':<bytes>,
+         'service':<str>, 'procedure':<str>, 'req_id':<bytes>,
+         'start':<float>, 'duration':<float>, 'failed':<bool>,
+         'phases':{'parse':<float>, 'queue':<float>, 'deserialize':<float>,
+                   'execute':<float>, 'serialize':<float>, 'handoff':<float>}}
+
+        Spans are kept in a ring buffer and passed to a sink if any.
+    """
+    def __init__(self, name=None, sink=None, max_spans=1000):  #{
+        """
+        Parameters
+        ==========
+        name      : [optional] <str> a service name put into spans
+        sink      : [optional] <callable> called with every span
+        max_spans : <int> a size of the ring buffer
+        """
+        self.name  = name
+        self.sink  = sink
+        self.spans = deque(maxlen=max_spans)
+    #}
+    def _emit(self, request):  #{
+        context = request.trace
+        if context is None or not context.sampled:
+            return
+
+        now    = time()
+        phases = request_phases(request, now)
+        span   = dict(
+            trace_id  = context.trace_id,
+            span_id   = context.span_id,
+            parent_id = context.parent_id,
+            service   = self.name,
+            procedure = request.name,
+            req_id    = request.req_id,
+            start     = request.received,
+            duration  = now - request.received,
+            failed    = request.failed,
+            phases    = phases,
+        )
+        self.spans.append(span)
+        if self.sink is not None:
+            self.sink(span)
+    #}
+    def after_dispatch(self, request, result):  #{
+        self._emit(request)
+    #}
+    def on_error(self, request, error):  #{
+        self._emit(request)
+    #}
+    def get(self, trace_id=None):  #{
+        "Returns recorded spans (of a trace), the oldest first"
+        spans = list(self.spans)
+        if trace_id is None:
+            return spans
+        return [span for span in spans if span['trace_id'] == trace_id]
+    #}
+#}
+
+
+__all__ = [
+    'TraceContext',
+    'current_trace',
+    'set_trace',
+    'trace',
+    'Tracer',
+]
@@ -5,6 +5,7 @@ from __future__ import absolute_import
 from sys     import stderr, modules
 from imp     import new_module
 from runpy   import _get_module_details
+from random  import random
 from logging import getLogger, DEBUG
 
 from pebble import ThreadPool
@@ -208,23 +209,129 @@ def get_green_tools(env=None):  #{
 
     return spawn, spawn_later, Event, Condition
 #}
-def green_device(inp, out, env=None):  #{
+def get_green_tpool(env=None):  #{
+    """ Returns a callable apply(func, args=(), kwargs={}) that runs func
+        in a pool of native threads blocking only the calling green thread.
+
+        Gevent (the hub ThreadPool) and Eventlet (tpool) are supported.
+    """
+    env = env or detect_green_env() or 'gevent'
+
+    if env == 'gevent':
+        from gevent import get_hub
+
+        def apply(func, args=(), kwargs={}):
+            return get_hub().threadpool.apply(func, args, kwargs)
+
+    elif env == 'eventlet':
+        from eventlet import tpool
+
+        def apply(func, args=(), kwargs={}):
+            return tpool.execute(func, *args, **kwargs)
+
+    else:
+        raise ValueError('native thread pools are not supported in %r' % env)
+
+    return apply
+#}
+def get_original(module, name):  #{
+    """ Returns an original (not monkey-patched) attribute of a module,
+        e.g. get_original('time', 'sleep'), Gevent and Eventlet are supported.
+    """
+    env = detect_green_env()
+
+    if env == 'gevent':
+        from gevent.monkey import get_original
+        return get_original(module, name)
+
+    elif env == 'eventlet':
+        from eventlet.patcher import original
+        return getattr(original(module), name)
+
+    elif env is None:
+        return getattr(__import__(module), name)
+
+    else:
+        raise ValueError('native %s.%s is not supported in %r' % (module, name, env))
+#}
+def start_native_thread(func, *args):  #{
+    """ Starts a real OS thread running func(*args) even in a monkey-patched
+        green environment (Gevent and Eventlet are supported).
+
+        Returns the thread identifier.
+    """
+    return get_original('thread', 'start_new_thread')(func, args)
+#}
+def pool_size(pool, default=128):  #{
+    """ Returns a number of threads in a ThreadPool (pebble keeps it private)
+        or the default one if the pool does not tell
+    """
+    return getattr(pool, '_workers', None) or default
+#}
+def pool_stats(pool):  #{
+    """ Returns a snapshot of a ThreadPool:
+
+        {'workers':<int>, 'queued':<int>}  # threads, tasks waiting for a free thread
+
+        or None if it is not a pebble ThreadPool
+    """
+    workers = getattr(pool, '_workers', None)
+    queue   = getattr(pool, '_queue', None)
+    if workers is None or queue is None:
+        return None
+    return dict(workers=workers, queued=queue.qsize())
+#}
+def green_device(inp, out, env=None, shadow=None, fraction=1.0):  #{
+    """ A device passing messages between two green sockets in greenlets
+        (blocks until they exit).
+
+        Parameters
+        ==========
+        inp      : <Socket> a front socket (requests come from it)
+        out      : <Socket> a back socket
+        env      : [optional] <str> a green environment (detected by default)
+        shadow   : [optional] <Socket>
+            A socket to copy a sample of the requests to with non-blocking
+            sends (copies are dropped while it is at its HWM), anything
+            received from it is discarded.
+        fraction : <float> a fraction of the requests to copy to the shadow
+    """
+    from zmq import NOBLOCK, Again
+
     env   = env or detect_green_env() or 'gevent'
     spawn = get_green_tools(env=env)[0]
 
     def _inp_to_out():
         while True:
-            out.send_multipart(inp.recv_multipart())
+            msg_list = inp.recv_multipart()
+            out.send_multipart(msg_list)
+            if shadow is not None and (fraction >= 1 or random() < fraction):
+                try:
+                    shadow.send_multipart(msg_list, NOBLOCK)
+                except Again:
+                    pass
 
     def _out_to_inp():
         while True:
             inp.send_multipart(out.recv_multipart())
 
-    i2o = spawn(_inp_to_out)
-    o2i = spawn(_out_to_inp)
-
-    i2o.join()
-    o2i.join()
+    def _drain_shadow():
+        while not stopped:
+            if shadow.poll(100):
+                shadow.recv_multipart()
+
+    stopped = []
+    i2o   = spawn(_inp_to_out)
+    o2i   = spawn(_out_to_inp)
+    drain = spawn(_drain_shadow) if shadow is not None else None
+
+    try:
+        i2o.join()
+        o2i.join()
+    finally:
+        if drain is not None:
+            stopped.append(True)
+            drain.join()
 #}
 
 class RemoteMethodBase(object):  #{
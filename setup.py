@@ -8,6 +8,9 @@ setup(
     packages = find_packages(),
 
     install_requires = ['pyzmq', 'pebble'],
+    extras_require   = {
+        'affinity' : ['psutil'],  # CPU pinning of prefork workers off Linux
+    },
 
     author = "Alexander Glyzov",
     author_email = "bonoba@gmail.com",
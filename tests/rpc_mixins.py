@@ -1,6 +1,11 @@
 # vim: fileencoding=utf-8 et ts=4 sts=4 sw=4 tw=0 fdm=marker fmr=#{,#}
 
-from netcall import RemoteRPCError
+from time     import time, sleep
+from binascii import hexlify
+
+from netcall         import RemoteRPCError, LRU
+from netcall.utils   import get_green_tools
+from netcall.tracing import Tracer, current_trace, trace
 
 
 class RPCCallsMixIn(object):  #{
@@ -26,7 +31,9 @@ class RPCCallsMixIn(object):  #{
         restricted_fields = [
             'register','register_object','proc','task',
             'start','stop','serve','shutdown',
-            'reset','connect','bind','bind_ports'
+            'reset','connect','bind','bind_ports',
+            'occupancy','workload','drain','stats','slow_requests',
+            'add_middleware','remove_middleware'
         ]
         for f in restricted_fields:
             self.assertNotImplementedRemotely(f)
@@ -164,6 +171,323 @@ class RPCCallsMixIn(object):  #{
 
         self.assertIsInstance(self.client.randint(0, 10), int)
         self.assertIsInstance(self.client.random(), float)
+
+    def test_function_cached(self):
+        calls = []
+        cache = LRU(maxsize=2)
+
+        @self.service.register(cache=cache)
+        def square(x):
+            calls.append(x)
+            return x * x
+
+        self.service.start()
+
+        self.assertEqual(self.client.square(3), 9)
+        self.assertEqual(self.client.square(3), 9)
+        self.assertEqual(self.client.square(x=3), 9)
+        self.assertEqual(calls, [3, 3])
+        self.assertEqual(cache.hits, 1)
+
+        # the least recently used entry is evicted
+        self.assertEqual(self.client.square(4), 16)
+        self.assertEqual(self.client.square(3), 9)
+        self.assertEqual(calls, [3, 3, 4, 3])
+
+    def test_function_cached_errors(self):
+        calls = []
+
+        @self.service.register(cache=LRU())
+        def fail(x):
+            calls.append(x)
+            raise ValueError(x)
+
+        self.service.start()
+
+        for _ in range(2):
+            with self.assertRaisesRegexp(RemoteRPCError, 'ValueError'):
+                self.client.fail(1)
+        self.assertEqual(calls, [1, 1])
+
+    def test_object_cached(self):
+        toy = ToyObject(12)
+        self.service.register_object(toy, namespace='toy', cache=LRU())
+        self.service.start()
+
+        self.assertEqual(self.client.toy.value(), 12)
+        toy._value = 13
+        self.assertEqual(self.client.toy.value(), 12)
+
+    def test_function_inline(self):
+        @self.service.register(inline=True)
+        def add(a, b):
+            return a + b
+
+        self.service.start()
+
+        self.assertEqual(self.client.add(1, 2), 3)
+        with self.assertRaisesRegexp(RemoteRPCError, 'TypeError'):
+            self.client.add(1)
+
+    def test_stats(self):
+        @self.service.register
+        def square(x):
+            return x * x
+
+        @self.service.register
+        def fail():
+            raise ValueError()
+
+        self.service.start()
+
+        self.assertEqual(self.client.square(3), 9)
+        self.assertEqual(self.client.square(4), 16)
+        with self.assertRaises(RemoteRPCError):
+            self.client.fail()
+
+        # requests are accounted right after their replies are sent
+        deadline = time() + 1
+        while sum(s['calls'] for s in self.service.stats().values()) < 3 and time() < deadline:
+            sleep(0.01)
+
+        stats  = self.client.call('_netcall.stats')
+        square = stats['square']
+        self.assertEqual(square['calls'], 2)
+        self.assertEqual(square['errors'], 0)
+        self.assertGreater(square['bytes_in'], 0)
+        self.assertGreater(square['bytes_out'], 0)
+        for timing in ['latency', 'queue', 'deserialize', 'execute', 'serialize']:
+            self.assertEqual(square[timing]['count'], 2)
+            self.assertLessEqual(square[timing]['max'], square['latency']['max'])
+
+        fail = stats['fail']
+        self.assertEqual((fail['calls'], fail['errors']), (1, 1))
+        self.assertEqual(fail['execute']['count'], 1)
+        self.assertEqual(fail['serialize']['count'], 0)
+
+        self.service.stats(reset=True)
+        self.assertEqual(self.service.stats()['square']['calls'], 0)
+
+    def test_client_metrics(self):
+        @self.service.register
+        def fail():
+            raise ValueError()
+
+        self.service.register(lambda: None, name='noop')
+        self.service.start()
+
+        self.client.noop()
+        self.client.noop()
+        with self.assertRaises(RemoteRPCError):
+            self.client.fail()
+
+        metrics = self.client.metrics.snapshot(reset=True)
+        self.assertEqual((metrics['in_flight'], metrics['orphaned']), (0, 0))
+
+        noop = metrics['procedures']['noop']
+        self.assertEqual((noop['calls'], noop['errors']), (2, 0))
+        for timing in ['latency', 'ack', 'result']:
+            self.assertEqual(noop[timing]['count'], 2)
+        self.assertEqual(metrics['procedures']['fail']['errors'], 1)
+
+        self.assertEqual(metrics['services'].keys(), [self.service.service_id])
+        self.assertEqual(metrics['services'][self.service.service_id]['calls'], 3)
+
+        self.assertEqual(self.client.metrics.snapshot()['procedures'], {})
+
+    def test_profile(self):
+        @self.service.register
+        def work(n):
+            return sum(range(n))
+
+        self.service.start()
+
+        self.assertTrue(self.client.call('_netcall.profile.start', kwargs=dict(name='work', calls=2)))
+        self.assertIsNone(self.client.call('_netcall.profile.result'))
+        for _ in range(3):
+            self.assertEqual(self.client.work(10), 45)
+
+        report = self.client.call('_netcall.profile.result')
+        self.assertIn('2 calls of work', report)
+        self.assertIn('(work)', report)
+
+        with self.assertRaisesRegexp(RemoteRPCError, 'ValueError'):
+            self.client.call('_netcall.profile.start', kwargs=dict(mode='unknown', calls=1))
+
+    def test_slow_requests(self):
+        self.service.slow_threshold = 0.05
+        self.service.register(lambda t: sleep(t) or t, name='sleep')
+        self.service.start()
+
+        self.assertEqual(self.client.sleep(0), 0)
+        self.assertEqual(self.client.sleep(0.1), 0.1)
+        self.assertEqual(self.client.sleep(0), 0)
+
+        # requests are accounted right after their replies are sent
+        deadline = time() + 1
+        while not self.service.slow_requests() and time() < deadline:
+            sleep(0.01)
+
+        slow = self.client.call('_netcall.slow_requests', (5,))
+        self.assertEqual(len(slow), 1)
+        entry = slow[0]
+        self.assertEqual(entry['procedure'], 'sleep')
+        self.assertEqual(entry['route'], [hexlify(self.client.identity)])
+        self.assertFalse(entry['failed'])
+        self.assertGreater(entry['bytes_in'], 0)
+        self.assertGreaterEqual(entry['execute'], 0.09)
+        self.assertGreaterEqual(entry['total'], entry['execute'])
+        for phase in ['parse', 'queue', 'deserialize', 'serialize', 'handoff']:
+            self.assertLess(entry[phase], 0.05)
+
+    def test_middleware(self):
+        events = []
+
+        class Auth(object):
+            def before_dispatch(self, request):
+                if request['name'] == 'secret':
+                    raise ValueError('access denied')
+                events.append(('before', request['name']))
+
+        class Trace(object):
+            def after_dispatch(self, request, result):
+                events.append(('after', request['name'], result))
+            def on_error(self, request, error):
+                events.append(('error', request['name'], type(error).__name__))
+
+        class Token(object):
+            def before_send(self, call):
+                call['kwargs'] = dict(call['kwargs'], token='xyz')
+            def on_reply(self, reply):
+                events.append(('reply', reply['type']))
+
+        @self.service.register
+        def echo(token=None):
+            return token
+
+        @self.service.register
+        def fail(token=None):
+            raise KeyError()
+
+        self.service.register(lambda token=None: None, name='secret')
+        self.service.add_middleware(Auth())
+        self.service.add_middleware(Trace())
+        self.client.add_middleware(Token())
+        with self.assertRaises(TypeError):
+            self.service.add_middleware(object())
+        self.service.start()
+
+        self.assertEqual(self.client.echo(), 'xyz')
+        with self.assertRaisesRegexp(RemoteRPCError, 'KeyError'):
+            self.client.fail()
+        with self.assertRaisesRegexp(RemoteRPCError, 'access denied'):
+            self.client.secret()
+
+        # hooks are called right after the replies are sent
+        deadline = time() + 1
+        while len(events) < 11 and time() < deadline:
+            sleep(0.01)
+
+        self.assertEqual(sorted(events), sorted([
+            ('before', 'echo'), ('after', 'echo', 'xyz'),
+            ('before', 'fail'), ('error', 'fail', 'KeyError'),
+            ('error', 'secret', 'ValueError'),
+            ('reply', b'ACK'), ('reply', b'ACK'), ('reply', b'ACK'),
+            ('reply', b'OK'), ('reply', b'FAIL'), ('reply', b'FAIL'),
+        ]))
+
+        del events[:]
+        for middleware in list(self.service.middleware):
+            self.service.remove_middleware(middleware)
+        self.assertEqual(self.client.call('secret'), None)
+        self.assertEqual([event for event in events if event[0] != 'reply'], [])
+
+    def test_tracing(self):
+        @self.service.register
+        def caller():
+            context = current_trace()
+            return context and (context.trace_id, context.parent_id)
+
+        tracer = Tracer(name='traced')
+        self.service.add_middleware(tracer)
+        self.service.start()
+
+        self.assertIsNone(self.client.caller())
+        with trace() as root:
+            self.assertEqual(self.client.caller(), (root.trace_id, root.span_id))
+        with trace(sampled=False):
+            self.client.caller()
+
+        # spans are emitted right after the replies are sent
+        deadline = time() + 1
+        while not tracer.get() and time() < deadline:
+            sleep(0.01)
+
+        spans = tracer.get()
+        self.assertEqual(len(spans), 1)
+        span = spans[0]
+        self.assertEqual((span['trace_id'], span['parent_id']), (root.trace_id, root.span_id))
+        self.assertEqual((span['service'], span['procedure']), ('traced', 'caller'))
+        self.assertFalse(span['failed'])
+        self.assertGreaterEqual(span['duration'], span['phases']['execute'])
+
+    def test_register_unknown_option(self):
+        with self.assertRaises(TypeError):
+            self.service.register(lambda: None, name='dummy', unknown=True)
+#}
+
+class GreenRPCCallsMixIn(object):  #{
+
+    def test_function_threadpool(self):
+        spawn, _, Event, _ = get_green_tools(env=self.service.green_env)
+
+        @self.service.register(threadpool=True)
+        def blocking(x):
+            sleep(0.5)  # not a green sleep
+            return x
+
+        self.service.register(lambda: 'cheap', name='cheap')
+        self.service.start()
+
+        results = []
+        start   = time()
+        caller  = spawn(lambda: results.append(self.client.blocking(1)))
+        Event().wait(0.1)
+
+        # the hub is not blocked by the procedure
+        self.assertEqual(self.client.cheap(), 'cheap')
+        self.assertLess(time() - start, 0.4)
+
+        caller.join()
+        self.assertEqual(results, [1])
+
+    def test_drain(self):
+        spawn, _, Event, _ = get_green_tools(env=self.service.green_env)
+        release = Event()
+
+        @self.service.register
+        def slow():
+            release.wait(5)
+            return 'done'
+
+        self.service.start()
+
+        results = []
+        callers = []
+        for func in [lambda: self.client.call('slow', timeout=5),
+                     lambda: self.service.drain(5)]:
+            callers.append(spawn(lambda func=func: results.append(func())))
+            Event().wait(0.1)
+
+        # new requests are rejected while draining
+        with self.assertRaisesRegexp(RemoteRPCError, 'RPCBusyError'):
+            self.client.call('slow', timeout=5)
+
+        release.set()
+        for caller in callers:
+            caller.join()
+
+        self.assertEqual(sorted(results), [True, 'done'])
 #}
 
 class ToyObject(object):  #{
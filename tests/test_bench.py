@@ -0,0 +1,53 @@
+# vim: fileencoding=utf-8 et ts=4 sts=4 sw=4 tw=0 fdm=marker fmr=#{,#}
+
+from unittest import TestCase
+
+from netcall.bench       import run, sweep
+from netcall.bench.micro import BENCHMARKS, run_micro, compare
+from netcall.serializer  import msgpack
+
+
+class BenchTest(TestCase):
+
+    def test_run(self):
+        result = run('threading', 'inproc', payload=100, concurrency=4, requests=40, warmup=4)
+        self.assertEqual((result['requests'], result['errors']), (40, 0))
+        self.assertEqual(result['latency']['count'], 40)
+        self.assertGreater(result['throughput'], 0)
+        self.assertLessEqual(result['latency']['p50'], result['latency']['p999'])
+
+    def test_sweep(self):
+        results = list(sweep(['sync'], ['ipc', 'tcp'], payloads=[16], serializers=['json', 'msgpack'],
+                             concurrency=[1, 2], requests=10, warmup=2))
+        combinations = 4 if msgpack is None else 8
+        self.assertEqual(len(results), combinations)
+        for result in results:
+            self.assertEqual(result['errors'], 0)
+
+    def test_unknown(self):
+        with self.assertRaises(ValueError):
+            run('unknown')
+        with self.assertRaises(ValueError):
+            run('sync', transport='udp')
+
+
+class MicroTest(TestCase):
+
+    def test_run_micro(self):
+        results = run_micro(['parse_', 'future'], repeat=1, min_time=0.001)
+        self.assertEqual(list(results), ['service.parse_request', 'client.parse_reply', 'future.set_wait'])
+        for ns in results.values():
+            self.assertGreater(ns, 0)
+
+    def test_all_benchmarks(self):
+        results = run_micro(repeat=1, min_time=0)
+        self.assertEqual(list(results), list(BENCHMARKS))
+
+    def test_compare(self):
+        baseline = {'a': 100.0, 'b': 100.0, 'c': 100.0, 'gone': 1.0}
+        current  = {'a': 105.0, 'b': 150.0, 'c': 50.0, 'fresh': 1.0}
+        report   = dict((item['name'], item) for item in compare(baseline, current, tolerance=0.1))
+        self.assertEqual(dict((name, item['status']) for name, item in report.items()), {
+            'a': 'ok', 'b': 'regression', 'c': 'improvement', 'fresh': 'new', 'gone': 'missing',
+        })
+        self.assertAlmostEqual(report['b']['change'], 0.5)
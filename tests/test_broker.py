@@ -0,0 +1,177 @@
+# vim: fileencoding=utf-8 et ts=4 sts=4 sw=4 tw=0 fdm=marker fmr=#{,#}
+
+from time      import time, sleep
+from threading import Thread
+
+import zmq
+
+from netcall           import RemoteRPCError
+from netcall.utils     import get_zmq_classes
+from netcall.broker    import Broker, BrokerWorker
+from netcall.threading import ThreadPool, ThreadingRPCService
+from netcall.sync      import SyncRPCClient
+
+from .base import BaseCase
+
+
+class BrokerTest(BaseCase):
+
+    def setUp(self):
+        super(BrokerTest, self).setUp()
+
+        Context, _ = get_zmq_classes()
+
+        self.context  = Context()
+        self.pool     = ThreadPool(16)
+        self.frontend = self.urls[0]
+        self.backend  = self.urls[1]
+
+        self.broker = Broker(context=self.context, heartbeat=0.1)
+        self.broker.bind_frontend(self.frontend)
+        self.broker.bind_backend(self.backend)
+        self.broker.start()
+
+        self.services = []
+        self.workers  = []
+        self.clients  = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.shutdown()
+        for worker in self.workers:
+            worker.stop()
+        for service in self.services:
+            service.shutdown()
+        self.broker.stop()
+        self.context.term()
+        self.pool.close()
+        self.pool.stop()
+        self.pool.join()
+
+        super(BrokerTest, self).tearDown()
+
+    def add_worker(self, name, capacity=1, **kwargs):
+        service = ThreadingRPCService(context=self.context, pool=self.pool)
+        service.register(lambda: name, name='who')
+        service.register(lambda t: sleep(t) or name, name='sleep')
+
+        worker = BrokerWorker(service, self.backend, capacity=capacity, heartbeat=0.1, **kwargs)
+        worker.start()
+        service.start()
+
+        self.services.append(service)
+        self.workers.append(worker)
+
+        return service
+
+    def add_client(self):
+        client = SyncRPCClient(context=self.context)
+        client.connect(self.frontend)
+        self.clients.append(client)
+        return client
+
+    def test_routing(self):
+        self.add_worker('a')
+        self.add_worker('b')
+        client = self.add_client()
+
+        self.assertEqual(set(client.who() for _ in range(10)), set(['a', 'b']))
+
+    def test_busy_worker_is_skipped(self):
+        self.add_worker('a')
+        self.add_worker('b')
+        slow = self.add_client()
+        fast = self.add_client()
+
+        results = []
+        thread  = Thread(target=lambda: results.append(slow.sleep(0.5)))
+        thread.start()
+        sleep(0.1)
+
+        start_t = time()
+        served  = set(fast.call('who', timeout=1) for _ in range(5))
+        self.assertLess(time() - start_t, 0.4)
+        self.assertEqual(len(served), 1)
+
+        thread.join()
+        self.assertNotIn(results[0], served)
+
+    def test_dead_worker(self):
+        socket = self.context.socket(zmq.DEALER)
+        socket.connect(self.backend)
+        socket.send_multipart([b'', b'READY', b'1'])  # never replies
+        sleep(0.1)
+
+        client = self.add_client()
+        try:
+            with self.assertRaisesRegexp(RemoteRPCError, 'dead'):
+                client.call('who', timeout=2)
+        finally:
+            socket.close(0)
+
+    def test_routing_by_name(self):
+        echo = self.add_worker('echo')
+        echo.register(lambda s: s, name='echo')
+        math = self.add_worker('math', namespaces=['math'])
+        math.register(lambda a, b: a+b, name='math.add')
+        client = self.add_client()
+        sleep(0.3)  # announced with a heartbeat
+
+        self.assertEqual(client.echo('hello'), 'hello')
+        self.assertEqual(client.math.add(1, 2), 3)
+
+        # the whole namespace is served without announcing new names
+        math.register(lambda a, b: a*b, name='math.mul')
+        self.assertEqual(client.math.mul(2, 3), 6)
+        with self.assertRaisesRegexp(RemoteRPCError, 'NotImplementedError'):
+            client.call('math_add', timeout=2)
+
+    def test_default_capacity(self):
+        service = ThreadingRPCService(context=self.context, pool=self.pool)
+        self.services.append(service)
+        worker  = BrokerWorker(service, self.backend)
+        self.workers.append(worker)
+
+        self.assertEqual(worker.capacity, 14)  # the io and res threads take two
+
+    def test_reserved_not_announced(self):
+        self.add_worker('a')
+        client = self.add_client()
+        self.assertEqual(client.who(), 'a')
+
+        self.assertEqual(sorted(self.broker.pools), ['sleep', 'who'])
+        with self.assertRaisesRegexp(RemoteRPCError, 'NotImplementedError'):
+            client.call('_netcall.stats', timeout=2)
+
+    def test_dynamic_registration(self):
+        service = self.add_worker('a')
+        client  = self.add_client()
+
+        with self.assertRaisesRegexp(RemoteRPCError, 'NotImplementedError'):
+            client.call('late', timeout=2)
+
+        service.register(lambda: 'here', name='late')
+        sleep(0.3)  # announced with a heartbeat
+
+        self.assertEqual(client.call('late', timeout=2), 'here')
+
+    def test_worker_drain(self):
+        service = self.add_worker('a')
+        service.register(lambda: sleep(0.5) or 'a', name='slow')
+        self.add_worker('b')
+        sleep(0.3)  # let the new procedure be announced
+
+        results = []
+        def call_slow():
+            results.append(self.add_client().slow())
+
+        caller = Thread(target=call_slow)
+        caller.start()
+        sleep(0.1)
+
+        self.assertTrue(self.workers[0].drain(5))
+        caller.join(5)
+        self.assertEqual(results, ['a'])
+
+        client = self.add_client()
+        self.assertEqual(set(client.who() for _ in range(5)), set(['b']))
@@ -0,0 +1,134 @@
+# vim: fileencoding=utf-8 et ts=4 sts=4 sw=4 tw=0 fdm=marker fmr=#{,#}
+
+from time      import time, sleep
+from cStringIO import StringIO
+
+from netcall.utils        import get_zmq_classes
+from netcall.sync         import SyncRPCClient
+from netcall.threading    import ThreadPool, ThreadingRPCService
+from netcall.capture      import Capture, read_capture, MAGIC
+from netcall.messages     import Request
+from netcall.bench.replay import replay, summary
+
+from .base import BaseCase
+
+
+class CaptureTest(BaseCase):
+
+    def setUp(self):
+        Context, _ = get_zmq_classes()
+
+        self.context = Context()
+        self.pool    = ThreadPool(8)
+        self.client  = SyncRPCClient(context=self.context)
+        self.service = ThreadingRPCService(context=self.context, pool=self.pool)
+        self.service.register(lambda x: x, name='echo')
+        self.service.register(lambda: 1/0, name='fail')
+        self.service.bind(self.urls[0])
+        self.client.connect(self.urls[0])
+        self.service.start()
+        self.path = '%s/traffic.ncap' % self.tmp_dir
+
+        super(CaptureTest, self).setUp()
+
+    def tearDown(self):
+        self.client.shutdown()
+        self.service.shutdown()
+        self.context.term()
+        self.pool.close()
+        self.pool.stop()
+        self.pool.join()
+
+        super(CaptureTest, self).tearDown()
+
+    def test_capture(self):
+        capture = Capture(self.path, limit=5)
+        self.service.add_middleware(capture)
+
+        started = time()
+        for i in range(4):
+            self.client.echo(i)
+            sleep(0.02)
+        self.client.call('_netcall.stats')  # not captured
+        self.client.call('echo', (4,), ignore=True)
+        self.client.echo(5)                 # over the limit
+
+        self.service.remove_middleware(capture)
+        capture.close()
+        self.assertEqual(capture.count, 5)
+
+        records = list(read_capture(self.path))
+        self.assertEqual(len(records), 5)
+        for timestamp, frames in records:
+            self.assertEqual(frames[1], 'echo')
+            self.assertGreaterEqual(timestamp, started)
+        self.assertEqual([frames[4] for _, frames in records], ['0']*4 + ['1'])
+        self.assertGreaterEqual(records[3][0] - records[0][0], 0.06)
+
+        info = summary(self.path)
+        self.assertEqual((info['requests'], info['procedures']), (5, {'echo': 5}))
+
+    def test_sample(self):
+        with self.assertRaises(ValueError):
+            Capture(StringIO(), sample=0)
+
+        output  = StringIO()
+        capture = Capture(output, sample=0.5)
+        for i in range(1000):
+            now = time()
+            capture.before_dispatch(Request([b'|', b'%x' % i], 'echo', None, [b'', b''],
+                                            {}, False, None, None, now, now))
+        self.assertTrue(300 < capture.count < 700, capture.count)
+
+        capture.flush()
+        output.seek(0)
+        self.assertEqual(len(list(read_capture(output))), capture.count)
+        capture.close()
+
+    def test_writer(self):
+        output  = StringIO()
+        capture = Capture(output, flush_interval=0.05)
+        capture.write([b'|', b'0', b'echo', b''])
+        self.assertEqual(output.getvalue(), MAGIC)  # queued, not written yet
+
+        sleep(0.2)
+        self.assertEqual(len(list(read_capture(StringIO(output.getvalue())))), 1)
+        capture.close()
+        self.assertTrue(capture.closed)
+        self.assertFalse(capture.write([b'|', b'1', b'echo', b'']))
+
+    def test_truncated(self):
+        output  = StringIO()
+        capture = Capture(output)
+        for i in range(3):
+            capture.write([b'|', b'%x' % i, b'echo', b'payload-%s' % i])
+        capture.flush()
+        data = output.getvalue()
+        capture.close()
+
+        # cut inside the last frame payload, its header and the record header
+        for cut in (2, 11, 13, 35):
+            records = list(read_capture(StringIO(data[:-cut])))
+            self.assertEqual([frames[3] for _, frames in records], ['payload-0', 'payload-1'])
+
+    def test_replay(self):
+        capture = Capture(self.path)
+        self.service.add_middleware(capture)
+        for i in range(10):
+            self.client.echo(i)
+            sleep(0.01)
+        try:
+            self.client.fail()
+        except Exception:
+            pass
+        self.service.remove_middleware(capture)
+        capture.close()
+
+        result = replay(self.path, self.urls[0], speed=4, context=self.context)
+        self.assertEqual((result['requests'], result['replied'], result['errors'], result['lost']), (11, 11, 1, 0))
+        self.assertEqual(result['procedures']['echo']['count'], 10)
+        self.assertEqual(result['latency']['count'], 11)
+
+        # the schedule is scaled by speed
+        self.assertLess(result['seconds'], summary(self.path)['seconds'])
+        self.assertLess(result['lag'], 0.05)
@@ -0,0 +1,179 @@
+# vim: fileencoding=utf-8 et ts=4 sts=4 sw=4 tw=0 fdm=marker fmr=#{,#}
+
+from time import time, sleep
+
+import zmq
+
+from netcall           import RPCTimeoutError
+from netcall.utils     import get_zmq_classes
+from netcall.devices   import ProxyDevice
+from netcall.threading import ThreadPool, ThreadingRPCService
+from netcall.sync      import SyncRPCClient
+
+from .base import BaseCase
+
+
+class ProxyDeviceTest(BaseCase):
+
+    def setUp(self):
+        super(ProxyDeviceTest, self).setUp()
+
+        Context, _ = get_zmq_classes()
+
+        self.context = Context()
+        self.pool    = ThreadPool(8)
+        self.device  = ProxyDevice(context=self.context)
+        self.client  = SyncRPCClient(context=self.context)
+        self.service = ThreadingRPCService(context=self.context, pool=self.pool)
+
+        self.device.bind_in(self.urls[0])
+        self.device.bind_out('inproc://backend')
+        self.device.start()
+
+        self.service.register(lambda s: s, name='echo')
+        self.service.connect('inproc://backend')
+        self.service.start()
+        self.client.connect(self.urls[0])
+
+    def tearDown(self):
+        self.client.shutdown()
+        self.service.shutdown()
+        self.device.terminate()
+        self.context.term()
+        self.pool.close()
+        self.pool.stop()
+        self.pool.join()
+
+        super(ProxyDeviceTest, self).tearDown()
+
+    def test_proxy(self):
+        self.assertTrue(self.device.is_alive())
+        self.assertEqual(self.client.echo('hello'), 'hello')
+
+    def test_pause_resume(self):
+        self.device.pause()
+        with self.assertRaises(RPCTimeoutError):
+            self.client.call('echo', ['lost'], timeout=0.2)
+        self.device.resume()
+        self.assertEqual(self.client.call('echo', ['hello'], timeout=2), 'hello')
+
+    def test_stats(self):
+        for i in range(3):
+            self.client.echo(i)
+        stats = self.device.stats()
+        self.assertEqual(stats['frontend']['msgs_in'], 3)
+        self.assertEqual(stats['backend']['msgs_in'], 6)  # ACK + OK
+
+    def test_stats_old_libzmq(self):
+        version_info = zmq.zmq_version_info
+        zmq.zmq_version_info = lambda: (4, 2, 5)
+        try:
+            with self.assertRaises(RuntimeError):
+                self.device.stats()
+        finally:
+            zmq.zmq_version_info = version_info
+
+    def test_terminate(self):
+        self.device.terminate()
+        self.assertFalse(self.device.is_alive())
+        with self.assertRaises(RuntimeError):
+            self.device.pause()
+
+
+class ShadowDeviceTest(BaseCase):
+
+    def setUp(self):
+        super(ShadowDeviceTest, self).setUp()
+
+        Context, _ = get_zmq_classes()
+
+        self.context = Context()
+        self.pool    = ThreadPool(8)
+        self.client  = SyncRPCClient(context=self.context)
+        self.service = ThreadingRPCService(context=self.context, pool=self.pool)
+        self.service.register(lambda s: s, name='echo')
+        self.service.connect('inproc://backend')
+        self.service.start()
+        self.device  = None
+
+    def tearDown(self):
+        self.client.shutdown()
+        self.service.shutdown()
+        if self.device is not None:
+            self.device.terminate()
+        self.context.term()
+        self.pool.close()
+        self.pool.stop()
+        self.pool.join()
+
+        super(ShadowDeviceTest, self).tearDown()
+
+    def _start(self, **kwargs):
+        self.device = ProxyDevice(context=self.context, **kwargs)
+        self.device.bind_in(self.urls[0])
+        self.device.bind_out('inproc://backend')
+        self.device.start()
+        self.client.connect(self.urls[0])
+
+    def _wait(self, check, timeout=2):
+        deadline = time() + timeout
+        while not check() and time() < deadline:
+            sleep(0.01)
+        return check()
+
+    def test_mirror(self):
+        shadowed = []
+        shadow   = ThreadingRPCService(context=self.context, pool=self.pool)
+        shadow.register(lambda s: shadowed.append(s) or 'shadow', name='echo')
+        shadow.bind(self.urls[1])
+        shadow.start()
+        try:
+            self._start(shadow=self.urls[1])
+            for i in range(5):
+                self.assertEqual(self.client.echo(i), i)
+            self.assertTrue(self._wait(lambda: len(shadowed) == 5))
+            self.assertEqual(sorted(shadowed), range(5))
+            self.assertTrue(self._wait(lambda: self.device.shadow_stats()['replies'] == 10))  # ACK + OK
+            self.assertEqual(self.device.shadow_stats()['mirrored'], 5)
+        finally:
+            shadow.shutdown()
+
+    def test_slow_shadow(self):
+        # nobody serves the shadow so copies are dropped beyond the HWM
+        self._start(shadow=self.urls[1], shadow_hwm=1)
+        for i in range(20):
+            self.assertEqual(self.client.call('echo', [i], timeout=2), i)
+        self.assertTrue(self._wait(lambda: sum(self.device.shadow_stats().values()) == 20))
+        stats = self.device.shadow_stats()
+        self.assertGreater(stats['dropped'], 0)
+        self.assertEqual(stats['replies'], 0)
+
+    def test_replies_not_mirrored(self):
+        # a backend replying with extra frames must not look like a request
+        self.device = ProxyDevice(context=self.context, shadow=self.urls[1])
+        self.device.bind_in(self.urls[0])
+        self.device.bind_out('inproc://raw-backend')
+        self.device.start()
+
+        front = self.context.socket(zmq.DEALER)
+        back  = self.context.socket(zmq.DEALER)
+        try:
+            front.connect(self.urls[0])
+            back.connect('inproc://raw-backend')
+
+            front.send_multipart([b'|', b'req-1', b'echo', b'args', b'kwargs', b'0'])
+            request = back.recv_multipart()
+            boundary = request.index(b'|')
+            back.send_multipart(request[:boundary+2] + [b'OK', b'a', b'b', b'c'])
+            self.assertEqual(front.recv_multipart()[1:], [b'req-1', b'OK', b'a', b'b', b'c'])
+
+            sleep(0.2)
+            stats = self.device.shadow_stats()
+            self.assertEqual(stats['mirrored'] + stats['dropped'], 1)
+        finally:
+            front.close(0)
+            back.close(0)
+
+    def test_fraction(self):
+        with self.assertRaises(ValueError):
+            ProxyDevice(context=self.context, shadow=self.urls[1], shadow_fraction=0)
@@ -5,7 +5,7 @@ from netcall.utils import get_zmq_classes
 
 from .base          import BaseCase
 from .client_mixins import ClientBindConnectMixIn
-from .rpc_mixins    import RPCCallsMixIn
+from .rpc_mixins    import RPCCallsMixIn, GreenRPCCallsMixIn
 
 
 class EventletBase(BaseCase):
@@ -33,7 +33,7 @@ try:
     class EventletClientBindConnectTest(ClientBindConnectMixIn, EventletBase):
         pass
 
-    class EventletRPCCallsTest(RPCCallsMixIn, EventletBase):
+    class EventletRPCCallsTest(RPCCallsMixIn, GreenRPCCallsMixIn, EventletBase):
         pass
 
 except ImportError:
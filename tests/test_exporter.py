@@ -0,0 +1,80 @@
+# vim: fileencoding=utf-8 et ts=4 sts=4 sw=4 tw=0 fdm=marker fmr=#{,#}
+
+from time    import sleep
+from urllib2 import urlopen
+
+from netcall           import get_zmq_classes
+from netcall.exporter  import MetricsExporter, CONTENT_TYPE
+from netcall.threading import ThreadPool, ThreadingRPCClient, ThreadingRPCService
+
+from .base import BaseCase
+
+
+class ExporterTest(BaseCase):
+
+    def setUp(self):
+        super(ExporterTest, self).setUp()
+
+        Context, _ = get_zmq_classes()
+
+        self.context = Context()
+        self.pool    = ThreadPool(24)
+        self.client  = ThreadingRPCClient(context=self.context, pool=self.pool)
+        self.service = ThreadingRPCService(context=self.context, pool=self.pool)
+        self.service.register(lambda x: x, name='echo', max_concurrency=2)
+
+        self.service.bind(self.urls[0])
+        self.client.connect(self.urls[0])
+        self.service.start()
+
+        self.exporter = MetricsExporter(services=[self.service], clients=[self.client])
+
+    def tearDown(self):
+        self.exporter.shutdown()
+        self.client.shutdown()
+        self.service.shutdown()
+        self.context.term()
+        self.pool.close()
+        self.pool.stop()
+        self.pool.join()
+
+        super(ExporterTest, self).tearDown()
+
+    def test_render(self):
+        for i in range(3):
+            self.assertEqual(self.client.echo(i), i)
+        sleep(0.1)  # requests are accounted after their replies
+
+        text    = self.exporter.render()
+        service = 'service="%s",procedure="echo"' % self.service.service_id
+        client  = 'client="%s",procedure="echo"' % self.client.identity
+
+        self.assertIn('# TYPE netcall_service_latency_seconds histogram', text)
+        self.assertIn('netcall_service_requests_total{%s} 3' % service, text)
+        self.assertIn('netcall_service_latency_seconds_bucket{%s,le="+Inf"} 3' % service, text)
+        self.assertIn('netcall_service_latency_seconds_count{%s} 3' % service, text)
+        self.assertIn('netcall_service_rejected_total{%s} 0' % service, text)
+        self.assertIn('netcall_service_pool_workers{service="%s"} 24' % self.service.service_id, text)
+        self.assertIn('netcall_client_calls_total{%s} 3' % client, text)
+        self.assertIn('netcall_client_service_calls_total{client="%s",service="%s"} 3' % (
+            self.client.identity, self.service.service_id
+        ), text)
+        self.assertIn('netcall_client_inflight_calls{client="%s"} 0' % self.client.identity, text)
+        self.assertIn('netcall_client_evicted_total{client="%s"} 0' % self.client.identity, text)
+
+        # every family is declared once
+        types = [line for line in text.splitlines() if line.startswith('# TYPE')]
+        self.assertEqual(len(types), len(set(types)))
+
+    def test_workload(self):
+        workload = self.service.workload()
+        self.assertEqual(workload['inflight'], 0)
+        self.assertEqual(workload['res_queue'], 0)
+        self.assertEqual(workload['pool']['workers'], 24)
+
+    def test_serve(self):
+        host, port = self.exporter.serve(0)
+
+        response = urlopen('http://%s:%s/metrics' % (host, port), timeout=5)
+        self.assertEqual(response.info()['Content-Type'], CONTENT_TYPE)
+        self.assertIn('netcall_service_inflight_requests', response.read())
@@ -1,11 +1,13 @@
 # vim: fileencoding=utf-8 et ts=4 sts=4 sw=4 tw=0 fdm=marker fmr=#{,#}
 
+from gc import get_objects
+
 from netcall.green import GreenRPCClient, GreenRPCService
-from netcall.utils import get_zmq_classes
+from netcall.utils import get_zmq_classes, green_device
 
 from .base          import BaseCase
 from .client_mixins import ClientBindConnectMixIn
-from .rpc_mixins    import RPCCallsMixIn
+from .rpc_mixins    import RPCCallsMixIn, GreenRPCCallsMixIn
 
 
 class GeventBase(BaseCase):
@@ -29,12 +31,47 @@ class GeventBase(BaseCase):
 
 try:
     import gevent
+    import zmq.green as zmq
 
     class GeventClientBindConnectTest(ClientBindConnectMixIn, GeventBase):
         pass
 
-    class GeventRPCCallsTest(RPCCallsMixIn, GeventBase):
+    class GeventRPCCallsTest(RPCCallsMixIn, GreenRPCCallsMixIn, GeventBase):
         pass
 
+    class GeventDeviceTest(GeventBase):
+
+        def test_green_device_shadow(self):
+            inp    = self.context.socket(zmq.ROUTER)
+            out    = self.context.socket(zmq.DEALER)
+            shadow = self.context.socket(zmq.DEALER)
+            mirror = self.context.socket(zmq.ROUTER)
+            inp.bind(self.urls[0])
+            out.bind('inproc://green-device-back')
+            shadow.bind('inproc://green-device-shadow')
+            mirror.connect('inproc://green-device-shadow')
+
+            self.service.register(lambda s: s, name='echo')
+            self.service.connect('inproc://green-device-back')
+            self.service.start()
+            self.client.connect(self.urls[0])
+
+            device = gevent.spawn(green_device, inp, out, env='gevent', shadow=shadow)
+            self.assertEqual(self.client.echo('hello'), 'hello')
+            self.assertTrue(mirror.poll(1000))  # a copy of the request
+
+            inp.close(0)
+            out.close(0)
+            device.join(5)
+            self.assertTrue(device.ready())
+
+            # the greenlet discarding shadow replies is stopped with the device
+            drains = [g for g in get_objects() if isinstance(g, gevent.Greenlet)
+                      and getattr(g._run, '__name__', None) == '_drain_shadow' and not g.dead]
+            self.assertEqual(drains, [])
+
+            shadow.close(0)
+            mirror.close(0)
+
 except ImportError:
     pass
@@ -0,0 +1,61 @@
+# vim: fileencoding=utf-8 et ts=4 sts=4 sw=4 tw=0 fdm=marker fmr=#{,#}
+
+from unittest import TestCase
+
+from netcall.messages  import Request, Reply
+from netcall.utils     import get_zmq_classes
+from netcall.threading import ThreadPool, ThreadingRPCService
+
+
+class MessagesTest(TestCase):
+
+    def setUp(self):
+        Context, _ = get_zmq_classes()
+
+        self.context = Context()
+        self.pool    = ThreadPool(1)
+        self.service = ThreadingRPCService(context=self.context, pool=self.pool)
+        self.service.register(lambda s: s, name='echo')
+
+    def tearDown(self):
+        self.service.shutdown()
+        self.context.term()
+        self.pool.close()
+        self.pool.join()
+
+    def test_request(self):
+        msg_list = [b'a', b'b', b'|', b'1', b'echo', b'args', b'kwargs', b'0']
+        request  = self.service._parse_request(msg_list)
+
+        self.assertIsInstance(request, Request)
+        self.assertFalse(hasattr(request, '__dict__'))
+        self.assertEqual(request.header, [b'a', b'b', b'|', b'1'])
+        self.assertEqual(request.route, [b'a', b'b'])
+        self.assertEqual(request.req_id, b'1')
+        self.assertEqual(request.name, b'echo')
+        self.assertEqual(request.data, [b'args', b'kwargs'])
+        self.assertIs(request.ignore, False)
+        self.assertIsNone(request.error)
+
+        # the header is shared by replies and left intact
+        ack   = self.service._build_reply(request, b'ACK', [b'srv'])
+        reply = self.service._build_reply(request, b'OK', [b'res'])
+        self.assertEqual(ack,   [b'a', b'b', b'|', b'1', b'ACK', b'srv'])
+        self.assertEqual(reply, [b'a', b'b', b'|', b'1', b'OK', b'res'])
+        self.assertEqual(request.header, [b'a', b'b', b'|', b'1'])
+
+    def test_mapping(self):
+        request = self.service._parse_request([b'a', b'|', b'1', b'echo', b'x', b'y', b'1'])
+        self.assertEqual(request['name'], b'echo')
+        self.assertEqual(request['route'], [b'a'])
+        self.assertEqual(request.get('missing', 42), 42)
+
+        request['failed'] = True
+        self.assertIs(request.failed, True)
+        with self.assertRaises(KeyError):
+            request['missing']
+        with self.assertRaises(KeyError):
+            request['missing'] = 1
+
+        reply = Reply(b'OK', b'1', None, 'result')
+        self.assertEqual(reply.as_dict(), dict(type=b'OK', req_id=b'1', srv_id=None, result='result'))
@@ -0,0 +1,80 @@
+# vim: fileencoding=utf-8 et ts=4 sts=4 sw=4 tw=0 fdm=marker fmr=#{,#}
+
+from unittest import TestCase
+
+from netcall.messages import Reply
+from netcall.metrics  import Histogram, ProcStats, ClientMetrics
+
+
+class HistogramTest(TestCase):
+
+    def test_empty(self):
+        hist = Histogram()
+        self.assertIsNone(hist.percentile(50))
+        self.assertEqual(hist.snapshot()['count'], 0)
+
+    def test_percentiles(self):
+        hist = Histogram()
+        for i in range(1, 1001):
+            hist.record(i / 1000.0)  # 1ms .. 1s
+
+        self.assertEqual(hist.count, 1000)
+        self.assertEqual((hist.min, hist.max), (0.001, 1.0))
+        for q in [50, 90, 99]:
+            self.assertAlmostEqual(hist.percentile(q), q / 100.0, delta=q / 100.0 / 16)
+        self.assertEqual(hist.percentile(100), 1.0)
+
+    def test_out_of_range(self):
+        hist = Histogram(max_exp=10)
+        hist.record(-1)
+        hist.record(10)
+        self.assertEqual(hist.min, 0)
+        self.assertEqual(hist.percentile(100), 10)
+
+    def test_merge(self):
+        one, two = Histogram(), Histogram()
+        one.record(0.001)
+        two.record(0.002)
+        two.record(0.003)
+        one.merge(two)
+        self.assertEqual(one.count, 3)
+        self.assertEqual(one.max, 0.003)
+
+        with self.assertRaises(ValueError):
+            one.merge(Histogram(precision=2))
+
+
+class ProcStatsTest(TestCase):
+
+    def test_record(self):
+        stats = ProcStats()
+        stats.record(False, 10, 20, 0.002, queue=0.001)
+        stats.record(True, 10, 30, 0.004)
+
+        snapshot = stats.snapshot()
+        self.assertEqual(snapshot['calls'], 2)
+        self.assertEqual(snapshot['errors'], 1)
+        self.assertEqual((snapshot['bytes_in'], snapshot['bytes_out']), (20, 50))
+        self.assertEqual(snapshot['latency']['count'], 2)
+        self.assertEqual(snapshot['queue']['count'], 1)
+        self.assertEqual(snapshot['execute']['count'], 0)
+
+        stats.reset()
+        self.assertEqual(stats.snapshot()['calls'], 0)
+
+
+class ClientMetricsTest(TestCase):
+
+    def test_evict(self):
+        metrics = ClientMetrics(max_pending=10)
+        for i in range(11):
+            metrics.sent(b'%x' % i, 'never')
+        self.assertEqual(metrics.in_flight, 9)
+        self.assertEqual(metrics.evicted, 2)
+
+        for i in range(11):
+            metrics.received(Reply(b'OK', b'%x' % i, None, None))
+        snapshot = metrics.snapshot()
+        self.assertEqual((snapshot['in_flight'], snapshot['orphaned'], snapshot['evicted']), (0, 2, 2))
+        self.assertEqual(snapshot['procedures']['never']['timeouts'], 2)
+        self.assertEqual(snapshot['procedures']['never']['calls'], 9)
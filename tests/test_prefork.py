@@ -0,0 +1,140 @@
+# vim: fileencoding=utf-8 et ts=4 sts=4 sw=4 tw=0 fdm=marker fmr=#{,#}
+
+from os              import getpid, kill
+from sys             import platform
+from time            import sleep
+from signal          import SIGKILL
+from threading       import Thread
+from unittest        import skipUnless
+from multiprocessing import cpu_count
+
+from netcall.prefork   import PreforkServer, set_cpu_affinity
+from netcall.threading import ThreadingRPCService
+from netcall.sync      import SyncRPCClient
+
+from .base import BaseCase
+
+
+def make_service():
+    service = ThreadingRPCService()
+    service.register(getpid, name='pid')
+    return service
+
+
+class PreforkTest(BaseCase):
+
+    def setUp(self):
+        super(PreforkTest, self).setUp()
+
+        self.url    = self.urls[0]
+        self.server = PreforkServer(make_service, self.url, workers=2, warmup=0.2, min_uptime=0,
+                                    heartbeat=0.1)
+        self.server.start()
+        self.client = SyncRPCClient()
+        self.client.connect(self.url)
+
+    def tearDown(self):
+        self.client.shutdown()
+        self.server.shutdown()
+
+        super(PreforkTest, self).tearDown()
+
+    def worker_pids(self):
+        return set(w.pid for w in self.server.workers.values())
+
+    def served_pids(self, n=20):
+        return set(self.client.call('pid', timeout=5) for _ in range(n))
+
+    def test_load_balancing(self):
+        self.assertEqual(self.served_pids(), self.worker_pids())
+
+    @skipUnless(platform.startswith('linux'), 'reads /proc')
+    def test_cpu_affinity(self):
+        for slot, worker in self.server.workers.items():
+            with open('/proc/%s/status' % worker.pid) as status:
+                allowed = [line.split()[1] for line in status if line.startswith('Cpus_allowed_list')]
+            self.assertEqual(allowed, [str(slot % cpu_count())])
+
+        with self.assertRaises(OSError):
+            set_cpu_affinity(1023)  # out of the cpuset
+
+    def test_respawn(self):
+        dead = sorted(self.worker_pids())[0]
+        kill(dead, SIGKILL)
+        sleep(0.5)  # the broker forgets it after 3 heartbeats
+        self.server._reap()
+
+        pids = self.worker_pids()
+        self.assertEqual(len(pids), 2)
+        self.assertNotIn(dead, pids)
+        self.assertEqual(self.served_pids(), pids)
+
+    def test_rolling_restart(self):
+        old = self.worker_pids()
+        self.server.restart()
+        new = self.worker_pids()
+
+        self.assertEqual(len(new), 2)
+        self.assertFalse(old & new)
+        self.assertEqual(self.served_pids(), new)
+
+    def test_calls_during_restart(self):
+        results = dict(ok=0, failed=[])
+        running = [True]
+
+        def caller():
+            client = SyncRPCClient()
+            client.connect(self.url)
+            try:
+                while running[0]:
+                    try:
+                        client.call('pid', timeout=5)
+                    except Exception, e:
+                        results['failed'].append(e)
+                    else:
+                        results['ok'] += 1
+            finally:
+                client.shutdown()
+
+        callers = [Thread(target=caller) for _ in range(4)]
+        for thread in callers:
+            thread.start()
+        try:
+            sleep(0.1)
+            self.server.restart()
+            sleep(0.1)
+        finally:
+            running[0] = False
+            for thread in callers:
+                thread.join(10)
+
+        self.assertEqual(results['failed'], [])
+        self.assertGreater(results['ok'], 0)
+
+    def test_rolling_restart_steps(self):
+        old = self.worker_pids()
+        self.server.restart(block=False)
+        self.assertEqual(self.worker_pids(), old)  # advanced by the supervisor loop
+        self.assertTrue(self.server._roll())
+
+        # a crashed worker is respawned while the restart is in progress
+        crashed = self.server.workers[1].pid
+        kill(crashed, SIGKILL)
+        sleep(0.2)
+        self.server._reap()
+        self.assertNotIn(crashed, self.worker_pids())
+
+        while self.server._roll() or self.server._stopping:
+            self.server._collect()
+            sleep(0.05)
+
+        new = self.worker_pids()
+        self.assertEqual(len(new), 2)
+        self.assertFalse(old & new)
+        self.assertEqual(self.served_pids(), new)
+
+    def test_shutdown(self):
+        broker = self.server.broker
+        self.server.shutdown()
+        self.assertIsNone(self.server.broker)
+        self.assertFalse(broker.is_alive())
@@ -0,0 +1,32 @@
+# vim: fileencoding=utf-8 et ts=4 sts=4 sw=4 tw=0 fdm=marker fmr=#{,#}
+
+from unittest import TestCase
+
+from netcall.profiling import Profiler
+
+
+class ProfilerTest(TestCase):
+
+    def test_wrapped_call_never_run(self):
+        profiler = Profiler()
+        profiler.start(name='work', calls=1)
+
+        # e.g. an executor failed to take the wrapped call
+        lost = profiler.wrap('work', lambda: None)
+        self.assertIsNot(lost, None)
+
+        work = profiler.wrap('work', lambda x: x * 2)
+        self.assertEqual(work(21), 42)
+        self.assertEqual(profiler.last.profiled, 1)
+        self.assertTrue(profiler.last.done)
+
+    def test_one_call_at_a_time(self):
+        profiler = Profiler()
+        profiler.start(calls=2)
+
+        inner = profiler.wrap('inner', lambda: 'inner')
+        outer = profiler.wrap('outer', lambda: inner())
+        self.assertEqual(outer(), 'inner')  # the nested call runs unprofiled
+        self.assertEqual(profiler.last.profiled, 1)
+        self.assertEqual(profiler.wrap('next', lambda: 'next')(), 'next')
+        self.assertEqual(profiler.last.profiled, 2)
@@ -1,7 +1,12 @@
 # vim: fileencoding=utf-8 et ts=4 sts=4 sw=4 tw=0 fdm=marker fmr=#{,#}
 
-from netcall           import get_zmq_classes
+from time      import time, sleep
+from thread    import get_ident
+from threading import Thread, Event
+
+from netcall           import get_zmq_classes, RemoteRPCError, RPCTimeoutError, JSONSerializer
 from netcall.threading import ThreadPool, ThreadingRPCClient, ThreadingRPCService
+from netcall.tracing   import Tracer, trace
 
 from .base          import BaseCase
 from .client_mixins import ClientBindConnectMixIn
@@ -35,5 +40,245 @@ class ThreadingClientBindConnectTest(ClientBindConnectMixIn, ThreadingBase):
     pass
 
 class ThreadingRPCCallsTest(RPCCallsMixIn, ThreadingBase):
-    pass
 
+    def test_slow_requests_binary_route(self):
+        service = ThreadingRPCService(context=self.context, pool=self.pool, serializer=JSONSerializer())
+        client  = ThreadingRPCClient(context=self.context, pool=self.pool, serializer=JSONSerializer(),
+                                     identity=b'\x00\xff\x80id')
+        try:
+            service.slow_threshold = 0
+            service.register(lambda: 'ok', name='work')
+            service.bind(self.extra[0])
+            service.start()
+            client.connect(self.extra[0])
+
+            self.assertEqual(client.work(), 'ok')
+            sleep(0.1)
+            slow = client.call('_netcall.slow_requests', (1,), timeout=2)
+            self.assertEqual(slow[0]['route'], ['00ff806964'])
+        finally:
+            client.shutdown()
+            service.shutdown()
+
+    def test_function_single_flight(self):
+        calls   = []
+        release = Event()
+
+        @self.service.register(single_flight=True)
+        def slow(x):
+            calls.append(x)
+            release.wait(5)
+            return x * 2
+
+        self.service.start()
+
+        results = []
+        def call(x):
+            results.append(self.client.call('slow', (x,), timeout=5))
+
+        threads = [Thread(target=call, args=(x,)) for x in [21]*5 + [1]]
+        for t in threads:
+            t.start()
+        sleep(0.3)
+        release.set()
+        for t in threads:
+            t.join(5)
+
+        self.assertEqual(sorted(results), [2] + [42]*5)
+        self.assertEqual(sorted(calls), [1, 21])
+
+        # the flight is over
+        self.assertEqual(self.client.slow(21), 42)
+        self.assertEqual(len(calls), 3)
+
+
+    def test_function_max_concurrency(self):
+        release = Event()
+
+        @self.service.register(max_concurrency=1, max_queue=1)
+        def slow(x):
+            release.wait(5)
+            return x
+
+        @self.service.register
+        def fast():
+            return 'fast'
+
+        self.service.start()
+
+        results = []
+        def call(x):
+            try:
+                results.append(self.client.call('slow', (x,), timeout=5))
+            except RemoteRPCError, e:
+                results.append(e.ename)
+
+        threads = [Thread(target=call, args=(x,)) for x in range(3)]
+        for t in threads:
+            t.start()
+            sleep(0.1)
+
+        # the pool is not exhausted by the slow procedure
+        self.assertEqual(self.client.fast(), 'fast')
+        self.assertEqual(self.service.occupancy()['slow'], dict(
+            active=1, queued=1, rejected=1, max_concurrency=1, max_queue=1
+        ))
+
+        release.set()
+        for t in threads:
+            t.join(5)
+
+        self.assertEqual(results, ['RPCBusyError', 0, 1])
+        self.assertEqual(self.service.occupancy()['slow']['active'], 0)
+
+    def test_register_max_queue_only(self):
+        with self.assertRaises(ValueError):
+            self.service.register(lambda: None, name='dummy', max_queue=10)
+
+    def test_function_batch(self):
+        batches = []
+
+        @self.service.register(batch=True, max_batch=4, max_wait_ms=50)
+        def double(calls):
+            batches.append(len(calls))
+            return [ValueError(x) if x < 0 else x * 2 for (x,) in calls]
+
+        self.service.start()
+
+        results = {}
+        def call(x):
+            try:
+                results[x] = self.client.call('double', (x,), timeout=5)
+            except RemoteRPCError, e:
+                results[x] = e.ename
+
+        threads = [Thread(target=call, args=(x,)) for x in [0, 1, 2, 3, 4, -1]]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(5)
+
+        self.assertEqual(results, {0:0, 1:2, 2:4, 3:6, 4:8, -1:'ValueError'})
+        self.assertEqual(sum(batches), 6)
+        self.assertLessEqual(max(batches), 4)
+        self.assertLess(len(batches), 6)
+
+        with self.assertRaisesRegexp(RemoteRPCError, 'TypeError'):
+            self.client.double(x=1)
+
+    def test_call_later(self):
+        self.service.start()
+        sleep(0.1)
+
+        calls = []
+        done  = Event()
+        def later(started):
+            calls.append((time() - started, get_ident() == self.service._io_ident))
+            done.set()
+
+        # from a foreign thread the io_thread is woken up to run it
+        self.service._call_later(0.05, later, time())
+        self.assertTrue(done.wait(2))
+        elapsed, in_io_thread = calls[0]
+        self.assertTrue(0.04 < elapsed < 0.5, elapsed)
+        self.assertTrue(in_io_thread)
+
+    def test_function_inline_io_thread(self):
+        @self.service.register(inline=True)
+        def ident():
+            return get_ident()
+
+        self.service.start()
+
+        self.assertEqual(self.client.ident(), self.service._io_ident)
+
+    def test_drain(self):
+        release = Event()
+
+        @self.service.register
+        def slow():
+            release.wait(5)
+            return 'done'
+
+        self.service.start()
+
+        results = []
+        callers = [
+            Thread(target=lambda: results.append(self.client.slow())),
+            Thread(target=lambda: results.append(self.service.drain(5))),
+        ]
+        for t in callers:
+            t.start()
+            sleep(0.1)
+
+        # new requests are rejected while draining
+        with self.assertRaisesRegexp(RemoteRPCError, 'RPCBusyError'):
+            self.client.slow()
+
+        release.set()
+        for t in callers:
+            t.join(5)
+
+        self.assertEqual(sorted(results), [True, 'done'])
+
+    def test_client_metrics_timeout(self):
+        self.service.register(lambda t: sleep(t), name='sleep')
+        self.service.start()
+
+        with self.assertRaises(RPCTimeoutError):
+            self.client.call('sleep', (0.3,), timeout=0.1)
+        sleep(0.4)  # the late reply is an orphan
+
+        metrics = self.client.metrics.snapshot()
+        self.assertEqual(metrics['procedures']['sleep']['timeouts'], 1)
+        self.assertEqual(metrics['procedures']['sleep']['calls'], 0)
+        self.assertEqual(metrics['services'][self.service.service_id]['timeouts'], 1)
+        self.assertEqual(metrics['orphaned'], 1)
+        self.assertEqual(metrics['in_flight'], 0)
+
+    def test_tracing_nested(self):
+        tracer = Tracer()
+        self.service.add_middleware(tracer)
+
+        self.service.register(lambda: sleep(0.05), name='leaf')
+
+        @self.service.register
+        def root():
+            self.client.leaf()
+            self.client.leaf()
+
+        self.service.start()
+
+        with trace() as context:
+            self.client.root()
+
+        deadline = time() + 1
+        while len(tracer.get()) < 3 and time() < deadline:
+            sleep(0.01)
+
+        spans = dict((span['procedure'], span) for span in tracer.get(context.trace_id))
+        leaves = [span for span in tracer.get(context.trace_id) if span['procedure'] == 'leaf']
+        self.assertEqual(spans['root']['parent_id'], context.span_id)
+        self.assertEqual(len(leaves), 2)
+        for leaf in leaves:
+            self.assertEqual(leaf['parent_id'], spans['root']['span_id'])
+        self.assertGreaterEqual(spans['root']['phases']['execute'], 0.1)
+
+    def test_profile_sampling(self):
+        @self.service.register
+        def spin(seconds):
+            deadline = time() + seconds
+            while time() < deadline:
+                pass
+
+        self.service.start()
+
+        self.client.call('_netcall.profile.start', kwargs=dict(name='spin', seconds=5, mode='sampling', interval=0.001))
+        self.client.spin(0.2)
+        report = self.client.call('_netcall.profile.stop')
+
+        stacks = report.splitlines()
+        self.assertTrue(stacks)
+        for line in stacks:
+            self.assertTrue(line.startswith('spin (test_threading.py:'), line)
+            self.assertGreater(int(line.rsplit(' ', 1)[1]), 0)
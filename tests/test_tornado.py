@@ -0,0 +1,110 @@
+# vim: fileencoding=utf-8 et ts=4 sts=4 sw=4 tw=0 fdm=marker fmr=#{,#}
+
+from time      import time, sleep
+from threading import Thread
+
+from netcall           import RemoteRPCError
+from netcall.threading import ThreadPool, ThreadingRPCClient
+
+from .base import BaseCase
+
+
+class TornadoBase(BaseCase):
+
+    def setUp(self):
+        self.context = Context()
+        self.ioloop  = IOLoop()
+        self.pool    = ThreadPool(8)
+        self.client  = ThreadingRPCClient(context=self.context, pool=self.pool)
+        self.service = TornadoRPCService(context=self.context, ioloop=self.ioloop)
+
+        self.url = self.urls[0]
+        self.service.bind(self.url)
+        self.client.connect(self.url)
+
+        self.thread = Thread(target=self.service.serve)
+
+        super(TornadoBase, self).setUp()
+
+    def tearDown(self):
+        if self.thread.is_alive():
+            self.ioloop.add_callback(self.ioloop.stop)
+            self.thread.join()
+        self.client.shutdown()
+        self.service.shutdown()
+        self.ioloop.close(all_fds=True)
+        self.context.term()
+        self.pool.close()
+        self.pool.stop()
+        self.pool.join()
+
+        super(TornadoBase, self).tearDown()
+
+
+try:
+    from zmq                  import Context
+    from zmq.eventloop.ioloop import IOLoop
+    from tornado              import gen
+    from concurrent.futures   import ThreadPoolExecutor
+    from netcall.tornado      import TornadoRPCService
+
+    class TornadoRPCCallsTest(TornadoBase):
+
+        def test_function(self):
+            self.service.register(lambda s: s, name='echo')
+            self.thread.start()
+
+            self.assertEqual(self.client.echo('Hi'), 'Hi')
+
+        def test_coroutine(self):
+            @self.service.register
+            @gen.coroutine
+            def decorated(x):
+                yield gen.sleep(0.01)
+                raise gen.Return(x * 2)
+
+            @self.service.register
+            def generator(x):
+                yield gen.sleep(0.01)
+                raise gen.Return(x * 3)
+
+            self.thread.start()
+
+            self.assertEqual(self.client.decorated(7), 14)
+            self.assertEqual(self.client.generator(7), 21)
+
+        def test_executor(self):
+            executor = ThreadPoolExecutor(2)
+
+            @self.service.register(executor=executor)
+            def blocking(x):
+                sleep(0.5)
+                return x
+
+            @self.service.register(executor=executor)
+            def fail():
+                raise ValueError('oops')
+
+            self.service.register(lambda: 'cheap', name='cheap')
+            self.thread.start()
+
+            results = []
+            caller  = Thread(target=lambda: results.append(self.client.blocking(1)))
+            caller.start()
+            sleep(0.1)
+
+            # the loop is not stalled by the blocking procedure
+            start = time()
+            self.assertEqual(self.client.cheap(), 'cheap')
+            self.assertLess(time() - start, 0.3)
+
+            caller.join(5)
+            self.assertEqual(results, [1])
+
+            with self.assertRaisesRegexp(RemoteRPCError, 'ValueError'):
+                self.client.fail()
+
+            executor.shutdown()
+
+except ImportError:
+    pass
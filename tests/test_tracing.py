@@ -0,0 +1,54 @@
+# vim: fileencoding=utf-8 et ts=4 sts=4 sw=4 tw=0 fdm=marker fmr=#{,#}
+
+from unittest  import TestCase
+from threading import Thread
+
+from netcall.tracing import TraceContext, current_trace, set_trace, trace
+
+
+class TraceContextTest(TestCase):
+
+    def test_encode_decode(self):
+        context = TraceContext(sampled=False)
+        frame   = context.encode()
+        self.assertEqual(frame, b'00-%s-%s-00' % (context.trace_id, context.span_id))
+
+        decoded = TraceContext.decode(frame)
+        self.assertEqual((decoded.trace_id, decoded.span_id, decoded.sampled),
+                         (context.trace_id, context.span_id, False))
+
+        for frame in [b'', b'00-xyz-abc-01', b'00-%s-%s-01' % ('g'*32, 'a'*16)]:
+            self.assertIsNone(TraceContext.decode(frame))
+
+    def test_child(self):
+        parent = TraceContext()
+        child  = parent.child()
+        self.assertEqual(child.trace_id, parent.trace_id)
+        self.assertEqual(child.parent_id, parent.span_id)
+        self.assertNotEqual(child.span_id, parent.span_id)
+
+
+class TraceLocalTest(TestCase):
+
+    def test_trace(self):
+        self.assertIsNone(current_trace())
+        with trace() as outer:
+            self.assertIs(current_trace(), outer)
+            with trace(outer.child()) as inner:
+                self.assertIs(current_trace(), inner)
+            self.assertIs(current_trace(), outer)
+        self.assertIsNone(current_trace())
+
+    def test_thread_local(self):
+        seen = []
+        with trace():
+            thread = Thread(target=lambda: seen.append(current_trace()))
+            thread.start()
+            thread.join()
+        self.assertEqual(seen, [None])
+
+    def test_set_trace(self):
+        context = TraceContext()
+        self.assertIsNone(set_trace(context))
+        self.assertIs(set_trace(None), context)
+        self.assertIsNone(current_trace())